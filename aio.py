@@ -0,0 +1,110 @@
+"""
+Asyncio run mode.
+
+Updates are fetched with pyTelegramBotAPI's AsyncTeleBot and handed to
+the regular handlers in main.py. Handlers (SQLite + reply) run in a
+bounded thread pool so the event loop never blocks on them. Updates of
+one user are processed strictly in order, different users run side by
+side, so one slow chat only delays itself.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from telebot.async_telebot import AsyncTeleBot
+
+WORKERS = int(os.getenv("GYMBRO_ASYNC_WORKERS", "8"))
+MAX_PENDING = int(os.getenv("GYMBRO_ASYNC_MAX_PENDING", "1000"))
+
+
+def update_user_id(update):
+    """Key used for per-user ordering (falls back to update_id)."""
+    for event in (update.message, update.edited_message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return update.update_id
+
+
+class UserSerialDispatcher:
+    """
+    Runs `handle(update)` in `executor`, one update at a time per user.
+
+    Each user with pending updates has a small queue drained by its own
+    task; the task ends when the queue is empty, so idle users cost nothing.
+    """
+
+    def __init__(self, handle, executor, max_pending=MAX_PENDING):
+        self.handle = handle
+        self.executor = executor
+        self._queues = {}
+        self._pending = 0
+        self._room = asyncio.Semaphore(max_pending)
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    async def dispatch(self, update):
+        # backpressure: stop taking updates while too many are in flight
+        await self._room.acquire()
+        self._pending += 1
+        self._idle.clear()
+
+        key = update_user_id(update)
+        user_queue = self._queues.get(key)
+        if user_queue is None:
+            user_queue = self._queues[key] = asyncio.Queue()
+            asyncio.get_running_loop().create_task(self._drain(key, user_queue))
+        user_queue.put_nowait(update)
+
+    async def _drain(self, key, user_queue):
+        loop = asyncio.get_running_loop()
+        while not user_queue.empty():
+            update = user_queue.get_nowait()
+            try:
+                await loop.run_in_executor(self.executor, self.handle, update)
+            except Exception as e:
+                print(f"Ошибка при обработке апдейта {update.update_id}: {e}")
+            finally:
+                self._pending -= 1
+                self._room.release()
+        del self._queues[key]
+        if not self._pending:
+            self._idle.set()
+
+    async def join(self):
+        """Wait until every dispatched update has been handled."""
+        await self._idle.wait()
+
+    def stats(self):
+        return {"pending": self._pending, "active_users": len(self._queues)}
+
+
+async def poll(bot, token, workers=WORKERS, timeout=20):
+    """Long-poll Telegram with AsyncTeleBot and serve updates with `bot`'s handlers."""
+    # handlers must run inline in our executor, not in telebot's own pool
+    bot.threaded = False
+    client = AsyncTeleBot(token)
+    offset = None
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler") as executor:
+        dispatcher = UserSerialDispatcher(lambda u: bot.process_new_updates([u]), executor)
+        try:
+            while True:
+                try:
+                    updates = await client.get_updates(offset=offset, timeout=timeout)
+                except Exception as e:
+                    print(f"Ошибка getUpdates: {e}")
+                    await asyncio.sleep(1)
+                    continue
+                for update in updates:
+                    offset = update.update_id + 1
+                    await dispatcher.dispatch(update)
+        finally:
+            await dispatcher.join()
+            await client.close_session()
+
+
+def run(bot, token, workers=WORKERS):
+    try:
+        asyncio.run(poll(bot, token, workers=workers))
+    except KeyboardInterrupt:
+        pass
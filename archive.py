@@ -0,0 +1,256 @@
+"""
+Cold tier for old sessions.
+
+Sessions older than ARCHIVE_AFTER_DAYS move out of Sessions/Logs into
+SessionArchive: one row per exercise and calendar month (UTC), its
+sessions packed column by column (start times as deltas, set counts,
+reps, weights) and zlib-compressed. The newest KEEP_HOT sessions of an
+exercise always stay hot, whatever their age, so ExerciseSummary and its
+rebuild never need the archive; show_exercise_summary and the other
+recent-data screens read the hot tables only.
+
+Whole-history readers (stats.load, transfer.export_rows, records.rebuild,
+import dedupe) go through columns() / sessions() / exercise_sets() /
+archived() and see both tiers. unpack() hands out NumPy views of the
+decompressed blob; stats.load appends them to its arrays as they are,
+the others get Python tuples. Archived sessions have no session_id.
+
+archive_exercise() runs in one transaction (through writer.write);
+compaction.Compactor walks the exercises a batch at a time every
+ARCHIVE_INTERVAL seconds, `python manage.py archive` does it all at once.
+"""
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+
+import numpy as np
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("GYMBRO_ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_INTERVAL = float(os.getenv("GYMBRO_ARCHIVE_INTERVAL", str(24 * 3600)))
+ARCHIVE_BATCH = int(os.getenv("GYMBRO_ARCHIVE_BATCH", "100"))  # exercises per step
+KEEP_HOT = 2
+
+FORMAT = 1
+_HEADER = struct.Struct("<BII")  # format, sessions, sets
+
+
+def month_of(started_at):
+    moment = datetime.fromtimestamp(started_at, timezone.utc)
+    return moment.year * 100 + moment.month
+
+
+def cutoff(days=None, now=None):
+    """started_at below which sessions go cold."""
+    days = ARCHIVE_AFTER_DAYS if days is None else days
+    return int(now if now is not None else time.time()) - days * 86400
+
+
+def pack(sessions):
+    """[(started_at, [(reps, weight)])] sorted by time -> blob"""
+    times, counts, reps, weights = [], [], [], []
+    previous = 0
+    for started_at, sets in sessions:
+        times.append(started_at - previous)
+        previous = started_at
+        counts.append(len(sets))
+        for r, w in sets:
+            reps.append(r)
+            weights.append(w)
+    n, m = len(times), len(reps)
+    body = struct.pack(f"<{n}q{n}I{m}I{m}d", *times, *counts, *reps, *weights)
+    return _HEADER.pack(FORMAT, n, m) + zlib.compress(body, 9)
+
+
+def unpack(blob):
+    """blob -> (started_at, set counts) per session + (reps, weights) per set, as arrays"""
+    version, n, m = _HEADER.unpack_from(blob)
+    if version != FORMAT:
+        raise ValueError(f"unknown archive format {version}")
+    body = zlib.decompress(blob[_HEADER.size:])
+    times = np.cumsum(np.frombuffer(body, "<i8", n))
+    counts = np.frombuffer(body, "<u4", n, 8 * n)
+    reps = np.frombuffer(body, "<u4", m, 12 * n)
+    weights = np.frombuffer(body, "<f8", m, 12 * n + 4 * m)
+    return times, counts, reps, weights
+
+
+def _tuples(times, counts, reps, weights):
+    """unpack()'s arrays -> [(started_at, [(reps, weight)])]"""
+    sets = list(zip(reps.tolist(), weights.tolist()))
+    ends = np.cumsum(counts).tolist()
+    return [(started_at, sets[end - count:end])
+            for started_at, count, end in zip(times.tolist(), counts.tolist(), ends)]
+
+
+def _merge(old, new):
+    return sorted(old + new, key=lambda session: session[0])
+
+
+def archive_exercise(conn, exercise_id, before, keep=KEEP_HOT):
+    """
+    Move the exercise's sessions started before `before` (except the
+    newest `keep`) into SessionArchive. Runs inside the caller's
+    transaction. Returns (sessions, sets) moved.
+    """
+    newest = conn.execute(
+        "SELECT started_at, session_id FROM Sessions WHERE exercise_id = ? "
+        "ORDER BY started_at DESC, session_id DESC LIMIT 1 OFFSET ?",
+        (exercise_id, keep - 1)
+    ).fetchone()
+    if newest is None:
+        return 0, 0
+    # strictly older than the newest `keep` and than `before`
+    bound = (min(newest[0], before), newest[1] if newest[0] < before else -1)
+    rows = conn.execute(
+        "SELECT s.session_id, s.started_at, l.reps, l.weight "
+        "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+        "WHERE s.exercise_id = ? AND (s.started_at < ? OR s.started_at = ? AND s.session_id < ?) "
+        "ORDER BY s.started_at, s.session_id, l.log_id",
+        (exercise_id, bound[0], bound[0], bound[1])
+    ).fetchall()
+    if not rows:
+        return 0, 0
+
+    by_month = {}
+    session_ids = []
+    for session_id, started_at, reps, weight in rows:
+        if not session_ids or session_ids[-1] != session_id:
+            session_ids.append(session_id)
+            by_month.setdefault(month_of(started_at), []).append((started_at, []))
+        by_month[month_of(started_at)][-1][1].append((reps, weight))
+
+    for month, sessions in by_month.items():
+        found = conn.execute(
+            "SELECT data FROM SessionArchive WHERE exercise_id = ? AND month = ?",
+            (exercise_id, month)
+        ).fetchone()
+        if found:
+            sessions = _merge(_tuples(*unpack(found[0])), sessions)
+        conn.execute(
+            "INSERT OR REPLACE INTO SessionArchive "
+            "(exercise_id, month, first_at, last_at, sessions, sets, data) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (exercise_id, month, sessions[0][0], sessions[-1][0], len(sessions),
+             sum(len(sets) for _, sets in sessions), pack(sessions))
+        )
+    # Logs go with them (ON DELETE CASCADE)
+    conn.execute(
+        "DELETE FROM Sessions WHERE exercise_id = ? "
+        "AND (started_at < ? OR started_at = ? AND session_id < ?)",
+        (exercise_id, bound[0], bound[0], bound[1])
+    )
+    return len(session_ids), len(rows)
+
+
+def candidates(conn, after, before, limit=ARCHIVE_BATCH, keep=KEEP_HOT):
+    """
+    Ids of up to `limit` exercises past `after` that have something to
+    archive: a session older than `before` and more than `keep` sessions.
+    Returns (ids, last exercise id looked at or None at the end).
+    """
+    ids = [row[0] for row in conn.execute(
+        "SELECT exercise_id FROM Exercises WHERE exercise_id > ? "
+        "ORDER BY exercise_id LIMIT ?",
+        (after, limit)
+    )]
+    if not ids:
+        return [], None
+    found = [exercise_id for exercise_id in ids if conn.execute(
+        "SELECT 1 FROM Sessions WHERE exercise_id = ? AND started_at < ? AND EXISTS ("
+        "SELECT 1 FROM Sessions WHERE exercise_id = ? ORDER BY started_at DESC "
+        "LIMIT 1 OFFSET ?) LIMIT 1",
+        (exercise_id, before, exercise_id, keep)
+    ).fetchone()]
+    return found, ids[-1]
+
+
+def archive_all(conn, write, before, batch_size=ARCHIVE_BATCH):
+    """Archive every exercise (manage.py archive). `conn` only reads. Returns (sessions, sets)."""
+    total_sessions = total_sets = 0
+    after = 0
+    while after is not None:
+        ids, after = candidates(conn, after, before, batch_size)
+        conn.commit()  # no read snapshot held while the writer works
+        for exercise_id in ids:
+            sessions, sets = write(archive_exercise, exercise_id, before, rows=batch_size)
+            total_sessions += sessions
+            total_sets += sets
+    return total_sessions, total_sets
+
+
+# --- reading both tiers ---
+
+def _chunks(conn, exercise_ids):
+    placeholders = ",".join("?" * len(exercise_ids))
+    return conn.execute(
+        "SELECT exercise_id, data FROM SessionArchive "
+        f"WHERE exercise_id IN ({placeholders}) ORDER BY exercise_id, month",
+        list(exercise_ids)
+    )
+
+
+def columns(conn, exercise_ids):
+    """
+    The archived sets as arrays (exercise_id, session, started_at, reps,
+    weight), sorted by exercise and time; sessions are numbered -1, -2, ...
+    None when nothing is archived.
+    """
+    parts = []
+    sessions_seen = 0
+    for exercise_id, data in _chunks(conn, exercise_ids):
+        times, counts, reps, weights = unpack(data)
+        numbers = -1 - sessions_seen - np.arange(len(times))
+        sessions_seen += len(times)
+        parts.append((np.full(len(reps), exercise_id, np.int64), np.repeat(numbers, counts),
+                      np.repeat(times, counts), reps, weights))
+    if not parts:
+        return None
+    return tuple(np.concatenate(column) for column in zip(*parts))
+
+
+def sessions(conn, exercise_ids):
+    """{exercise_id: [(started_at, [(reps, weight)])]} of the archived sessions, oldest first."""
+    result = {}
+    for exercise_id, data in _chunks(conn, exercise_ids):
+        result.setdefault(exercise_id, []).extend(_tuples(*unpack(data)))
+    return result
+
+
+def exercise_sets(conn, exercise_id):
+    """[(started_at, reps, weight)] of one exercise's archived sets, oldest first."""
+    return [(started_at, reps, weight)
+            for started_at, sets in sessions(conn, [exercise_id]).get(exercise_id, ())
+            for reps, weight in sets]
+
+
+def archived(conn, sessions, batch=400):
+    """The (exercise_id, started_at) pairs of `sessions` that are in the archive."""
+    wanted = {}
+    for exercise_id, started_at in sessions:
+        wanted.setdefault((exercise_id, month_of(started_at)), set()).add(started_at)
+    keys = list(wanted)
+    found = set()
+    for i in range(0, len(keys), batch):
+        part = keys[i:i + batch]
+        for exercise_id, month, data in conn.execute(
+                "WITH wanted (exercise_id, month) AS (VALUES "
+                + ",".join(["(?, ?)"] * len(part)) + ") "
+                "SELECT a.exercise_id, a.month, a.data FROM wanted w "
+                "JOIN SessionArchive a ON a.exercise_id = w.exercise_id AND a.month = w.month",
+                [value for key in part for value in key]):
+            times = wanted[(exercise_id, month)]
+            found.update((exercise_id, started_at) for started_at in unpack(data)[0].tolist()
+                         if started_at in times)
+    return found
+
+
+def totals(conn):
+    """Size of the cold tier for metrics."""
+    chunks, archived_sessions, archived_sets, size = conn.execute(
+        "SELECT count(*), coalesce(sum(sessions), 0), coalesce(sum(sets), 0), "
+        "coalesce(sum(length(data)), 0) FROM SessionArchive"
+    ).fetchone()
+    return {"chunks": chunks, "sessions": archived_sessions, "sets": archived_sets,
+            "bytes": size}
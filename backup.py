@@ -0,0 +1,310 @@
+"""
+Online backups of workouts.db.
+
+The Backup thread copies the live db into BACKUP_DIR every INTERVAL
+seconds with SQLite's online backup API (Connection.backup): PAGES pages
+per step and PAUSE_MS between steps, on its own connection, so handlers
+keep reading and writing while it runs. The whole copy reads one
+snapshot - a read transaction stays open for the run (in WAL mode writers
+go on, the WAL just can't be checkpointed past it meanwhile); without it
+every commit from another connection would restart the copy from page 1.
+
+A copy is written to a .tmp file, checked with PRAGMA quick_check,
+switched to journal_mode=DELETE (one self-contained file) and renamed to
+<db name>-YYYYmmdd-HHMMSS.db, so a snapshot on disk is always complete.
+Shards back up their own files. After every backup only the KEEP newest
+snapshots and the newest one of each of the last KEEP_DAYS days are kept.
+
+    python manage.py backup       # one now, the bot may be running
+    python manage.py backups      # list
+    python manage.py restore --latest   # bot stopped
+
+restore() checks the snapshot (integrity_check, foreign_key_check,
+schema version), saves the current db as one more snapshot and copies the
+snapshot over it.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db
+
+ENABLED = os.getenv("GYMBRO_BACKUP", "1") == "1"
+BACKUP_DIR = os.getenv("GYMBRO_BACKUP_DIR")  # default: backups/ next to the db
+INTERVAL = float(os.getenv("GYMBRO_BACKUP_INTERVAL", str(6 * 3600)))
+PAGES = int(os.getenv("GYMBRO_BACKUP_PAGES", "256"))  # per step, 1MB with 4K pages
+PAUSE_MS = float(os.getenv("GYMBRO_BACKUP_PAUSE_MS", "10"))
+KEEP = int(os.getenv("GYMBRO_BACKUP_KEEP", "4"))
+KEEP_DAYS = int(os.getenv("GYMBRO_BACKUP_KEEP_DAYS", "7"))
+
+_STAMP = "%Y%m%d-%H%M%S"
+
+
+class BackupCancelled(Exception):
+    """The backup was stopped halfway (shutdown), nothing was kept."""
+
+
+def backup_dir(db_path, directory=None):
+    directory = directory or BACKUP_DIR
+    return directory or os.path.join(os.path.dirname(os.path.abspath(db_path)), "backups")
+
+
+def _stem(db_path):
+    return os.path.splitext(os.path.basename(db_path))[0]
+
+
+def snapshots(db_path, directory=None):
+    """[(path, taken at)] of a db's snapshots, newest first."""
+    directory = backup_dir(db_path, directory)
+    if not os.path.isdir(directory):
+        return []
+    pattern = re.compile(re.escape(_stem(db_path)) + r"-(\d{8}-\d{6})\.db")
+    found = []
+    for name in os.listdir(directory):
+        match = pattern.fullmatch(name)
+        if match:
+            found.append((os.path.join(directory, name),
+                          datetime.strptime(match.group(1), _STAMP)))
+    return sorted(found, key=lambda snapshot: snapshot[1], reverse=True)
+
+
+def take(db_path, directory=None, pages=PAGES, pause=PAUSE_MS / 1000, should_stop=None):
+    """
+    Copy `db_path` into a new snapshot. Returns {"path", "size",
+    "seconds", "steps"}; raises BackupCancelled when `should_stop()`
+    turns true halfway, sqlite3.DatabaseError when the copy is bad.
+    """
+    directory = backup_dir(db_path, directory)
+    os.makedirs(directory, exist_ok=True)
+    moment = datetime.now()
+    path = os.path.join(directory, f"{_stem(db_path)}-{moment.strftime(_STAMP)}.db")
+    while os.path.exists(path):
+        # two in the same second
+        moment += timedelta(seconds=1)
+        path = os.path.join(directory, f"{_stem(db_path)}-{moment.strftime(_STAMP)}.db")
+    tmp_path = path + ".tmp"
+    started = time.perf_counter()
+    steps = [0]
+
+    def progress(status, remaining, total):
+        steps[0] += 1
+        if should_stop is not None and should_stop():
+            raise BackupCancelled()
+        if remaining and pause:
+            time.sleep(pause)
+
+    src = sqlite3.connect(db_path, isolation_level=None, check_same_thread=False)
+    dst = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        src.execute("PRAGMA busy_timeout=5000")
+        # one read transaction for the whole copy: a consistent snapshot
+        src.execute("BEGIN")
+        src.execute("SELECT count(*) FROM sqlite_master").fetchone()
+        try:
+            src.backup(dst, pages=pages, progress=progress)
+        finally:
+            src.execute("COMMIT")
+        problems = dst.execute("PRAGMA quick_check").fetchall()
+        if problems != [("ok",)]:
+            raise sqlite3.DatabaseError(f"snapshot failed quick_check: {problems[:10]}")
+        dst.execute("PRAGMA journal_mode=DELETE")
+        dst.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        dst.close()
+        for leftover in (tmp_path, tmp_path + "-wal", tmp_path + "-shm"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    finally:
+        src.close()
+    return {"path": path, "size": os.path.getsize(path),
+            "seconds": time.perf_counter() - started, "steps": steps[0]}
+
+
+def prune(db_path, directory=None, keep=KEEP, keep_days=KEEP_DAYS, now=None):
+    """Delete the snapshots the retention policy doesn't keep. Returns their paths."""
+    found = snapshots(db_path, directory)
+    today = (now or datetime.now()).date()
+    kept = {path for path, _ in found[:keep]}
+    days = set()
+    for path, taken in found:
+        if (today - taken.date()).days < keep_days and taken.date() not in days:
+            days.add(taken.date())
+            kept.add(path)
+    removed = []
+    for path, _ in found:
+        if path not in kept:
+            os.remove(path)
+            removed.append(path)
+    return removed
+
+
+def check(path):
+    """Problems of a snapshot, empty when it can be restored."""
+    import migrations
+
+    if not os.path.exists(path):
+        return [f"{path}: no such file"]
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        problems = [row[0] for row in conn.execute("PRAGMA integrity_check")
+                    if row[0] != "ok"]
+        problems += [f"foreign key: {row}" for row in conn.execute("PRAGMA foreign_key_check")]
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > migrations.LATEST_VERSION:
+            problems.append(f"schema version {version} is newer than this code "
+                            f"({migrations.LATEST_VERSION})")
+    except sqlite3.DatabaseError as e:
+        problems = [str(e)]
+    finally:
+        conn.close()
+    return problems
+
+
+def restore(path, db_path, directory=None):
+    """
+    Replace `db_path` with the snapshot at `path`, the bot must be stopped.
+    Returns the snapshot the current db was saved to (None when there was
+    no db). Raises ValueError when the snapshot doesn't pass check().
+    """
+    problems = check(path)
+    if problems:
+        raise ValueError(f"{path} can't be restored: " + "; ".join(map(str, problems[:10])))
+    saved = None
+    if os.path.exists(db_path):
+        saved = take(db_path, directory, pages=-1, pause=0)["path"]
+
+    src = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    dst = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        # through the backup API, so a -wal next to the old db can't mix in
+        src.backup(dst)
+        dst.execute("PRAGMA journal_mode=WAL")
+        problems = dst.execute("PRAGMA integrity_check").fetchall()
+        if problems != [("ok",)]:
+            raise sqlite3.DatabaseError(f"restored db failed integrity_check: {problems[:10]}")
+    finally:
+        src.close()
+        dst.close()
+    return saved
+
+
+class Backup:
+    """
+    Background snapshots of the db every `interval` seconds (counted from
+    the newest snapshot on disk, so restarts don't take extra ones), pruned
+    after each.
+    """
+
+    def __init__(self, path=None, directory=None, interval=INTERVAL, pages=PAGES,
+                 pause=PAUSE_MS / 1000, keep=KEEP, keep_days=KEEP_DAYS):
+        self._db_path = path
+        self.directory = directory
+        self.interval = interval
+        self.pages = pages
+        self.pause = pause
+        self.keep = keep
+        self.keep_days = keep_days
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # stats
+        self._backups = 0
+        self._failures = 0
+        self._pruned = 0
+        self._seconds = 0.0
+        self._max_seconds = 0.0
+        self._last = None
+
+    @property
+    def path(self):
+        # shard workers repoint db.DB_PATH before they start us
+        return self._db_path or db.DB_PATH
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="db-backup", daemon=True)
+                self._thread.start()
+        return self
+
+    def close(self, timeout=10.0):
+        """Stop; a backup halfway through is abandoned."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def run_once(self):
+        """Take a snapshot and prune. Returns take()'s result."""
+        try:
+            result = take(self.path, self.directory, self.pages, self.pause,
+                          should_stop=self._stop.is_set)
+        except BackupCancelled:
+            raise
+        except Exception:
+            with self._lock:
+                self._failures += 1
+            raise
+        removed = prune(self.path, self.directory, self.keep, self.keep_days)
+        with self._lock:
+            self._backups += 1
+            self._pruned += len(removed)
+            self._seconds += result["seconds"]
+            self._max_seconds = max(self._max_seconds, result["seconds"])
+            self._last = dict(result, at=time.time())
+        return result
+
+    def _next_due(self):
+        found = snapshots(self.path, self.directory)
+        if not found:
+            return time.time()
+        return found[0][1].timestamp() + self.interval
+
+    def _run(self):
+        due = self._next_due()
+        while not self._stop.wait(max(0.0, due - time.time())):
+            try:
+                self.run_once()
+            except BackupCancelled:
+                return
+            except Exception as e:
+                print(f"Ошибка бэкапа: {e}")
+            due = time.time() + self.interval
+
+    def stats(self):
+        count = len(snapshots(self.path, self.directory))
+        with self._lock:
+            backups = self._backups
+            last = self._last or {}
+            return {
+                "backups": backups,
+                "failures": self._failures,
+                "pruned": self._pruned,
+                "avg_seconds": self._seconds / backups if backups else 0.0,
+                "max_seconds": self._max_seconds,
+                "last_seconds": last.get("seconds", 0.0),
+                "last_size": last.get("size", 0),
+                "last_at": last.get("at"),
+                "snapshots": count,
+            }
+
+
+backups = Backup() if ENABLED else None
+
+
+def start():
+    if backups is not None:
+        backups.start()
+
+
+def stop():
+    if backups is not None:
+        backups.close()
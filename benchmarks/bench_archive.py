@@ -0,0 +1,173 @@
+"""
+Hot/cold tiering (archive.py): db size and query latency before and
+after the sessions older than --days move to SessionArchive.
+
+--users users with --exercises exercises each, --per-week sessions a
+week for --years years, 4 sets a session. The seeded db is copied, one
+copy archived, both VACUUMed, then the same queries are timed on each:
+
+- summary: show_exercise_summary (ExerciseSummary, hot only either way)
+- recent:  last 90 days of an exercise's sessions + sets (hot only)
+- save:    logbook.record_sets + commit
+- stats:   stats.load of one exercise, whole history (both tiers after)
+- export:  transfer.export_rows of one user, whole history
+
+    python benchmarks/bench_archive.py --users 100 --years 3
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SETS = 4
+
+
+def seed(conn, args, now):
+    rng = random.Random(1)
+    weeks = int(args.years * 52)
+    for user_id in range(1, args.users + 1):
+        day_id = conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)",
+                              (user_id, "День")).lastrowid
+        for e in range(args.exercises):
+            exercise_id = conn.execute(
+                "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                (day_id, f"Упражнение {e}")).lastrowid
+            weight = rng.uniform(40, 100)
+            for week in range(weeks):
+                for k in range(args.per_week):
+                    started_at = now - (weeks - week) * 7 * 86400 + k * 2 * 86400
+                    session_id = conn.execute(
+                        "INSERT INTO Sessions (exercise_id, started_at) VALUES (?, ?)",
+                        (exercise_id, started_at)).lastrowid
+                    weight += rng.uniform(-1, 1.2)
+                    conn.executemany(
+                        "INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)",
+                        [(session_id, rng.choice((5, 8, 10)), round(weight * 2) / 2)
+                         for _ in range(SETS)])
+        conn.commit()
+
+
+def timed(func, ids, rounds):
+    times = []
+    for i in range(rounds):
+        started = time.perf_counter()
+        func(ids[i % len(ids)])
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+def measure(path, args, now):
+    import logbook
+    import stats
+    import transfer
+
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    size = os.path.getsize(path)
+    hot = conn.execute("SELECT count(*) FROM Logs").fetchone()[0]
+    exercise_ids = [row[0] for row in conn.execute("SELECT exercise_id FROM Exercises")]
+    random.Random(2).shuffle(exercise_ids)
+    user_ids = list(range(1, args.users + 1))
+
+    def summary(exercise_id):
+        conn.execute(
+            "SELECT e.exercise_name, e.day_id, s.last_at, s.last_reps, s.last_weights, "
+            "s.prev_at, s.prev_reps, s.prev_weights FROM Exercises e "
+            "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+            "LEFT JOIN ExerciseSummary s ON s.exercise_id = e.exercise_id "
+            "WHERE e.exercise_id = ?", (exercise_id,)).fetchone()
+
+    def recent(exercise_id):
+        conn.execute(
+            "SELECT s.started_at, l.reps, l.weight FROM Sessions s "
+            "JOIN Logs l ON l.session_id = s.session_id "
+            "WHERE s.exercise_id = ? AND s.started_at >= ? ORDER BY s.started_at",
+            (exercise_id, now - 90 * 86400)).fetchall()
+
+    def save(exercise_id):
+        logbook.record_sets(conn, exercise_id, [(5, 100.0)] * SETS)
+        conn.commit()
+
+    def history(exercise_id):
+        stats.load(conn, [exercise_id])
+
+    def export(user_id):
+        for _ in transfer.export_rows(conn, user_id):
+            pass
+
+    result = {
+        "size_mb": size / 2 ** 20,
+        "hot_sets": hot,
+        "summary": timed(summary, exercise_ids, args.rounds),
+        "recent": timed(recent, exercise_ids, args.rounds),
+        "stats": timed(history, exercise_ids, args.rounds),
+        "export": timed(export, user_ids, max(1, args.rounds // 10)),
+        "save": timed(save, exercise_ids, args.rounds),
+    }
+    conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--exercises", type=int, default=4)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--per-week", type=int, default=3)
+    parser.add_argument("--days", type=int, default=180, help="archive sessions older than this")
+    parser.add_argument("--rounds", type=int, default=300)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    seeded = os.path.join(tmp, "seed.db")
+    os.environ["GYMBRO_DB"] = seeded
+    now = int(time.time())
+
+    import archive
+    import db
+    import logbook
+    import migrations
+
+    started = time.perf_counter()
+    with db.connection() as conn:
+        migrations.migrate(conn)
+        seed(conn, args, now)
+        logbook.rebuild_summaries(conn)
+    db.pool.close()
+    print(f"seeded in {time.perf_counter() - started:.0f}s")
+
+    results = {}
+    for label in ("hot only", "archived"):
+        path = os.path.join(tmp, label.replace(" ", "-") + ".db")
+        shutil.copyfile(seeded, path)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA foreign_keys = ON")
+        if label == "archived":
+            def write(func, *a, rows=1):
+                result = func(conn, *a)
+                conn.commit()
+                return result
+            started = time.perf_counter()
+            sessions, sets = archive.archive_all(conn, write, archive.cutoff(args.days, now))
+            print(f"archived {sessions} sessions ({sets} sets) in "
+                  f"{time.perf_counter() - started:.1f}s, cold tier: {archive.totals(conn)}")
+        conn.execute("VACUUM")
+        conn.close()
+        results[label] = measure(path, args, now)
+
+    print(f"{'':10} {'db MB':>7} {'hot sets':>9} {'summary':>9} {'recent':>8} "
+          f"{'stats':>8} {'export':>8} {'save':>8}   (p50 ms)")
+    for label, r in results.items():
+        print(f"{label:10} {r['size_mb']:>7.1f} {r['hot_sets']:>9} {r['summary']:>9.3f} "
+              f"{r['recent']:>8.3f} {r['stats']:>8.2f} {r['export']:>8.1f} {r['save']:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
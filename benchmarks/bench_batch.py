@@ -0,0 +1,111 @@
+"""
+Logging a whole workout: one exercise per message (tap the exercise,
+send `3 80 85 90`, repeat) against every exercise in one multi-line
+message (parser.py).
+
+Runs through the real handlers against fakeapi.py (outbox off, so every
+reply is a blocking Bot API call); --api-latency adds a network round
+trip to each call. Reports per workout: updates the user sends, Bot API
+calls, write transactions and wall time.
+
+    python benchmarks/bench_batch.py --exercises 6 --rounds 20 --api-latency 0.05
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+USER = 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--exercises", type=int, default=6)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds the fake Bot API waits before answering")
+    args = parser.parse_args()
+
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCH"
+    os.environ["GYMBRO_DB"] = os.path.join(tempfile.mkdtemp(), "batch.db")
+    os.environ["GYMBRO_OUTBOX"] = "0"
+
+    import fakeapi
+    api = fakeapi.FakeTelegramAPI(latency=args.api_latency).start()
+    fakeapi.use(api.url)
+
+    import callbacks
+    import db
+    import main as bot_main
+    import writer
+    from telebot import types
+    bot_main.init_db()
+    bot_main.bot.threaded = False
+
+    update_ids = iter(range(1, 10 ** 9))
+
+    def send(text):
+        bot_main.bot.process_new_updates([types.Update.de_json({
+            "update_id": next(update_ids),
+            "message": {"message_id": 1, "from": {"id": USER, "is_bot": False, "first_name": "u"},
+                        "chat": {"id": USER, "type": "private"}, "date": 0, "text": text}})])
+
+    def tap(action, *ids):
+        bot_main.bot.process_new_updates([types.Update.de_json({
+            "update_id": next(update_ids),
+            "callback_query": {"id": "1", "from": {"id": USER, "is_bot": False, "first_name": "u"},
+                               "chat_instance": "x", "data": callbacks.encode(action, *ids),
+                               "message": {"message_id": 1, "date": 0, "text": "x",
+                                           "chat": {"id": USER, "type": "private"}}}})])
+
+    writes = [0]
+    real_write = writer.write
+
+    def counted_write(func, *a, **kw):
+        writes[0] += 1
+        return real_write(func, *a, **kw)
+    writer.write = counted_write
+
+    send("➕ Добавить день")
+    send("Тренировка")
+    with db.connection() as conn:
+        day_id = conn.execute("SELECT day_id FROM TrainingDays WHERE user_id = ?",
+                              (USER,)).fetchone()[0]
+    names = [f"Упражнение{i}" for i in range(args.exercises)]
+    tap("add_ex", day_id)
+    send("\n".join(f"{name} 3 80" for name in names))
+    with db.connection() as conn:
+        ids = [conn.execute("SELECT exercise_id FROM Exercises WHERE exercise_name = ?",
+                            (name,)).fetchone()[0] for name in names]
+
+    def one_by_one():
+        for exercise_id in ids:
+            tap("log_new", exercise_id)
+            send("3 80 85 90")
+
+    def batched():
+        tap("log_new", ids[0])
+        send("\n".join(["3x80 3x85 3x90"] + [f"{name} 3x80 3x85 3x90" for name in names[1:]]))
+
+    print(f"{args.exercises} exercises, api latency {args.api_latency * 1000:.0f}ms")
+    print(f"{'':12} {'updates':>8} {'api calls':>10} {'writes':>7} {'ms':>9}")
+    for label, workout, updates in (("one by one", one_by_one, 2 * len(ids)),
+                                    ("one message", batched, 2)):
+        calls = api.calls_total()
+        writes[0] = 0
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            workout()
+        elapsed = (time.perf_counter() - started) / args.rounds
+        print(f"{label:12} {updates:>8} {(api.calls_total() - calls) / args.rounds:>10.0f} "
+              f"{writes[0] / args.rounds:>7.0f} {elapsed * 1000:>9.2f}")
+
+    bot_main.shutdown()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Callback dispatch: the old chain of callback_query_handler(startswith)
+lambdas + split('_') against one handler + callbacks.Router, as the
+number of actions grows.
+
+Both run through a real TeleBot (threaded=False), process_new_callback_query
+with one CallbackQuery, handlers that only take their ids. "first" is a
+button of the first registered action, "last" of the last one (the worst
+case for the chain); "forged" is a payload with a bad tag.
+
+    python benchmarks/bench_callbacks.py --actions 5 10 20 50
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot import TeleBot, types
+
+import callbacks
+
+
+def make_call(data):
+    return types.CallbackQuery.de_json({
+        "id": "1", "from": {"id": 1, "is_bot": False, "first_name": "u"},
+        "chat_instance": "x", "data": data,
+        "message": {"message_id": 5, "chat": {"id": 1, "type": "private"}, "date": 0,
+                    "text": "x"}})
+
+
+def chain_bot(names):
+    bot = TeleBot("123456:BENCH", threaded=False)
+    for name in names:
+        prefix = f"{name}_"
+
+        # default argument: each lambda keeps its own prefix
+        @bot.callback_query_handler(func=lambda call, prefix=prefix: call.data.startswith(prefix))
+        def handler(call):
+            return int(call.data.split('_')[-1])
+    return bot
+
+
+def router_bot(names):
+    router = callbacks.Router({name: (code, 1) for code, name in enumerate(names, 1)},
+                              secret="bench")
+    for name in names:
+        router.route(name)(lambda call, object_id: object_id)
+    bot = TeleBot("123456:BENCH", threaded=False)
+
+    @bot.callback_query_handler(func=lambda call: True)
+    def handle_callback(call):
+        route = router.decode(call.data)
+        if route is None:
+            return
+        action, ids = route
+        action.handler(call, *ids)
+    return bot, router
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--actions", type=int, nargs="+", default=[5, 10, 20, 50])
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'actions':>7} {'button':>7} {'chain us':>9} {'router us':>10}")
+    for count in args.actions:
+        names = [f"action{i}" for i in range(count)]
+        chain = chain_bot(names)
+        routed, router = router_bot(names)
+        forged = router.encode(names[-1], 42)
+        forged = forged[:-2] + ("AA" if forged[-2:] != "AA" else "BA")
+        cases = [
+            ("first", make_call(f"{names[0]}_42"), make_call(router.encode(names[0], 42))),
+            ("last", make_call(f"{names[-1]}_42"), make_call(router.encode(names[-1], 42))),
+            ("forged", None, make_call(forged)),
+        ]
+        for label, old_call, new_call in cases:
+            old = "-"
+            if old_call is not None:
+                seconds = timeit.timeit(lambda: chain.process_new_callback_query([old_call]),
+                                        number=args.rounds)
+                old = f"{seconds / args.rounds * 1e6:.2f}"
+            seconds = timeit.timeit(lambda: routed.process_new_callback_query([new_call]),
+                                    number=args.rounds)
+            print(f"{count:>7} {label:>7} {old:>9} {seconds / args.rounds * 1e6:>10.2f}")
+
+    # the real action table, ids as big as a sharded db hands out
+    router = callbacks.Router(callbacks.ACTIONS, secret="bench")
+    router.route("days_page")(lambda call, kind, after: None)
+    data = router.encode("days_page", 3, 1 << 43)
+    seconds = timeit.timeit(lambda: router.decode(data), number=args.rounds)
+    print(f"\ndecode alone: {seconds / args.rounds * 1e6:.2f} us, "
+          f"payload with two ids: {len(data)} chars")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Deleting a day with a long history: the old hard delete on the request
+path against soft delete + background compaction.
+
+One day with --sessions sessions (4 sets each) spread over 4 exercises,
+and another user saving a session every few ms on a separate thread the
+whole time. For each way: how long the tap takes, how long the whole
+purge takes, and the saver's p50 / max latency (how long the write lock
+kept it waiting).
+
+    python benchmarks/bench_delete.py --sessions 50000
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def old_delete(conn, day_id):
+    # process_day_deletion before soft deletes
+    exercise_ids = [row[0] for row in conn.execute(
+        "SELECT exercise_id FROM Exercises WHERE day_id = ?", (day_id,))]
+    placeholders = ",".join("?" * len(exercise_ids))
+    conn.execute("DELETE FROM Logs WHERE session_id IN (SELECT session_id FROM "
+                 f"Sessions WHERE exercise_id IN ({placeholders}))", exercise_ids)
+    conn.execute(f"DELETE FROM Sessions WHERE exercise_id IN ({placeholders})", exercise_ids)
+    conn.execute(f"DELETE FROM ExerciseSummary WHERE exercise_id IN ({placeholders})",
+                 exercise_ids)
+    conn.execute(f"DELETE FROM PersonalRecords WHERE exercise_id IN ({placeholders})",
+                 exercise_ids)
+    conn.execute("DELETE FROM Exercises WHERE day_id = ?", (day_id,))
+    conn.execute("DELETE FROM TrainingDays WHERE day_id = ?", (day_id,))
+    conn.commit()
+
+
+class Saver(threading.Thread):
+    """Another user logging a session every `every` seconds."""
+
+    def __init__(self, path, exercise_id, every=0.005):
+        super().__init__(daemon=True)
+        self.path = path
+        self.exercise_id = exercise_id
+        self.every = every
+        self.latencies = []
+        self.done = threading.Event()
+
+    def run(self):
+        import db
+        import logbook
+
+        pool = db.ConnectionPool(self.path, max_size=1)
+        with pool.connection() as conn:
+            while not self.done.is_set():
+                started = time.perf_counter()
+                logbook.record_sets(conn, self.exercise_id, [(5, 100.0)] * 3)
+                conn.commit()
+                self.latencies.append(time.perf_counter() - started)
+                time.sleep(self.every)
+        pool.close()
+
+    def report(self):
+        times = sorted(self.latencies)
+        return (f"saves {len(times)}, p50 {times[len(times) // 2] * 1000:.2f}ms, "
+                f"max {times[-1] * 1000:.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=50000)
+    parser.add_argument("--batch", type=int, default=200, help="sessions per purge batch")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    seeded = os.path.join(tmp, "seed.db")
+    os.environ["GYMBRO_DB"] = seeded
+
+    import compaction
+    import db
+    import migrations
+
+    with db.connection() as conn:
+        migrations.migrate(conn)
+        day_id = conn.execute(
+            "INSERT INTO TrainingDays (user_id, day_name) VALUES (1, 'big')").lastrowid
+        other_day = conn.execute(
+            "INSERT INTO TrainingDays (user_id, day_name) VALUES (2, 'other')").lastrowid
+        saver_exercise = conn.execute(
+            "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, 'saver')",
+            (other_day,)).lastrowid
+        for i in range(4):
+            exercise_id = conn.execute(
+                "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                (day_id, f"ex{i}")).lastrowid
+            for at in range(args.sessions // 4):
+                session_id = conn.execute(
+                    "INSERT INTO Sessions (exercise_id, started_at) VALUES (?, ?)",
+                    (exercise_id, at * 86400)).lastrowid
+                conn.executemany("INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)",
+                                 [(session_id, 5, 100.0)] * 4)
+        conn.commit()
+    db.pool.close()
+
+    for label in ("hard delete", "soft delete"):
+        path = os.path.join(tmp, label.replace(" ", "-") + ".db")
+        shutil.copyfile(seeded, path)
+        pool = db.ConnectionPool(path, max_size=2)
+        saver = Saver(path, saver_exercise)
+        saver.start()
+        time.sleep(0.2)
+
+        with pool.connection() as conn:
+            started = time.perf_counter()
+            if label == "hard delete":
+                old_delete(conn, day_id)
+                tap = purge = time.perf_counter() - started
+            else:
+                compaction.soft_delete_day(conn, 1, day_id)
+                conn.commit()
+                tap = time.perf_counter() - started
+
+                def write(func, *args, rows=1):
+                    result = func(conn, *args)
+                    conn.commit()
+                    return result
+                compactor = compaction.Compactor(write=write, pool=pool, batch_size=args.batch)
+                # what the compactor thread does, minus its idle waits
+                while any(compactor.step()):
+                    time.sleep(compactor.pause)
+                purge = time.perf_counter() - started
+                stats = compactor.stats()
+        time.sleep(0.2)
+        saver.done.set()
+        saver.join()
+        pool.close()
+
+        extra = ""
+        if label == "soft delete":
+            extra = (f", {stats['batches']} batches of "
+                     f"{stats['avg_batch_time'] * 1000:.1f}ms avg")
+        print(f"{label}: tap {tap * 1000:.1f}ms, purged in {purge * 1000:.0f}ms{extra}; "
+              f"other user's {saver.report()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+Bulk import of a big history while other users keep saving sets.
+
+Generates a CSV of --rows sets on the fly (never held in memory), imports
+it through transfer.import_user, and meanwhile a few threads save small
+sessions the way save_logs_to_db does. Reports import speed, peak RSS
+and the other users' save latency, before and during the import; the p99
+during it must stay within 2 x --chunk-ms of the one before.
+
+    python benchmarks/bench_import.py --rows 1000000 --write-behind
+"""
+import argparse
+import io
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class GeneratedCSV(io.TextIOBase):
+    """Readable text stream of `rows` sets, produced line by line."""
+
+    def __init__(self, rows, exercises=20, sets=3):
+        self.lines = self._lines(rows, exercises, sets)
+
+    @staticmethod
+    def _lines(rows, exercises, sets):
+        yield "day,exercise,date,reps,weight\n"
+        n = 0
+        session = 0
+        while n < rows:
+            date = (datetime(2000, 1, 1, 18) + timedelta(days=session // exercises)).strftime(
+                "%Y-%m-%d %H:%M:%S")
+            exercise = f"Упражнение {session % exercises}"
+            for i in range(min(sets, rows - n)):
+                yield f"День {session % exercises % 4},{exercise},{date},5,{60 + i * 5}\n"
+                n += 1
+            session += 1
+
+    def readable(self):
+        return True
+
+    def __iter__(self):
+        return self.lines
+
+    def __next__(self):
+        return next(self.lines)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=None, help="most rows per chunk")
+    parser.add_argument("--chunk-ms", type=float, default=None, help="write lock hold per chunk")
+    parser.add_argument("--baseline", type=float, default=2.0,
+                        help="seconds of saves measured before the import")
+    parser.add_argument("--others", type=int, default=4, help="threads saving sets meanwhile")
+    parser.add_argument("--write-behind", action="store_true")
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["GYMBRO_DB"] = os.path.join(tmp, "import.db")
+    os.environ["GYMBRO_WRITE_BEHIND"] = "1" if args.write_behind else "0"
+
+    import db
+    import logbook
+    import migrations
+    import transfer
+    import writer
+
+    with db.connection() as conn:
+        migrations.migrate(conn)
+        exercise_ids = []
+        for i in range(args.others):
+            day_id = conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (?, 'd')",
+                                  (i + 1,)).lastrowid
+            exercise_ids.append(conn.execute(
+                "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, 'e')", (day_id,)).lastrowid)
+        conn.commit()
+
+    chunk_size = args.chunk_size or transfer.CHUNK_SIZE
+    chunk_ms = args.chunk_ms or transfer.CHUNK_MS
+    done = threading.Event()
+    importing = threading.Event()
+    baseline = []
+    latencies = []
+    lock = threading.Lock()
+
+    def other_user(exercise_id):
+        before, during = [], []
+        while not done.is_set():
+            phase = during if importing.is_set() else before
+            started = time.perf_counter()
+            writer.write(logbook.record_sets, exercise_id, [(5, 100.0), (5, 105.0)], rows=2)
+            phase.append(time.perf_counter() - started)
+            time.sleep(0.01)
+        with lock:
+            baseline.extend(before)
+            latencies.extend(during)
+
+    others = [threading.Thread(target=other_user, args=(ex,)) for ex in exercise_ids]
+    for t in others:
+        t.start()
+    time.sleep(args.baseline)
+    importing.set()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with db.connection() as conn:
+        report = transfer.import_user(conn, 10_000, GeneratedCSV(args.rows), "csv",
+                                      chunk_size=chunk_size, chunk_ms=chunk_ms)
+    elapsed = time.perf_counter() - started
+    done.set()
+    for t in others:
+        t.join()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def p99(values):
+        return values[int(len(values) * 0.99)] * 1000
+
+    baseline.sort()
+    latencies.sort()
+    print(f"imported {report['inserted']} sets in {elapsed:.1f}s "
+          f"({report['inserted'] / elapsed:.0f} rows/s), chunks up to {chunk_size} rows / "
+          f"{chunk_ms:.0f}ms, write-behind {'on' if args.write_behind else 'off'}")
+    print(f"peak RSS {rss_before / 1024:.0f} MB -> {rss_after / 1024:.0f} MB")
+    print(f"other users: {len(baseline)} saves before the import, "
+          f"p50={baseline[len(baseline) // 2] * 1000:.1f}ms p99={p99(baseline):.1f}ms "
+          f"max={baseline[-1] * 1000:.1f}ms")
+    print(f"other users: {len(latencies)} saves during the import, "
+          f"p50={latencies[len(latencies) // 2] * 1000:.1f}ms p99={p99(latencies):.1f}ms "
+          f"max={latencies[-1] * 1000:.1f}ms")
+    writer.stop()
+    db.pool.close()
+
+    assert report["inserted"] == args.rows
+    # a save waits for at most about one chunk
+    assert p99(latencies) <= p99(baseline) + 2 * chunk_ms, "import blocks other users"
+
+
+if __name__ == '__main__':
+    main()
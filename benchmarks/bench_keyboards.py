@@ -0,0 +1,58 @@
+"""
+Reply-path microbenchmark: building + serializing keyboards per reply
+(the old get_main_keyboard / per-request InlineKeyboardMarkup) against the
+prebuilt ones in keyboards.py.
+
+    python benchmarks/bench_keyboards.py --days 20 --rounds 20000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telebot import apihelper, types
+
+import keyboards
+from cache import Page
+
+
+def old_main_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+    keyboard.add(types.KeyboardButton("➕ Добавить день"), types.KeyboardButton("📅 Мои дни"))
+    keyboard.add(types.KeyboardButton("🗑️ Удалить день"))
+    return keyboard
+
+
+def old_days_keyboard(days):
+    inline_keyboard = types.InlineKeyboardMarkup()
+    for day_id, day_name in days:
+        inline_keyboard.add(types.InlineKeyboardButton(text=day_name,
+                                                       callback_data=f"select_day_{day_id}"))
+    return inline_keyboard
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    days = Page((i, f"День {i}") for i in range(1, args.days + 1))
+    # what telebot does with reply_markup right before sending
+    convert = apihelper._convert_markup
+
+    cases = [
+        ("main keyboard, built per reply", lambda: convert(old_main_keyboard())),
+        ("main keyboard, prebuilt", lambda: convert(keyboards.MAIN_KEYBOARD)),
+        (f"{args.days} days inline, built per reply", lambda: convert(old_days_keyboard(days))),
+        (f"{args.days} days inline, cached", lambda: convert(keyboards.days_keyboard(days))),
+    ]
+    for name, func in cases:
+        seconds = timeit.timeit(func, number=args.rounds)
+        print(f"{name:38s} {seconds / args.rounds * 1e6:8.2f} us/reply")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+"""
+End-to-end load benchmark: synthetic users (or a recorded update stream)
+-> main.py handlers -> FakeTelegramAPI, against a seeded database.
+
+    python benchmarks/bench_load.py --dataset medium --users 2000 --workers 8
+    python benchmarks/bench_load.py --dataset small --workers 1 --record updates.jsonl
+    python benchmarks/bench_load.py --dataset small --workers 1 --replay updates.jsonl
+    python benchmarks/bench_load.py --dataset large --compare benchmarks/results/<old>.json
+    python benchmarks/bench_load.py --dataset medium --backup-interval 0 --compare <run without>
+
+Datasets (seeded once into benchmarks/data/, every run works on a copy):
+small ~36k Logs rows, medium ~360k, large ~3.6M.
+
+Synthetic users are new users (add day, add exercises, log sets, view
+summary, sometimes delete the day) and returning seeded users (open a
+day, view summary, log sets). They press the buttons the bot actually
+sent them, read back from the fake API. Replay takes one raw Telegram
+update per line; record and replay with --workers 1 so new rows get the
+same ids as in the recording.
+
+The outbox is off (GYMBRO_OUTBOX=0): replies go out inside the handler,
+so a handler's latency includes its fake Bot API round trips.
+
+--backup-interval runs backup.py's scheduler against the db during the
+run (0 = one backup right after the other), to see what online backups
+cost the handlers; the backups' durations go into the result.
+
+Results are written to benchmarks/results/ as JSON. --compare prints the
+change against an earlier result and exits 1 if a handler's p95 or the
+overall throughput got worse by more than --threshold.
+"""
+import argparse
+import functools
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATA_DIR = os.path.join(ROOT, "benchmarks", "data")
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+# users x days x exercises x sessions x sets = Logs rows
+DATASETS = {
+    "small": dict(users=100, days=3, exercises=4, sessions=10, sets=3),
+    "medium": dict(users=1000, days=3, exercises=4, sessions=10, sets=3),
+    "large": dict(users=10000, days=3, exercises=4, sessions=10, sets=3),
+}
+
+NEW_USER_IDS = 10_000_000  # synthetic new users start here, seeded users are 1..N
+
+EXERCISE_NAMES = ["Жим", "Присед", "Тяга", "Подтягивания", "Выпады", "Жим_гантелей", "Бицепс"]
+
+
+# --- seeding ---
+
+def dataset_path(name):
+    return os.path.join(DATA_DIR, f"{name}.db")
+
+
+def seed(name):
+    """Build benchmarks/data/<name>.db unless it is already there."""
+    import logbook
+    import migrations
+
+    path = dataset_path(name)
+    if os.path.exists(path):
+        return path
+    spec = DATASETS[name]
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp_path = path + ".building"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    started = time.perf_counter()
+    conn = sqlite3.connect(tmp_path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    migrations.migrate(conn)
+
+    rng = random.Random(name)
+    first_date = datetime(2024, 1, 1, 18, 0, 0)
+    days, exercises, sessions_rows, logs, summaries = [], [], [], [], []
+    day_ids = itertools.count(1)
+    exercise_ids = itertools.count(1)
+    session_ids = itertools.count(1)
+
+    def flush():
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO TrainingDays (day_id, user_id, day_name) VALUES (?, ?, ?)",
+                         days)
+        conn.executemany("INSERT INTO Exercises (exercise_id, day_id, exercise_name) "
+                         "VALUES (?, ?, ?)", exercises)
+        conn.executemany("INSERT INTO Sessions (session_id, exercise_id, started_at) "
+                         "VALUES (?, ?, ?)", sessions_rows)
+        conn.executemany("INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)", logs)
+        conn.executemany("INSERT INTO ExerciseSummary VALUES (?, ?, ?, ?, ?, ?, ?)", summaries)
+        conn.execute("COMMIT")
+        for rows in (days, exercises, sessions_rows, logs, summaries):
+            rows.clear()
+
+    for user_id in range(1, spec["users"] + 1):
+        for d in range(spec["days"]):
+            day_id = next(day_ids)
+            days.append((day_id, user_id, f"День {d + 1}"))
+            for e in range(spec["exercises"]):
+                exercise_id = next(exercise_ids)
+                exercises.append((exercise_id, day_id, EXERCISE_NAMES[e % len(EXERCISE_NAMES)]))
+                reps = rng.choice((5, 8, 10, 12))
+                base = rng.randrange(20, 120, 5)
+                sessions = []
+                for s in range(spec["sessions"]):
+                    started_at = int((first_date + timedelta(days=s * 7 + d * 2)).timestamp())
+                    session_id = next(session_ids)
+                    sets = [(reps, float(base + s * 2.5 + i * 5)) for i in range(spec["sets"])]
+                    sessions_rows.append((session_id, exercise_id, started_at))
+                    logs.extend((session_id, r, weight) for r, weight in sets)
+                    sessions.append((started_at, sets))
+                (prev_at, prev_sets), (last_at, last_sets) = sessions[-2], sessions[-1]
+                summaries.append((exercise_id, last_at, reps, logbook.format_weights(last_sets),
+                                  prev_at, reps, logbook.format_weights(prev_sets)))
+        if len(logs) >= 100_000:
+            flush()
+    flush()
+    conn.close()
+    os.replace(tmp_path, path)
+    print(f"seeded {name} ({count_logs(path)} Logs rows) in {time.perf_counter() - started:.1f}s")
+    return path
+
+
+def count_logs(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT count(*) FROM Logs").fetchone()[0]
+    finally:
+        conn.close()
+
+
+# --- synthetic traffic ---
+
+class User:
+    """Builds the raw updates one Telegram user would send."""
+
+    def __init__(self, user_id, ids, rng):
+        self.user_id = user_id
+        self.ids = ids
+        self.rng = rng
+        self.sender = {"id": user_id, "is_bot": False, "first_name": f"u{user_id}"}
+        self.chat = {"id": user_id, "type": "private"}
+
+    def message(self, text):
+        msg = {"message_id": next(self.ids), "date": int(time.time()), "text": text,
+               "from": self.sender, "chat": self.chat}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"update_id": next(self.ids), "message": msg}
+
+    def press(self, reply, data):
+        """Callback from an inline button on the bot's message `reply`."""
+        return {"update_id": next(self.ids), "callback_query": {
+            "id": str(next(self.ids)), "from": self.sender, "chat_instance": str(self.user_id),
+            "data": data,
+            "message": {"message_id": reply["message_id"], "date": int(time.time()),
+                        "chat": self.chat, "from": {"id": 1, "is_bot": True, "first_name": "GymBro"}},
+        }}
+
+    def sets_text(self):
+        reps = self.rng.choice((5, 8, 10, 12))
+        weights = [str(self.rng.randrange(20, 140, 5)) for _ in range(self.rng.randint(1, 5))]
+        return f"{reps} {' '.join(weights)}"
+
+
+def buttons(reply, action):
+    """callback_data of the inline buttons in a bot reply for a callbacks.ACTIONS action."""
+    import callbacks
+    markup = (reply or {}).get("reply_markup")
+    if not markup:
+        return []
+    if isinstance(markup, str):
+        markup = json.loads(markup)
+    found = []
+    for row in markup.get("inline_keyboard", []):
+        for button in row:
+            route = callbacks.decode(button.get("callback_data"))
+            if route is not None and route[0].action == action:
+                found.append(button["callback_data"])
+    return found
+
+
+def open_day(user):
+    """Мои дни -> a random day. Returns the exercises screen (or None)."""
+    reply = yield user.message("📅 Мои дни")
+    days = buttons(reply, "select_day")
+    if not days:
+        return None
+    return (yield user.press(reply, user.rng.choice(days)))
+
+
+def log_session(user):
+    """Open a day, look at an exercise's summary and log a new session."""
+    reply = yield from open_day(user)
+    exercises = buttons(reply, "log_ex")
+    if not exercises:
+        return
+    reply = yield user.press(reply, user.rng.choice(exercises))
+    if user.rng.random() < 0.3:
+        return  # just looked
+    log_new = buttons(reply, "log_new")
+    if not log_new:
+        return
+    yield user.press(reply, log_new[0])
+    yield user.message(user.sets_text())
+
+
+def new_user(user):
+    yield user.message("/start")
+    yield user.message("➕ Добавить день")
+    yield user.message(f"День {user.rng.randint(1, 9)}")
+    for _ in range(user.rng.randint(1, 3)):
+        reply = yield from open_day(user)
+        add = buttons(reply, "add_ex")
+        if not add:
+            return
+        yield user.press(reply, add[0])
+        yield user.message(f"{user.rng.choice(EXERCISE_NAMES)} {user.sets_text()}")
+    for _ in range(user.rng.randint(1, 4)):
+        yield from log_session(user)
+    if user.rng.random() < 0.2:
+        reply = yield user.message("🗑️ Удалить день")
+        days = buttons(reply, "delete_day")
+        if days:
+            yield user.press(reply, days[-1])
+
+
+def returning_user(user):
+    for _ in range(user.rng.randint(1, 5)):
+        yield from log_session(user)
+
+
+def synthetic_users(count, seeded_users, returning_share, seed_value):
+    """(user_id, generator) pairs; generators get the bot's last reply sent in."""
+    rng = random.Random(seed_value)
+    ids = itertools.count(1)
+    # each seeded user at most once: two flows of one chat would interleave
+    returning = list(range(1, seeded_users + 1))
+    rng.shuffle(returning)
+    users = []
+    for n in range(count):
+        if returning and rng.random() < returning_share:
+            user = User(returning.pop(), ids, random.Random(rng.random()))
+            users.append((user.user_id, returning_user(user)))
+        else:
+            user = User(NEW_USER_IDS + n, ids, random.Random(rng.random()))
+            users.append((user.user_id, new_user(user)))
+    return users
+
+
+def replayed_users(path):
+    """Recorded updates grouped per user, in file order, as (user_id, generator)."""
+    import webhook
+    per_user = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                update = json.loads(line)
+                per_user.setdefault(webhook.update_user_id(update), []).append(update)
+
+    def stream(updates):
+        for update in updates:
+            yield update
+
+    return [(user_id, stream(updates)) for user_id, updates in per_user.items()]
+
+
+# --- running ---
+
+class Recorder:
+    """Latency per handler; the handler is whichever ran innermost for the update."""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def instrument(self, bot_main):
+        def timed(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                self.local.handler = func.__name__
+                return func(*args, **kwargs)
+            return wrapper
+
+        for handler in bot_main.bot.message_handlers + bot_main.bot.callback_query_handlers:
+            handler["function"] = timed(handler["function"])
+        bot_main.callbacks.router.wrap(timed)
+        # handle_pending_step calls these through the module
+        for name in ("save_day", "parse_new_exercise_and_logs", "parse_logs_for_existing_exercise"):
+            setattr(bot_main, name, timed(getattr(bot_main, name)))
+
+    def run(self, process, update):
+        self.local.handler = "unhandled"
+        error = False
+        started = time.perf_counter()
+        try:
+            process(update)
+        except Exception as e:
+            print(f"update {update.get('update_id')} failed: {e}")
+            error = True
+        elapsed = time.perf_counter() - started
+        handler = self.local.handler
+        with self.lock:
+            self.latencies.setdefault(handler, []).append(elapsed)
+            if error:
+                self.errors[handler] = self.errors.get(handler, 0) + 1
+
+
+def drive(users, workers, process, last_reply, recorder, record_file=None):
+    """
+    Each worker takes every n-th user and steps its users round-robin, so
+    one user's updates stay in order while many users are mid-flow at once.
+    """
+    record_lock = threading.Lock()
+
+    def worker(mine):
+        active = []
+        for user_id, flow in mine:
+            try:
+                active.append((user_id, flow, next(flow)))
+            except StopIteration:
+                pass
+        while active:
+            still_active = []
+            for user_id, flow, update in active:
+                recorder.run(process, update)
+                if record_file:
+                    with record_lock:
+                        record_file.write(json.dumps(update, ensure_ascii=False) + "\n")
+                try:
+                    still_active.append((user_id, flow, flow.send(last_reply(user_id))))
+                except StopIteration:
+                    pass
+            active = still_active
+
+    threads = [threading.Thread(target=worker, args=(users[i::workers],)) for i in range(workers)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - started
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def summarize(recorder, elapsed):
+    handlers = {}
+    for name, values in sorted(recorder.latencies.items()):
+        values.sort()
+        handlers[name] = {
+            "count": len(values),
+            "errors": recorder.errors.get(name, 0),
+            "mean_ms": sum(values) / len(values) * 1000,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    updates = sum(h["count"] for h in handlers.values())
+    return {
+        "updates": updates,
+        "errors": sum(recorder.errors.values()),
+        "elapsed_s": elapsed,
+        "throughput": updates / elapsed if elapsed else 0.0,
+        "handlers": handlers,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+# runs are only comparable when these match
+SETUP_KEYS = ("dataset", "mode", "users", "workers", "write_behind", "api_latency",
+              "backup_interval")
+
+
+def print_report(result, previous=None, threshold=0.2):
+    """Prints the per-handler table. Returns the list of regressions vs `previous`."""
+    regressions = []
+    old_handlers = previous["handlers"] if previous else {}
+    print(f"\n{result['updates']} updates in {result['elapsed_s']:.2f}s "
+          f"= {result['throughput']:.0f} updates/s, errors: {result['errors']}")
+    if result.get("backup"):
+        b = result["backup"]
+        print(f"backups during the run: {b['backups']}, {b['avg_seconds']:.2f}s avg, "
+              f"{b['max_seconds']:.2f}s max, {b['last_size'] / 2 ** 20:.1f} MB each")
+    if previous:
+        different = [f"{key} {previous.get(key)} -> {result[key]}" for key in SETUP_KEYS
+                     if previous.get(key) != result[key]]
+        if different:
+            print("note: different setups, " + ", ".join(different))
+        change = result["throughput"] / previous["throughput"] - 1
+        print(f"throughput vs {previous.get('git') or '?'} ({previous['started_at']}): "
+              f"{previous['throughput']:.0f} -> {result['throughput']:.0f} updates/s ({change:+.0%})")
+        if change < -threshold:
+            regressions.append(f"throughput {change:+.0%}")
+
+    print(f"{'handler':34} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+          + (f" {'p95 was':>8} {'change':>7}" if previous else ""))
+    for name, h in result["handlers"].items():
+        line = (f"{name:34} {h['count']:7d} {h['p50_ms']:8.2f} {h['p95_ms']:8.2f} "
+                f"{h['p99_ms']:8.2f} {h['max_ms']:8.2f}")
+        old = old_handlers.get(name)
+        if old:
+            change = h["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+            line += f" {old['p95_ms']:8.2f} {change:+7.0%}"
+            # sub-millisecond moves are noise
+            if change > threshold and h["p95_ms"] - old["p95_ms"] > 0.5:
+                line += "  REGRESSION"
+                regressions.append(f"{name} p95 {change:+.0%}")
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GymBro end-to-end load benchmark")
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="small")
+    parser.add_argument("--users", type=int, default=1000, help="synthetic users")
+    parser.add_argument("--returning", type=float, default=0.5,
+                        help="share of synthetic users that are seeded (returning) users")
+    parser.add_argument("--workers", type=int, default=8, help="threads processing updates")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the traffic")
+    parser.add_argument("--replay", help="JSONL file of raw updates to replay instead")
+    parser.add_argument("--record", help="write every processed update to this JSONL file")
+    parser.add_argument("--write-behind", action="store_true", help="GYMBRO_WRITE_BEHIND=1")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="seconds the fake Bot API waits before answering")
+    parser.add_argument("--backup-interval", type=float,
+                        help="take online backups every N seconds during the run")
+    parser.add_argument("--out", help="result file (default: benchmarks/results/<dataset>-<time>.json)")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    seeded_path = seed(args.dataset)
+    tmp = tempfile.mkdtemp(prefix="gymbro-load-")
+    db_path = os.path.join(tmp, "load.db")
+    shutil.copyfile(seeded_path, db_path)
+
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCH"
+    os.environ["GYMBRO_DB"] = db_path
+    os.environ["GYMBRO_OUTBOX"] = "0"
+    os.environ["GYMBRO_DB_POOL_SIZE"] = str(args.workers + 2)
+    os.environ["GYMBRO_WRITE_BEHIND"] = "1" if args.write_behind else "0"
+
+    import fakeapi
+    api = fakeapi.FakeTelegramAPI(latency=args.api_latency).start()
+    fakeapi.use(api.url)
+
+    import db
+    import main as bot_main
+    import writer
+    from telebot import types
+    bot_main.init_db()
+    bot_main.bot.threaded = False
+    writer.start()
+
+    recorder = Recorder()
+    recorder.instrument(bot_main)
+
+    def process(update):
+        bot_main.bot.process_new_updates([types.Update.de_json(update)])
+
+    if args.replay:
+        users = replayed_users(args.replay)
+    else:
+        users = synthetic_users(args.users, DATASETS[args.dataset]["users"], args.returning,
+                                args.seed)
+
+    backups = None
+    if args.backup_interval is not None:
+        import backup
+        backups = backup.Backup(path=db_path, directory=os.path.join(tmp, "backups"),
+                                interval=args.backup_interval, keep=1, keep_days=0).start()
+
+    record_file = open(args.record, "w", encoding="utf-8") if args.record else None
+    print(f"dataset {args.dataset}: {count_logs(db_path)} Logs rows, {len(users)} users, "
+          f"{args.workers} workers{', replay ' + args.replay if args.replay else ''}")
+    try:
+        elapsed = drive(users, args.workers, process, api.last_message, recorder, record_file)
+    finally:
+        if record_file:
+            record_file.close()
+        if backups:
+            backups.close()
+        writer.stop()
+
+    result = {
+        "dataset": args.dataset,
+        "logs_rows": count_logs(db_path),
+        "mode": "replay" if args.replay else "synthetic",
+        "replay": args.replay,
+        "users": len(users),
+        "workers": args.workers,
+        "write_behind": args.write_behind,
+        "api_latency": args.api_latency,
+        "backup_interval": args.backup_interval,
+        "seed": args.seed,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        **summarize(recorder, elapsed),
+        "api_calls": dict(api.calls),
+        "pool": db.pool.stats(),
+    }
+    if backups:
+        result["backup"] = backups.stats()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    regressions = print_report(result, previous, args.threshold)
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"{args.dataset}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    print(f"\nresult saved to {out}")
+
+    db.pool.close()
+    api.stop()
+    shutil.rmtree(tmp, ignore_errors=True)
+
+    if regressions:
+        print("regressions: " + ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
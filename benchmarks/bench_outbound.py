@@ -0,0 +1,112 @@
+"""
+Outbox against the local fake Bot API: a burst over many chats with a few
+injected 429s, callback answers queued behind it, and a run of edits to one
+message. Checks the limits held and prints queue/delay metrics. A
+document (from a path and from an open file) is answered with 429 once
+and must arrive whole on the retry. Last, an outbox closed with a chat's
+backlog unsent must fail the leftover calls (their callbacks run).
+
+    python benchmarks/bench_outbound.py --chats 30 --per-chat 3
+"""
+import argparse
+import collections
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+
+import fakeapi
+from outbound import Outbox, OutboxClosed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chats", type=int, default=30)
+    parser.add_argument("--per-chat", type=int, default=3)
+    parser.add_argument("--callbacks", type=int, default=20)
+    parser.add_argument("--edits", type=int, default=50)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--chat-rate", type=float, default=1)
+    args = parser.parse_args()
+
+    api = fakeapi.FakeTelegramAPI().start()
+    fakeapi.use(api.url)
+    bot = telebot.TeleBot("123456:BENCH", threaded=False)
+    outbox = Outbox(bot, global_rate=args.global_rate, chat_rate=args.chat_rate, chat_burst=1)
+
+    api.fail_next("sendMessage", times=3, retry_after=1)
+    started = time.monotonic()
+    for i in range(args.per_chat):
+        for chat_id in range(1, args.chats + 1):
+            outbox.send_message(chat_id, f"msg {i}")
+    callbacks = [outbox.answer_callback_query(str(n)) for n in range(args.callbacks)]
+    for n in range(args.edits):
+        outbox.edit_message_text(f"edit {n}", chat_id=1, message_id=1)
+
+    content = os.urandom(64 * 1024)
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(content)
+    api.fail_next("sendDocument", times=2, retry_after=1)
+    document_from_path = outbox.send_document_file(999, f.name, visible_file_name="a.bin")
+    opened = open(f.name, "rb")
+    document_from_file = outbox.send_document(998, opened, visible_file_name="b.bin")
+
+    callbacks[-1].result()
+    callbacks_done = time.monotonic() - started
+    outbox.flush()
+    elapsed = time.monotonic() - started
+    document_from_path.result()
+    document_from_file.result()
+    opened.close()
+    os.remove(f.name)
+    documents = [p["document"] for _, method, p in api.log if method == "sendDocument"]
+    stats = outbox.stats()
+    outbox.close()
+    delivered = api.calls["sendMessage"] - 3
+    sends = [(t, int(p["chat_id"])) for t, method, p in api.log if method == "sendMessage"]
+    everything = [t for t, _, _ in api.log]
+
+    # one message a second to one chat, closed after 0.5s: most stay queued
+    closing = Outbox(bot, chat_rate=1, chat_burst=1)
+    backlog = [closing.send_message(1000, f"late {n}") for n in range(5)]
+    called_back = []
+    for future in backlog:
+        future.add_done_callback(called_back.append)
+    closing.close(timeout=0.5)
+    unsent = sum(1 for future in backlog if isinstance(future.exception(), OutboxClosed))
+    api.stop()
+
+    per_chat = collections.defaultdict(list)
+    for t, chat_id in sends:
+        per_chat[chat_id].append(t)
+    min_gap = min(b - a for times in per_chat.values() for a, b in zip(times, times[1:]))
+    window = max(sum(1 for t in everything if s <= t < s + 1) for s in everything)
+
+    total = args.chats * args.per_chat
+    print(f"messages: {total} to {args.chats} chats in {elapsed:.2f}s")
+    print(f"delivered sendMessage: {delivered} (+3 answered 429)")
+    print(f"callback answers done after {callbacks_done:.2f}s")
+    print(f"editMessageText calls: {api.calls['editMessageText']} for {args.edits} edits")
+    print(f"min gap within a chat: {min_gap:.3f}s, max API calls in any 1s window: {window}")
+    print(f"sendDocument calls: {len(documents)}, delivered sizes: "
+          f"{[len(d) for d in documents[2:]]} of {len(content)}")
+    print(f"outbox stats: {stats}")
+    print(f"closed with a backlog: {unsent} of {len(backlog)} failed with OutboxClosed, "
+          f"{len(called_back)} callbacks ran")
+
+    assert delivered == total
+    assert stats["retried_429"] == 5
+    assert len(documents) == 4 and documents[2:] == [content, content]
+    assert api.calls["editMessageText"] < args.edits
+    assert min_gap >= 1 / args.chat_rate * 0.9
+    assert window <= args.global_rate + 1
+    assert all(future.done() for future in backlog) and len(called_back) == len(backlog)
+    assert unsent == len(backlog) - 1
+
+
+if __name__ == '__main__':
+    main()
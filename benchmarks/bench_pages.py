@@ -0,0 +1,190 @@
+"""
+Keyset-paginated day lists: cost of one page as the list grows, and a
+walk over every page checking the boundaries.
+
+For each list length: one user with that many days, then
+- first / middle / last page with cache.load_page (no cache), p50
+- the old full list (every row + one keyboard) for comparison
+- a walk forward over next_after and back over prev_after: every day
+  must show up exactly once, pages full except the last, and going back
+  from page k must land on page k-1. The walk is repeated after deleting
+  the days around a page boundary.
+The same walk then goes over a day with that many exercises on the
+show_day_stats screen: cache.get_exercise_page + the keyboard it gets,
+following the ⬅️/➡️ buttons' callback_data.
+
+    python benchmarks/bench_pages.py --days 10 1000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2] * 1000
+
+
+def walk(conn, cache, user_id, size):
+    """Check every page of the user's days; returns the number of pages."""
+    expected = [row[0] for row in conn.execute(
+        "SELECT day_id FROM TrainingDays WHERE user_id = ? ORDER BY day_id", (user_id,))]
+    afters, seen = [], []
+    after = 0
+    while after is not None:
+        page = cache.load_page(conn, "TrainingDays", "day_id", "day_id, day_name",
+                               "user_id", user_id, after, size)
+        assert page.prev_after == (afters[-1] if afters else None), (after, page.prev_after)
+        assert len(page) == size or page.next_after is None, (after, len(page))
+        afters.append(after)
+        seen += [day_id for day_id, _ in page]
+        after = page.next_after
+    assert seen == expected, "pages skip or repeat days"
+
+    # and backwards, over prev_after only
+    after = afters[-1]
+    for previous in reversed(afters[:-1]):
+        page = cache.load_page(conn, "TrainingDays", "day_id", "day_id, day_name",
+                               "user_id", user_id, after, size)
+        assert page.prev_after == previous, (after, page.prev_after, previous)
+        after = previous
+    return len(afters)
+
+
+def walk_day_stats(conn, cache, keyboards, callbacks, day_id):
+    """Same walk over the show_day_stats pages of a day; returns the number of pages."""
+    expected = [row[0] for row in conn.execute(
+        "SELECT exercise_id FROM Exercises WHERE day_id = ? ORDER BY exercise_id", (day_id,))]
+
+    def screen(after):
+        page = cache.get_exercise_page(day_id, after)
+        rows = json.loads(keyboards.day_stats_keyboard(day_id, page))["inline_keyboard"]
+        buttons = {button["text"]: button["callback_data"] for row in rows for button in row}
+        assert [buttons[f"📈 {name}"] for _, name in page] == \
+            [callbacks.encode("stats_ex", ex_id) for ex_id, _ in page], after
+        # the arrows open exactly the pages around this one
+        for arrow, around in (("⬅️", page.prev_after), ("➡️", page.next_after)):
+            assert buttons.get(arrow) == (None if around is None else callbacks.encode(
+                "stats_day_page", day_id, around)), (after, arrow)
+        return page
+
+    afters, seen = [], []
+    after = 0
+    while after is not None:
+        page = screen(after)
+        assert len(page) == cache.PAGE_SIZE or page.next_after is None, (after, len(page))
+        afters.append(after)
+        seen += [ex_id for ex_id, _ in page]
+        after = page.next_after
+    assert seen == expected, "day stats pages skip or repeat exercises"
+
+    after = afters[-1]
+    for previous in reversed(afters[:-1]):
+        assert screen(after).prev_after == previous, (after, previous)
+        after = previous
+    return len(afters)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    os.environ["GYMBRO_DB"] = os.path.join(tempfile.mkdtemp(), "pages.db")
+    os.environ["GYMBRO_PAGE_SIZE"] = str(args.page_size)
+
+    import cache
+    import callbacks
+    import db
+    import keyboards
+    import migrations
+
+    size = args.page_size
+    with db.connection() as conn:
+        migrations.migrate(conn)
+        for user_id, count in enumerate(args.days, 1):
+            conn.executemany("INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)",
+                             [(user_id, f"День {i}") for i in range(count)])
+            # someone else's days in between, pages must not pick them up
+            conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (0, 'чужой')")
+        conn.commit()
+
+        for user_id, count in enumerate(args.days, 1):
+            ids = [row[0] for row in conn.execute(
+                "SELECT day_id FROM TrainingDays WHERE user_id = ? ORDER BY day_id", (user_id,))]
+            # `after` of the middle and the last page
+            middle = ids[len(ids) // 2]
+            last_start = (len(ids) - 1) // size * size
+            last = ids[last_start - 1] if last_start else 0
+
+            def page(after):
+                return lambda: keyboards.days_keyboard(cache.load_page(
+                    conn, "TrainingDays", "day_id", "day_id, day_name", "user_id", user_id,
+                    after, size))
+
+            def full():
+                rows = conn.execute("SELECT day_id, day_name FROM TrainingDays WHERE user_id = ?",
+                                    (user_id,)).fetchall()
+                return keyboards.days_keyboard(cache.Page(rows))
+
+            timings = [timeit(page(after), args.repeat) for after in (0, middle, last)]
+            full_ms = timeit(full, max(3, args.repeat // 50))
+            pages = walk(conn, cache, user_id, size)
+
+            # drop the days right around a page boundary and walk again
+            boundary = ids[min(size, len(ids) - 1)]
+            conn.execute("DELETE FROM TrainingDays WHERE user_id = ? AND day_id BETWEEN ? AND ?",
+                         (user_id, boundary - 1, boundary + 1))
+            walk(conn, cache, user_id, size)
+            conn.rollback()
+
+            print(f"{count:>7} days, {pages} pages: page first/middle/last "
+                  f"{timings[0]:.3f}/{timings[1]:.3f}/{timings[2]:.3f}ms, "
+                  f"full list {full_ms:.2f}ms; boundaries ok")
+
+        # show_day_stats of a day with that many exercises
+        for user_id, count in enumerate(args.days, 1):
+            day_id = conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (?, 'Ноги')",
+                                  (user_id,)).lastrowid
+            other = conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (0, 'чужой')"
+                                 ).lastrowid
+            for i in range(count):
+                conn.execute("INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                             (day_id, f"Упражнение {i}"))
+                if i % 7 == 0:
+                    # another day's exercises in between
+                    conn.execute("INSERT INTO Exercises (day_id, exercise_name) VALUES (?, 'чужое')",
+                                 (other,))
+            conn.commit()
+            started = time.perf_counter()
+            pages = walk_day_stats(conn, cache, keyboards, callbacks, day_id)
+            walked = time.perf_counter() - started
+
+            ids = [row[0] for row in conn.execute(
+                "SELECT exercise_id FROM Exercises WHERE day_id = ? ORDER BY exercise_id", (day_id,))]
+            boundary = ids[min(size, len(ids) - 1)]
+            conn.execute("DELETE FROM Exercises WHERE day_id = ? AND exercise_id BETWEEN ? AND ?",
+                         (day_id, boundary - 1, boundary + 1))
+            conn.commit()
+            cache.invalidate_exercises(day_id)
+            walk_day_stats(conn, cache, keyboards, callbacks, day_id)
+
+            print(f"{count:>7} exercises, {pages} day stats pages: walked in "
+                  f"{walked * 1000:.1f}ms; boundaries ok")
+    db.pool.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Aggregate throughput of the sharded mode as workers are added.
+
+For each shard count: fresh shard files, a shards.ShardDispatcher with
+that many worker processes, every user's flow dispatched (users
+interleaved, each user's updates in order), then wait until all are
+handled. Replies go to an in-process FakeTelegramAPI; the last reply of
+every chat is checked to make sure per-user order held.
+
+Then, with the outbox on, --rate-users users send /start at once to the
+largest shard count: the workers share --global-rate between them, so the
+replies of all of them together must stay within it in any 1s window.
+
+    python benchmarks/bench_shards.py --users 400 --shards 1 2 4
+
+Scaling needs free cores: on an N-core machine expect gains up to ~N
+workers (the dispatcher and the fake API need CPU too).
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def user_flow(user_id, ids, sessions):
+    """Add a day, look at it a few times, end on the day list (the checked reply)."""
+    def message(text):
+        msg = {"message_id": next(ids), "date": 0, "text": text,
+               "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+               "chat": {"id": user_id, "type": "private"}}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"update_id": next(ids), "message": msg}
+
+    flow = [message("/start"), message("➕ Добавить день"), message(f"День {user_id}")]
+    for _ in range(sessions):
+        flow += [message("📈 Статистика"), message("/records")]
+    return flow + [message("📅 Мои дни")]
+
+
+def run(shard_count, args, api):
+    import shards
+
+    tmp = tempfile.mkdtemp()
+    dispatcher = shards.ShardDispatcher(shard_count, base_path=os.path.join(tmp, "bench.db"),
+                                        threads=args.threads).start()
+    ids = itertools.count(1)
+    flows = [user_flow(10_000 + i, ids, args.sessions) for i in range(args.users)]
+    # round-robin over users: a user's updates stay in order, users interleave
+    updates = [u for step in itertools.zip_longest(*flows) for u in step if u is not None]
+
+    started = time.perf_counter()
+    for update in updates:
+        dispatcher.dispatch(update)
+    dispatcher.join()
+    elapsed = time.perf_counter() - started
+    stats = dispatcher.stats()
+    dispatcher.stop()
+
+    wrong = 0
+    for i in range(args.users):
+        user_id = 10_000 + i
+        last = api.last_message(user_id) or {}
+        markup = json.loads(last.get("reply_markup") or "{}")
+        days = [button["text"] for row in markup.get("inline_keyboard", []) for button in row]
+        if days != [f"День {user_id}"]:
+            wrong += 1
+    per_shard = [stats["shards"][str(i)]["dispatched"] for i in range(shard_count)]
+    return {"updates": len(updates), "elapsed": elapsed, "rate": len(updates) / elapsed,
+            "per_shard": per_shard, "out_of_order": wrong}
+
+
+def rate_check(shard_count, args, api):
+    """Max replies in any 1s window when every worker's outbox is busy."""
+    import shards
+
+    os.environ["GYMBRO_OUTBOX"] = "1"
+    tmp = tempfile.mkdtemp()
+    dispatcher = shards.ShardDispatcher(shard_count, base_path=os.path.join(tmp, "rate.db"),
+                                        threads=args.threads,
+                                        global_rate=args.global_rate).start()
+    ids = itertools.count(1)
+    # one reply per chat: only the global limit applies
+    chats = range(50_000, 50_000 + args.rate_users)
+    since = time.monotonic()
+    for user_id in chats:
+        dispatcher.dispatch(user_flow(user_id, ids, 0)[0])
+    dispatcher.join()
+    # handled is not sent: wait for the outboxes to get every reply out
+    deadline = time.monotonic() + 60
+    while (sum(1 for t, method, p in api.log if method == "sendMessage" and t >= since
+               and int(p["chat_id"]) in chats) < args.rate_users
+           and time.monotonic() < deadline):
+        time.sleep(0.1)
+    dispatcher.stop()
+    os.environ["GYMBRO_OUTBOX"] = "0"
+
+    sends = sorted(t for t, method, p in api.log
+                   if method == "sendMessage" and t >= since and int(p["chat_id"]) in chats)
+    window = max(sum(1 for t in sends if start <= t < start + 1) for start in sends)
+    return len(sends), window, sends[-1] - sends[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--sessions", type=int, default=3, help="stats/records views per user")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, default=2, help="handler threads per worker")
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--rate-users", type=int, default=100)
+    parser.add_argument("--global-rate", type=float, default=20)
+    args = parser.parse_args()
+
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCH"
+    # per-chat pacing would measure the outbox, not the workers
+    os.environ["GYMBRO_OUTBOX"] = "0"
+    os.environ["GYMBRO_METRICS_PORT"] = "0"
+
+    import fakeapi
+    api = fakeapi.FakeTelegramAPI(latency=args.api_latency).start()
+    os.environ["GYMBRO_API_URL"] = api.url
+
+    print(f"{os.cpu_count()} cores, {args.users} users, {args.threads} threads per worker")
+    baseline = None
+    for shard_count in args.shards:
+        result = run(shard_count, args, api)
+        baseline = baseline or result["rate"]
+        print(f"{shard_count} shard(s): {result['updates']} updates in {result['elapsed']:.2f}s "
+              f"= {result['rate']:.0f} updates/s (x{result['rate'] / baseline:.2f}), "
+              f"per shard {result['per_shard']}, out of order: {result['out_of_order']}")
+
+    shard_count = max(args.shards)
+    sent, window, spread = rate_check(shard_count, args, api)
+    api.stop()
+    print(f"{shard_count} shard(s), outbox on: {sent} replies in {spread:.2f}s, "
+          f"max {window} in any 1s window (global rate {args.global_rate:.0f}/s)")
+    assert sent == args.rate_users
+    # each worker's bucket may start full: one extra send per worker
+    assert window <= args.global_rate + shard_count, "workers exceed the global rate together"
+
+
+if __name__ == '__main__':
+    main()
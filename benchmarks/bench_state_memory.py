@@ -0,0 +1,58 @@
+"""
+Memory per pending user: telebot next-step handlers vs state.MemoryStateStore.
+
+    python benchmarks/bench_state_memory.py --users 100000
+"""
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import telebot
+
+from state import MemoryStateStore, State
+
+
+def parse_new_exercise_and_logs(message, day_id):
+    pass
+
+
+def measure(fill, users):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    keep = fill(users)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    used = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    del keep
+    return used / users
+
+
+def fill_next_step(users):
+    bot = telebot.TeleBot("123456:BENCH", threaded=False)
+    for chat_id in range(users):
+        bot.register_next_step_handler_by_chat_id(chat_id, parse_new_exercise_and_logs, chat_id)
+    return bot
+
+
+def fill_state_store(users):
+    store = MemoryStateStore(max_size=users)
+    for chat_id in range(users):
+        store.set(chat_id, State.AWAIT_NEW_EXERCISE, chat_id)
+    return store
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    args = parser.parse_args()
+
+    print(f"pending users: {args.users}")
+    print(f"next-step handlers: {measure(fill_next_step, args.users):7.1f} bytes/user")
+    print(f"MemoryStateStore:   {measure(fill_state_store, args.users):7.1f} bytes/user")
+
+
+if __name__ == '__main__':
+    main()
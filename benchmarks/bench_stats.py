@@ -0,0 +1,143 @@
+"""
+Stats screens over a long history.
+
+For every --years value, seeds one training day with --exercises
+exercises and that much history (3 sessions a week, 5 sets each) in its
+own db, then times show_day_stats and show_exercise_stats the way the
+handlers run them: cold (query + NumPy aggregation) and from the stats
+cache, text rendering included. Day numbers (stats.local_days) are
+checked against time.localtime for every session; --tz runs it all in
+another zone.
+
+    python benchmarks/bench_stats.py --years 2 10 --exercises 6 --tz Europe/Berlin
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def timeit(func, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2] * 1000, times[-1] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[2, 10])
+    parser.add_argument("--exercises", type=int, default=6)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tz", help="server time zone, e.g. Europe/Berlin")
+    args = parser.parse_args()
+
+    if args.tz:
+        os.environ["TZ"] = args.tz
+        time.tzset()
+    tmp = tempfile.mkdtemp()
+    os.environ["GYMBRO_DB"] = os.path.join(tmp, "stats.db")
+
+    import db
+
+    for years in args.years:
+        db.use(os.path.join(tmp, f"stats_{years}y.db"))
+        print(f"--- {years} years")
+        run(args, years)
+    db.pool.close()
+
+
+def run(args, years):
+    import db
+    import logbook
+    import migrations
+    import numpy as np
+    import stats
+
+    rnd = random.Random(1)
+    with db.connection() as conn:
+        migrations.migrate(conn)
+        day_id = conn.execute(
+            "INSERT INTO TrainingDays (user_id, day_name) VALUES (1, 'Ноги')").lastrowid
+        exercises = []
+        start = datetime(2026, 1, 1) - timedelta(days=365 * years)
+        sets = 0
+        for i in range(args.exercises):
+            ex_id = conn.execute("INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                                 (day_id, f"Упражнение {i}")).lastrowid
+            exercises.append((ex_id, f"Упражнение {i}"))
+            weight = 40.0 + 10 * i
+            for week in range(52 * years):
+                for weekday in (0, 2, 4):
+                    started_at = int((start + timedelta(weeks=week, days=weekday,
+                                                        hours=18)).timestamp())
+                    weight += rnd.uniform(-0.5, 0.6)
+                    logbook.record_sets(conn, ex_id, [(rnd.randint(3, 12), round(weight + 2.5 * s, 1))
+                                                      for s in range(5)], started_at)
+                    sets += 5
+        conn.commit()
+    ids = [ex_id for ex_id, _ in exercises]
+    print(f"{sets} sets, {sets // len(ids) // 5} sessions per exercise, "
+          f"{len(ids)} exercises")
+
+    def day_cold():
+        stats._cache.clear()
+        stats.day_text("Ноги", exercises, stats.get_many(ids))
+
+    def day_cached():
+        stats.day_text("Ноги", exercises, stats.get_many(ids))
+
+    def exercise_cold():
+        stats._cache.clear()
+        stats.exercise_text("Упражнение 0", stats.get(ids[0]))
+
+    def exercise_cached():
+        stats.exercise_text("Упражнение 0", stats.get(ids[0]))
+
+    for name, func in (("day, cold", day_cold), ("day, cached", day_cached),
+                       ("exercise, cold", exercise_cold), ("exercise, cached", exercise_cached)):
+        p50, worst = timeit(func, args.repeat)
+        print(f"{name:18} p50={p50:.2f}ms max={worst:.2f}ms")
+
+    # query vs aggregation, for the day
+    with db.connection() as conn:
+        started = time.perf_counter()
+        placeholders = ",".join("?" * len(ids))
+        fetched = conn.execute(
+            "SELECT s.exercise_id, s.session_id, s.started_at, l.reps, l.weight "
+            "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+            f"WHERE s.exercise_id IN ({placeholders}) "
+            "ORDER BY s.exercise_id, s.started_at, s.session_id", ids).fetchall()
+        query = time.perf_counter() - started
+        started = time.perf_counter()
+        stats.load(conn, ids)
+        total = time.perf_counter() - started
+    print(f"day cold split: query+fetch {query * 1000:.1f}ms of {total * 1000:.1f}ms "
+          f"({len(fetched)} rows)")
+
+    # the vectorized day numbers vs the per-timestamp localtime they replace
+    with db.connection() as conn:
+        started_at = np.array([row[0] for row in conn.execute(
+            "SELECT started_at FROM Sessions ORDER BY started_at")], np.int64)
+    started = time.perf_counter()
+    days = stats.local_days(started_at)
+    vectorized = time.perf_counter() - started
+    started = time.perf_counter()
+    expected = np.array([(t + time.localtime(t).tm_gmtoff) // 86400
+                         for t in started_at.tolist()], np.int64)
+    looped = time.perf_counter() - started
+    print(f"local_days for {len(started_at)} sessions: {vectorized * 1000:.2f}ms "
+          f"(localtime loop {looped * 1000:.1f}ms)")
+    assert (days == expected).all(), "local_days differs from time.localtime"
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""
+Offline load test of the webhook path: client threads -> WebhookServer ->
+main.py handlers -> FakeTelegramAPI. Reports how fast requests are
+acknowledged and how fast updates are fully processed.
+
+    python benchmarks/bench_webhook.py --users 200 --clients 16 --workers 8
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SECRET = "bench-secret"
+
+
+def user_updates(user_id, ids):
+    """The add-day-then-look flow of one user, as raw Telegram updates."""
+    def message(text):
+        msg = {"message_id": next(ids), "date": 0, "text": text,
+               "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+               "chat": {"id": user_id, "type": "private"}}
+        if text.startswith("/"):
+            msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return {"update_id": next(ids), "message": msg}
+
+    return [message("/start"), message("➕ Добавить день"),
+            message(f"День {user_id}"), message("📅 Мои дни")]
+
+
+def post(conn, body, secret=SECRET):
+    conn.request("POST", "/webhook", body=body, headers={
+        "Content-Type": "application/json",
+        "X-Telegram-Bot-Api-Secret-Token": secret,
+    })
+    response = conn.getresponse()
+    response.read()
+    return response.status
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch", type=int, default=1, help="updates per POST")
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["TELEGRAM_TOKEN"] = "123456:BENCH"
+    os.environ["GYMBRO_DB"] = os.path.join(tmp, "bench.db")
+
+    import fakeapi
+    api = fakeapi.FakeTelegramAPI(latency=args.api_latency).start()
+    fakeapi.use(api.url)
+
+    import main as bot_main
+    import webhook
+    from telebot import types
+    bot_main.init_db()
+    bot_main.bot.threaded = False
+
+    server = webhook.WebhookServer(
+        lambda u: bot_main.bot.process_new_updates([types.Update.de_json(u)]),
+        port=0, secret=SECRET, workers=args.workers, max_pending=100000).start()
+    host, port = server.httpd.server_address[:2]
+
+    # each user's updates in order, users spread over the client threads
+    ids = itertools.count(1)
+    flows = [user_updates(1000 + i, ids) for i in range(args.users)]
+    per_client = [flows[i::args.clients] for i in range(args.clients)]
+
+    conn = http.client.HTTPConnection(host, port)
+    assert post(conn, json.dumps(flows[0][0]), secret="wrong") == 403
+    conn.close()
+
+    acks = []
+    acks_lock = threading.Lock()
+
+    def client(user_flows):
+        conn = http.client.HTTPConnection(host, port)
+        mine = []
+        for step in range(4):
+            updates = [flow[step] for flow in user_flows]
+            for i in range(0, len(updates), args.batch):
+                chunk = updates[i:i + args.batch]
+                body = json.dumps(chunk if args.batch > 1 else chunk[0])
+                started = time.perf_counter()
+                status = post(conn, body)
+                mine.append(time.perf_counter() - started)
+                assert status == 200, status
+        conn.close()
+        with acks_lock:
+            acks.extend(mine)
+
+    threads = [threading.Thread(target=client, args=(chunk,)) for chunk in per_client]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    ingest_time = time.perf_counter() - started
+    server.join()
+    total_time = time.perf_counter() - started
+
+    total = args.users * 4
+    acks.sort()
+    print(f"updates: {total}, workers: {args.workers}, clients: {args.clients}, batch: {args.batch}")
+    print(f"ack latency  p50={statistics.median(acks) * 1000:.2f}ms "
+          f"p99={acks[int(len(acks) * 0.99) - 1] * 1000:.2f}ms")
+    print(f"ingest       {total / ingest_time:8.0f} updates/s")
+    print(f"processed    {total / total_time:8.0f} updates/s")
+    print(f"server stats {server.stats()}")
+    print(f"api calls    {dict(api.calls)}")
+
+    server.stop()
+    api.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Set-logging throughput with the write-behind queue on and off.
+
+N handler threads each save sessions of a few sets, the way
+save_logs_to_db does. Off: every save commits on its own connection.
+On: saves go through WriteBehindWriter and are group-committed.
+
+    python benchmarks/bench_writer.py --threads 16 --saves 200
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+import logbook
+import migrations
+from writer import WriteBehindWriter
+
+
+def run(path, threads, saves, write_behind, synchronous, delay_ms):
+    pragmas = tuple(p for p in db.PRAGMAS if "synchronous" not in p)
+    pragmas += (f"PRAGMA synchronous={synchronous}",)
+    pool = db.ConnectionPool(path, max_size=threads + 1, pragmas=pragmas)
+    with pool.connection() as conn:
+        migrations.migrate(conn)
+        conn.execute("INSERT INTO TrainingDays (user_id, day_name) VALUES (1, 'bench')")
+        day_id = conn.execute("SELECT max(day_id) FROM TrainingDays").fetchone()[0]
+        exercise_ids = []
+        for i in range(threads):
+            cur = conn.execute("INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                               (day_id, f"ex{i}"))
+            exercise_ids.append(cur.lastrowid)
+        conn.commit()
+
+    sets = [(5, 100.0), (5, 102.5), (3, 110.0)]
+    writer = WriteBehindWriter(pool, max_delay=delay_ms / 1000).start() if write_behind else None
+
+    def worker(exercise_id):
+        for _ in range(saves):
+            if writer:
+                writer.submit(logbook.record_sets, exercise_id, sets, rows=len(sets)).result()
+            else:
+                with pool.connection() as conn:
+                    logbook.record_sets(conn, exercise_id, sets)
+                    conn.commit()
+
+    workers = [threading.Thread(target=worker, args=(ex_id,)) for ex_id in exercise_ids]
+    started = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    stats = writer.stats() if writer else None
+    if writer:
+        writer.close()
+    pool.close()
+    return threads * saves / elapsed, stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--saves", type=int, default=200)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    parser.add_argument("--synchronous", default="FULL", choices=["OFF", "NORMAL", "FULL"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for write_behind in (False, True):
+            path = os.path.join(tmp, f"bench_{int(write_behind)}.db")
+            rate, stats = run(path, args.threads, args.saves, write_behind, args.synchronous,
+                              args.delay_ms)
+            label = "write-behind on " if write_behind else "write-behind off"
+            print(f"{label}: {rate:8.0f} saves/s ({rate * 3:8.0f} rows/s)")
+            if stats:
+                print(f"  batches={stats['batches']} avg_batch_jobs={stats['avg_batch_jobs']:.1f} "
+                      f"avg_commit={stats['avg_commit_time'] * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
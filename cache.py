@@ -0,0 +1,250 @@
+"""
+In-process read-through caches for the navigation screens.
+
+days: user_id -> that user's (day_id, day_name) rows
+exercises: day_id -> that day's (exercise_id, exercise_name) rows
+day_pages / exercise_pages: the same lists one keyset page at a time
+(what the list keyboards show), owner id -> {after id: Page}
+
+Every write that changes one of these lists must call the matching
+invalidate_* function after its commit. Cached lists carry the inline
+keyboards rendered from them (see keyboards.py), so invalidating a list
+drops its keyboards too.
+"""
+import os
+import threading
+
+import db
+
+DAYS_CACHE_SIZE = int(os.getenv("GYMBRO_DAYS_CACHE_SIZE", "50000"))
+EXERCISES_CACHE_SIZE = int(os.getenv("GYMBRO_EXERCISES_CACHE_SIZE", "100000"))
+PAGE_SIZE = int(os.getenv("GYMBRO_PAGE_SIZE", "10"))
+
+
+class Listing(tuple):
+    """Cached rows + the serialized markups built from exactly these rows."""
+
+    def __init__(self, rows):
+        self.markups = {}
+        self._names = None
+
+    def markup(self, kind, build):
+        json_markup = self.markups.get(kind)
+        if json_markup is None:
+            json_markup = self.markups[kind] = build(self)
+        return json_markup
+
+    def name(self, row_id):
+        """Name of the row with this id, None when it isn't in the list."""
+        if self._names is None:
+            self._names = dict(self)
+        return self._names.get(row_id)
+
+
+class Page(Listing):
+    """
+    Rows with id > `after`, in id order, at most PAGE_SIZE of them.
+    prev_after / next_after are the `after` of the pages around it
+    (None at either end of the list).
+    """
+
+    def __new__(cls, rows, prev_after=None, next_after=None):
+        return super().__new__(cls, rows)
+
+    def __init__(self, rows, prev_after=None, next_after=None):
+        super().__init__(rows)
+        self.prev_after = prev_after
+        self.next_after = next_after
+
+
+class Pages(dict):
+    """after -> Page of one list, dropped as a whole when the list changes."""
+
+
+class LRUCache:
+    """Size-bounded LRU with hit/miss counters, safe to share between threads."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = {}
+        self._lock = threading.Lock()
+        # bumped on every invalidation, a load that overlaps one is not stored
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            value = self._entries.pop(key, None)
+            if value is not None:
+                self._entries[key] = value
+                self.hits += 1
+                return value
+            self.misses += 1
+            generation = self._generation
+
+        value = loader(key)
+        self._store({key: value}, generation)
+        return value
+
+    def get_many_or_load(self, keys, loader):
+        """Like get_or_load for several keys; `loader(missing keys)` returns {key: value}."""
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                value = self._entries.pop(key, None)
+                if value is None:
+                    missing.append(key)
+                else:
+                    self._entries[key] = value
+                    found[key] = value
+            self.hits += len(found)
+            self.misses += len(missing)
+            generation = self._generation
+
+        if missing:
+            loaded = loader(missing)
+            self._store(loaded, generation)
+            found.update(loaded)
+        return found
+
+    def _store(self, values, generation):
+        with self._lock:
+            if generation == self._generation:
+                self._entries.update(values)
+                while len(self._entries) > self.max_size:
+                    del self._entries[next(iter(self._entries))]
+                    self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+days = LRUCache(DAYS_CACHE_SIZE)
+exercises = LRUCache(EXERCISES_CACHE_SIZE)
+day_pages = LRUCache(DAYS_CACHE_SIZE)
+exercise_pages = LRUCache(EXERCISES_CACHE_SIZE)
+
+
+def _load_days(user_id):
+    with db.connection() as conn:
+        return Listing(conn.execute(
+            "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ? AND deleted_at IS NULL",
+            (user_id,)
+        ))
+
+
+def _load_exercises(day_id):
+    with db.connection() as conn:
+        return Listing(conn.execute(
+            "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ?",
+            (day_id,)
+        ))
+
+
+def load_page(conn, table, id_column, columns, owner_column, owner_id, after, size=PAGE_SIZE,
+              condition=None):
+    """
+    Keyset page: the index on (owner, id) is entered at `after` and read for
+    size + 1 rows each way, so a page costs the same on any list length.
+    `condition` is extra SQL the rows must match (a partial index's WHERE).
+    """
+    extra = f" AND {condition}" if condition else ""
+    rows = conn.execute(
+        f"SELECT {columns} FROM {table} WHERE {owner_column} = ? AND {id_column} > ?{extra} "
+        f"ORDER BY {id_column} LIMIT ?",
+        (owner_id, after, size + 1)
+    ).fetchall()
+    next_after = rows[size - 1][0] if len(rows) > size else None
+
+    prev_after = None
+    if after:
+        before = [row[0] for row in conn.execute(
+            f"SELECT {id_column} FROM {table} WHERE {owner_column} = ? AND {id_column} <= ?{extra} "
+            f"ORDER BY {id_column} DESC LIMIT ?",
+            (owner_id, after, size + 1)
+        )]
+        if before:
+            # a full page back, or the start of the list
+            prev_after = before[size] if len(before) > size else 0
+    return Page(rows[:size], prev_after, next_after)
+
+
+def _load_day_page(user_id, after):
+    with db.connection() as conn:
+        return load_page(conn, "TrainingDays", "day_id", "day_id, day_name",
+                         "user_id", user_id, after, condition="deleted_at IS NULL")
+
+
+def _load_exercise_page(day_id, after):
+    with db.connection() as conn:
+        return load_page(conn, "Exercises", "exercise_id", "exercise_id, exercise_name",
+                         "day_id", day_id, after)
+
+
+def _get_page(cache, owner_id, after, loader):
+    pages = cache.get_or_load(owner_id, lambda _: Pages())
+    page = pages.get(after)
+    if page is None:
+        # a concurrent invalidation drops `pages` from the cache, so a page
+        # loaded from before a write never outlives it
+        page = pages[after] = loader(owner_id, after)
+    return page
+
+
+def get_day_page(user_id, after=0):
+    return _get_page(day_pages, user_id, after, _load_day_page)
+
+
+def get_exercise_page(day_id, after=0):
+    return _get_page(exercise_pages, day_id, after, _load_exercise_page)
+
+
+def day_name(user_id, day_id):
+    """Name of a live day of this user, None for a deleted or someone else's day."""
+    # the user's cached day list only has live days of their own
+    return get_days(user_id).name(day_id)
+
+
+def get_days(user_id):
+    return days.get_or_load(user_id, _load_days)
+
+
+def get_exercises(day_id):
+    return exercises.get_or_load(day_id, _load_exercises)
+
+
+def invalidate_days(user_id):
+    days.invalidate(user_id)
+    day_pages.invalidate(user_id)
+
+
+def invalidate_exercises(day_id):
+    exercises.invalidate(day_id)
+    exercise_pages.invalidate(day_id)
+
+
+def stats():
+    return {"days": days.stats(), "exercises": exercises.stats(),
+            "day_pages": day_pages.stats(), "exercise_pages": exercise_pages.stats()}
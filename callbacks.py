@@ -0,0 +1,131 @@
+"""
+callback_data of the inline buttons and the router that dispatches them.
+
+Instead of one callback_query_handler per prefix (tried one by one with
+startswith, ids parsed with split('_')), every button carries a packed
+payload and main.handle_callback looks its action up in a dict:
+
+    version (1 byte) | action code (1 byte) | ids (8 bytes each, unsigned)
+    | tag (6 bytes, keyed BLAKE2b of everything before it)
+
+sent as urlsafe base64 without padding (<= 32 chars with two ids,
+Telegram allows 64 bytes). The key comes from GYMBRO_CALLBACK_SECRET or
+the bot token, so every process of the bot (shards, webhook workers)
+agrees on it. A client can replay a button it was sent but can't make
+one up for an id it was never shown. Anything that isn't a known action
+with a valid tag is rejected in decode(), before a handler or the db
+sees it.
+
+Codes are part of payloads already sitting in chats: never reuse or
+renumber one, add new ones. Changing the layout means a new VERSION.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import struct
+
+VERSION = 1
+TAG_SIZE = 6
+MAX_DATA = 64  # Telegram's callback_data limit, in bytes
+
+_FROM_URLSAFE = bytes.maketrans(b"-_", b"+/")
+
+# action -> (code, number of ids)
+ACTIONS = {
+    "select_day": (1, 1),
+    "delete_day": (2, 1),
+    "add_ex": (3, 1),
+    "log_ex": (4, 1),
+    "log_new": (5, 1),
+    "stats_day": (6, 1),
+    "stats_ex": (7, 1),
+    "records_day": (8, 1),
+    "days_page": (9, 2),        # list kind (keyboards.DAY_LIST_KINDS index), after
+    "exercises_page": (10, 2),  # day_id, after
+    "stats_day_page": (11, 2),  # day_id, after
+}
+
+
+class Route:
+    __slots__ = ("action", "code", "struct", "handler")
+
+    def __init__(self, action, code, id_count):
+        self.action = action
+        self.code = code
+        self.struct = struct.Struct(">BB" + "Q" * id_count)
+        self.handler = None
+
+
+class Router:
+    """Action table + payload codec. handler(call, *ids) per action."""
+
+    def __init__(self, actions, secret=None):
+        self._secret = secret
+        self._key = None
+        self.routes = {action: Route(action, code, ids) for action, (code, ids) in actions.items()}
+        # the dispatch table: action code -> Route
+        self._by_code = {route.code: route for route in self.routes.values()}
+        self.rejected = 0
+
+    def _tag(self, body):
+        if self._key is None:
+            # read on first use: main loads .env after its imports
+            secret = (self._secret or os.getenv("GYMBRO_CALLBACK_SECRET")
+                      or os.getenv("TELEGRAM_TOKEN") or "")
+            self._key = hashlib.sha256(b"gymbro-callbacks:" + secret.encode()).digest()
+        return hashlib.blake2b(body, key=self._key, digest_size=TAG_SIZE).digest()
+
+    def route(self, action):
+        """Decorator: register the handler of an action."""
+        route = self.routes[action]
+
+        def register(func):
+            route.handler = func
+            return func
+        return register
+
+    def wrap(self, wrapper):
+        """Replace every registered handler with wrapper(handler) (metrics)."""
+        for route in self.routes.values():
+            if route.handler is not None:
+                route.handler = wrapper(route.handler)
+
+    def encode(self, action, *ids):
+        route = self.routes[action]
+        body = route.struct.pack(VERSION, route.code, *ids)
+        return base64.urlsafe_b64encode(body + self._tag(body)).rstrip(b"=").decode()
+
+    def decode(self, data):
+        """callback_data -> (Route, ids), or None when it isn't a valid button of ours."""
+        if not data or len(data) > MAX_DATA:
+            return self._reject()
+        try:
+            # what urlsafe_b64decode does, minus its wrappers (hot path)
+            raw = binascii.a2b_base64(
+                data.encode().translate(_FROM_URLSAFE) + b"=" * (-len(data) % 4))
+        except (binascii.Error, ValueError):
+            return self._reject()
+        if len(raw) < 2 + TAG_SIZE or raw[0] != VERSION:
+            return self._reject()
+        route = self._by_code.get(raw[1])
+        body = raw[:-TAG_SIZE]
+        if route is None or route.handler is None or len(body) != route.struct.size:
+            return self._reject()
+        if not hmac.compare_digest(raw[-TAG_SIZE:], self._tag(body)):
+            return self._reject()
+        return route, route.struct.unpack(body)[2:]
+
+    def _reject(self):
+        self.rejected += 1
+        return None
+
+    def stats(self):
+        return {"actions": len(self._by_code), "rejected": self.rejected}
+
+
+router = Router(ACTIONS)
+route = router.route
+encode = router.encode
+decode = router.decode
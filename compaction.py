@@ -0,0 +1,289 @@
+"""
+Deleting a day in two steps.
+
+process_day_deletion only sets TrainingDays.deleted_at (soft_delete_day,
+one primary key UPDATE), so the tap is answered at once and every list
+stops showing the day. The Compactor thread purges soft-deleted days
+afterwards, a batch of sessions per transaction: deleting a Sessions row
+cascades to its Logs (ON DELETE CASCADE, migration 10), and once a day has
+no sessions left, deleting the day takes its exercises, summaries and
+records with it. The write lock is never held for more than one batch,
+and batches go through writer.write, so users' saves get in between.
+
+Freed pages go back to the file with PRAGMA incremental_vacuum every
+VACUUM_INTERVAL seconds. That needs auto_vacuum=INCREMENTAL: new dbs get
+it in migrations.migrate(), `python manage.py vacuum` converts old ones.
+
+The same thread moves old sessions to the cold tier (archive.py) every
+archive.ARCHIVE_INTERVAL seconds, archive.ARCHIVE_BATCH exercises per
+step, each exercise one write; purges go first.
+"""
+import os
+import threading
+import time
+
+import archive
+import db
+import writer
+
+ENABLED = os.getenv("GYMBRO_COMPACT", "1") == "1"
+INTERVAL = float(os.getenv("GYMBRO_COMPACT_INTERVAL", "60"))
+BATCH_SESSIONS = int(os.getenv("GYMBRO_COMPACT_BATCH", "200"))
+# breather between batches while a big day is purged
+PAUSE_MS = float(os.getenv("GYMBRO_COMPACT_PAUSE_MS", "20"))
+VACUUM_INTERVAL = float(os.getenv("GYMBRO_VACUUM_INTERVAL", "3600"))
+VACUUM_PAGES = int(os.getenv("GYMBRO_VACUUM_PAGES", "2000"))  # per run, 0 = every free page
+# archive.totals() reads every SessionArchive row; stats() reuses it this long
+# unless our own purge/archive changed the cold tier
+TOTALS_TTL = float(os.getenv("GYMBRO_ARCHIVE_TOTALS_TTL", "600"))
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def soft_delete_day(conn, user_id, day_id):
+    """Mark a user's day deleted. False when it is not theirs or already gone."""
+    return conn.execute(
+        "UPDATE TrainingDays SET deleted_at = ? "
+        "WHERE day_id = ? AND user_id = ? AND deleted_at IS NULL",
+        (int(time.time()), day_id, user_id)
+    ).rowcount > 0
+
+
+def purge_step(conn, batch_size=BATCH_SESSIONS):
+    """
+    One batch of the day that was deleted first. Returns (sessions, days)
+    purged, (0, 0) when nothing is waiting.
+    """
+    row = conn.execute(
+        "SELECT day_id FROM TrainingDays WHERE deleted_at IS NOT NULL "
+        "ORDER BY deleted_at LIMIT 1"
+    ).fetchone()
+    if row is None:
+        return 0, 0
+    day_id = row[0]
+
+    # Logs go with their sessions (cascade)
+    sessions = conn.execute(
+        "DELETE FROM Sessions WHERE session_id IN ("
+        "SELECT s.session_id FROM Exercises e "
+        "JOIN Sessions s ON s.exercise_id = e.exercise_id "
+        "WHERE e.day_id = ? LIMIT ?)",
+        (day_id, batch_size)
+    ).rowcount
+    if sessions:
+        return sessions, 0
+    # just a few rows per exercise left: Exercises, ExerciseSummary, PersonalRecords
+    conn.execute("DELETE FROM TrainingDays WHERE day_id = ?", (day_id,))
+    return 0, 1
+
+
+def pending(conn):
+    """What soft deletes still hold: days, sessions (+ their sets) and free pages."""
+    days = conn.execute(
+        "SELECT count(*) FROM TrainingDays WHERE deleted_at IS NOT NULL").fetchone()[0]
+    sessions = conn.execute(
+        "SELECT count(*) FROM TrainingDays d "
+        "JOIN Exercises e ON e.day_id = d.day_id "
+        "JOIN Sessions s ON s.exercise_id = e.exercise_id "
+        "WHERE d.deleted_at IS NOT NULL"
+    ).fetchone()[0]
+    return {
+        "pending_days": days,
+        "pending_sessions": sessions,
+        "free_pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+        "incremental_vacuum": (conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+                               == AUTO_VACUUM_INCREMENTAL),
+    }
+
+
+def vacuum(conn, pages=VACUUM_PAGES):
+    """Give up to `pages` free pages (0 = all) back to the file. Returns how many."""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+        return 0
+    before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # executescript steps the pragma to the end, execute() frees one page
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+
+class Compactor:
+    """
+    Background purge of soft-deleted days: batches back to back (with a
+    short pause) while anything is waiting, then sleeps `interval` seconds
+    or until wake(). Runs vacuum() every `vacuum_interval` seconds.
+    """
+
+    def __init__(self, write=None, pool=None, interval=INTERVAL, batch_size=BATCH_SESSIONS,
+                 pause=PAUSE_MS / 1000, vacuum_interval=VACUUM_INTERVAL,
+                 vacuum_pages=VACUUM_PAGES, archive_interval=archive.ARCHIVE_INTERVAL,
+                 archive_batch=archive.ARCHIVE_BATCH):
+        self.write = write or writer.write
+        self.pool = pool or db.pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_interval = vacuum_interval
+        self.vacuum_pages = vacuum_pages
+        self.archive_interval = archive_interval
+        self.archive_batch = archive_batch
+        self._archive_after = 0  # exercise id the archive pass got to
+        self._totals = None  # (archive.totals(), time.monotonic() it was read at)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # stats
+        self._batches = 0
+        self._purged_sessions = 0
+        self._purged_days = 0
+        self._vacuumed_pages = 0
+        self._archived_sessions = 0
+        self._archived_sets = 0
+        self._errors = 0
+        self._batch_time = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="db-compactor",
+                                                daemon=True)
+                self._thread.start()
+        return self
+
+    def wake(self):
+        """Something was just deleted, don't wait for the interval."""
+        self._wake.set()
+
+    def close(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def step(self):
+        """One purge batch. Returns (sessions, days) purged."""
+        started = time.perf_counter()
+        sessions, days = self.write(purge_step, self.batch_size, rows=self.batch_size)
+        with self._lock:
+            if sessions or days:
+                self._batches += 1
+                self._batch_time += time.perf_counter() - started
+            self._purged_sessions += sessions
+            self._purged_days += days
+            if days:
+                # their archived months went with them
+                self._totals = None
+        return sessions, days
+
+    def purge_all(self):
+        """Purge everything that is waiting now (manage.py compact). Returns (sessions, days)."""
+        total_sessions = total_days = 0
+        while True:
+            sessions, days = self.step()
+            if not sessions and not days:
+                return total_sessions, total_days
+            total_sessions += sessions
+            total_days += days
+
+    def archive_step(self, before=None):
+        """
+        Archive the next batch of exercises. Returns False once the pass
+        has gone through all of them (the next call starts over).
+        """
+        before = archive.cutoff() if before is None else before
+        with self.pool.connection() as conn:
+            ids, last = archive.candidates(conn, self._archive_after, before,
+                                           self.archive_batch)
+        for exercise_id in ids:
+            sessions, sets = self.write(archive.archive_exercise, exercise_id, before,
+                                        rows=self.archive_batch)
+            with self._lock:
+                self._archived_sessions += sessions
+                self._archived_sets += sets
+                if sessions:
+                    self._totals = None
+        self._archive_after = last or 0
+        return last is not None
+
+    def vacuum(self):
+        with self.pool.connection() as conn:
+            freed = vacuum(conn, self.vacuum_pages)
+        with self._lock:
+            self._vacuumed_pages += freed
+        return freed
+
+    def _run(self):
+        next_vacuum = time.monotonic() + self.vacuum_interval
+        next_archive = time.monotonic() + self.archive_interval
+        while not self._stop.is_set():
+            try:
+                sessions, days = self.step()
+                if sessions or days:
+                    self._stop.wait(self.pause)
+                    continue
+                if time.monotonic() >= next_archive:
+                    if self.archive_step():
+                        self._stop.wait(self.pause)
+                        continue
+                    next_archive = time.monotonic() + self.archive_interval
+                if time.monotonic() >= next_vacuum:
+                    self.vacuum()
+                    next_vacuum = time.monotonic() + self.vacuum_interval
+            except Exception as e:
+                print(f"Ошибка компакции: {e}")
+                with self._lock:
+                    self._errors += 1
+            self._wake.wait(max(0.0, min(self.interval, next_vacuum - time.monotonic(),
+                                         next_archive - time.monotonic())))
+            self._wake.clear()
+
+    def stats(self):
+        with self._lock:
+            totals = self._totals
+        with self.pool.connection() as conn:
+            result = pending(conn)
+            if totals is None or time.monotonic() - totals[1] > TOTALS_TTL:
+                totals = (archive.totals(conn), time.monotonic())
+        result["archive"] = totals[0]
+        with self._lock:
+            if self._totals is None or self._totals[1] < totals[1]:
+                self._totals = totals
+            batches = self._batches
+            result.update({
+                "batches": batches,
+                "purged_sessions": self._purged_sessions,
+                "purged_days": self._purged_days,
+                "vacuumed_pages": self._vacuumed_pages,
+                "archived_sessions": self._archived_sessions,
+                "archived_sets": self._archived_sets,
+                "errors": self._errors,
+                "avg_batch_time": self._batch_time / batches if batches else 0.0,
+            })
+        return result
+
+
+compactor = Compactor() if ENABLED else None
+
+
+def start():
+    if compactor is not None:
+        compactor.start()
+        with db.connection() as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+                print("auto_vacuum is off: deleted days free pages inside the file only "
+                      "(python manage.py vacuum, with the bot stopped, turns it on)")
+
+
+def stop():
+    if compactor is not None:
+        compactor.close()
+
+
+def wake():
+    if compactor is not None:
+        compactor.wake()
@@ -0,0 +1,173 @@
+"""Shared SQLite connection pool for workouts.db.
+
+Handlers borrow a long-lived connection with `connection()` instead of
+opening the file on every update.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import metrics
+
+DB_PATH = os.getenv("GYMBRO_DB", "workouts.db")
+POOL_SIZE = int(os.getenv("GYMBRO_DB_POOL_SIZE", "8"))
+
+# applied once per connection, right after it is opened
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",      # safe with WAL, no fsync per commit
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",       # ~16MB page cache per connection
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=ON",         # deleting a day cascades down to Logs
+)
+
+
+class PoolTimeout(sqlite3.OperationalError):
+    """No connection became free within the pool timeout."""
+
+
+class ConnectionPool:
+    """
+    Thread-aware pool of long-lived connections.
+
+    A thread that already holds a connection gets the same one back on a
+    nested borrow, so helpers called from inside a handler never wait on
+    the pool twice.
+    """
+
+    def __init__(self, path=DB_PATH, max_size=POOL_SIZE, timeout=10.0,
+                 statement_cache=256, pragmas=PRAGMAS, factory=None):
+        self.path = path
+        # metrics.TimedConnection times every statement
+        self.factory = factory or metrics.connection_factory()
+        self.pragmas = pragmas
+        self.max_size = max_size
+        self.timeout = timeout
+        # sqlite3 keeps this many prepared statements per connection
+        self.statement_cache = statement_cache
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._all = []
+
+        # stats
+        self._acquired = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path,
+                               timeout=self.timeout,
+                               check_same_thread=False,
+                               cached_statements=self.statement_cache,
+                               factory=self.factory)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._all) < self.max_size:
+                conn = self._connect()
+                self._all.append(conn)
+                return conn
+
+        # pool is exhausted: wait for someone to give a connection back
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolTimeout(f"no free connection after {self.timeout}s")
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._waits += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def acquire(self):
+        held = getattr(self._local, "conn", None)
+        if held is not None:
+            self._local.depth += 1
+            return held
+
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        with self._lock:
+            self._acquired += 1
+        return conn
+
+    def release(self, conn):
+        self._local.depth -= 1
+        if self._local.depth:
+            return
+        self._local.conn = None
+
+        # never hand out a connection with a half-done transaction
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def stats(self):
+        with self._lock:
+            size = len(self._all)
+            waits = self._waits
+            return {
+                "size": size,
+                "max_size": self.max_size,
+                "idle": self._idle.qsize(),
+                "in_use": size - self._idle.qsize(),
+                "acquired": self._acquired,
+                "waits": waits,
+                "wait_time_total": self._wait_total,
+                "wait_time_avg": self._wait_total / waits if waits else 0.0,
+                "wait_time_max": self._wait_max,
+            }
+
+    def close(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        while True:
+            try:
+                self._idle.get_nowait()
+            except queue.Empty:
+                break
+        for conn in conns:
+            conn.close()
+
+
+pool = ConnectionPool()
+
+
+def connection():
+    """Borrow a connection from the shared pool."""
+    return pool.connection()
+
+
+def use(path):
+    """Point the shared pool at another db file (shards.py workers)."""
+    global DB_PATH, pool
+    pool.close()
+    DB_PATH = path
+    pool = ConnectionPool(path)
@@ -0,0 +1,262 @@
+"""
+Offline stand-in for the Telegram Bot API.
+
+Answers the methods the bot uses (sendMessage, editMessageText,
+answerCallbackQuery, getUpdates, setWebhook, ...) with plausible results,
+so the whole bot can be run and load-tested without network access.
+
+    python fakeapi.py --port 8081
+    GYMBRO_API_URL=http://127.0.0.1:8081 python main.py
+"""
+import argparse
+import collections
+import itertools
+import json
+import queue
+import socket
+import threading
+import time
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+# methods whose result is the sent/edited Message
+_MESSAGE_METHODS = {"sendMessage", "editMessageText", "sendDocument", "editMessageReplyMarkup"}
+
+
+class FakeTelegramAPI:
+    """
+    In-process fake Bot API server.
+
+    `latency` delays every answer, `push_update()` feeds getUpdates, and
+    `fail_next()` makes the next calls of a method answer 429.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, log_size=10000):
+        self.latency = latency
+        self.calls = collections.Counter()
+        self.log = collections.deque(maxlen=log_size)
+        self.updates = queue.Queue()
+        self.files = {}
+        self.webhook = {}
+        # chat_id -> params of the last message sent/edited there
+        self.last_messages = {}
+
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        self._failures = collections.defaultdict(collections.deque)
+
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body are separate writes, don't let Nagle hold the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_GET(self):
+                api._serve(self)
+
+            def do_POST(self):
+                api._serve(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def push_update(self, update):
+        self.updates.put(update)
+
+    def add_file(self, content, name="file"):
+        """Make `content` downloadable through getFile. Returns its file_id."""
+        file_id = f"F{next(self._file_ids)}"
+        self.files[file_id] = (f"documents/{file_id}_{name}", content)
+        return file_id
+
+    def fail_next(self, method, times=1, retry_after=1):
+        """Answer the next `times` calls of `method` with 429 Too Many Requests."""
+        with self._lock:
+            self._failures[method].extend([retry_after] * times)
+
+    def last_message(self, chat_id):
+        """Params (text, reply_markup, message_id, ...) of the last message sent/edited in a chat."""
+        return self.last_messages.get(chat_id)
+
+    def calls_total(self, *methods):
+        with self._lock:
+            if not methods:
+                return sum(self.calls.values())
+            return sum(self.calls[m] for m in methods)
+
+    # --- request handling ---
+
+    def _serve(self, request):
+        parts = urlsplit(request.path)
+        segments = parts.path.strip("/").split("/")
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length else b""
+
+        if segments[0] == "file" and len(segments) >= 3:
+            return self._serve_file("/".join(segments[2:]), request)
+        if len(segments) != 2 or not segments[0].startswith("bot"):
+            return self._reply(request, 404, {"ok": False, "error_code": 404,
+                                              "description": "Not Found"})
+
+        method = segments[1]
+        params = dict(parse_qsl(parts.query))
+        params.update(self._parse_body(request.headers.get("Content-Type", ""), body))
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls[method] += 1
+            self.log.append((time.monotonic(), method, params))
+            failures = self._failures.get(method)
+            retry_after = failures.popleft() if failures else None
+
+        if retry_after is not None:
+            return self._reply(request, 429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            })
+        return self._reply(request, 200, {"ok": True, "result": self._result(method, params)})
+
+    @staticmethod
+    def _parse_body(content_type, body):
+        if not body:
+            return {}
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            msg = BytesParser(policy=policy.default).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+            params = {}
+            for part in msg.iter_parts():
+                name = part.get_param("name", header="content-disposition")
+                payload = part.get_payload(decode=True)
+                if part.get_filename():
+                    params[name] = payload
+                else:
+                    params[name] = payload.decode()
+            return params
+        return dict(parse_qsl(body.decode()))
+
+    def _result(self, method, params):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "GymBro", "username": "gymbro_bot"}
+        if method == "getUpdates":
+            return self._get_updates(params)
+        if method == "setWebhook":
+            self.webhook = dict(params)
+            return True
+        if method == "deleteWebhook":
+            self.webhook = {}
+            return True
+        if method == "getFile":
+            path, content = self.files[params["file_id"]]
+            return {"file_id": params["file_id"], "file_unique_id": params["file_id"],
+                    "file_size": len(content), "file_path": path}
+        if method in _MESSAGE_METHODS:
+            return self._message(method, params)
+        return True
+
+    def _message(self, method, params):
+        chat_id = int(params.get("chat_id") or 0)
+        message = {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "GymBro"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        self.last_messages[chat_id] = dict(params, message_id=message["message_id"])
+        if method == "sendDocument":
+            content = params.get("document", b"")
+            if isinstance(content, str):
+                content = content.encode()
+            file_id = self.add_file(content, "document")
+            message["document"] = {"file_id": file_id, "file_unique_id": file_id,
+                                   "file_size": len(content)}
+        return message
+
+    def _get_updates(self, params):
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        try:
+            updates = [self.updates.get(timeout=timeout) if timeout else self.updates.get_nowait()]
+        except queue.Empty:
+            return []
+        while len(updates) < limit:
+            try:
+                updates.append(self.updates.get_nowait())
+            except queue.Empty:
+                break
+        return updates
+
+    def _serve_file(self, path, request):
+        for file_path, content in self.files.values():
+            if file_path == path:
+                request.send_response(200)
+                request.send_header("Content-Type", "application/octet-stream")
+                request.send_header("Content-Length", str(len(content)))
+                request.end_headers()
+                request.wfile.write(content)
+                return
+        self._reply(request, 404, {"ok": False, "error_code": 404, "description": "Not Found"})
+
+    @staticmethod
+    def _reply(request, status, payload):
+        body = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def use(base_url):
+    """Point telebot (sync and async) at a Bot API server, e.g. FakeTelegramAPI.url."""
+    from telebot import apihelper, asyncio_helper
+    apihelper.API_URL = base_url + "/bot{0}/{1}"
+    apihelper.FILE_URL = base_url + "/file/bot{0}/{1}"
+    asyncio_helper.API_URL = apihelper.API_URL
+    asyncio_helper.FILE_URL = apihelper.FILE_URL
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Offline fake Telegram Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every call")
+    args = parser.parse_args()
+
+    api = FakeTelegramAPI(args.host, args.port, latency=args.latency)
+    print(f"Fake Telegram API on {api.url}")
+    try:
+        api.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,212 @@
+"""
+Prebuilt, serialized keyboards.
+
+telebot sends a str reply_markup as is, so keyboards are turned into JSON
+once and reused. The static main keyboard is serialized at import. Inline
+keyboards for day/exercise lists are memoized on the cache.Listing they
+were built from and go away when that list is invalidated.
+
+Day and exercise lists are shown one cache.Page at a time, with ⬅️/➡️
+buttons whose callback_data carries the `after` id of the page to open.
+All callback_data is packed by callbacks.encode.
+"""
+from telebot import types
+
+import callbacks
+from cache import LRUCache
+
+
+def _build_main_keyboard():
+    keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
+
+    # button create
+    btn_add_day = types.KeyboardButton("➕ Добавить день")
+    btn_my_days = types.KeyboardButton("📅 Мои дни")
+    btn_delete_day = types.KeyboardButton("🗑️ Удалить день")
+    btn_stats = types.KeyboardButton("📈 Статистика")
+
+    # keyboard create
+    keyboard.add(btn_add_day, btn_my_days)
+    keyboard.add(btn_delete_day, btn_stats)
+    return keyboard
+
+
+MAIN_KEYBOARD = _build_main_keyboard().to_json()
+
+
+def _add_page_buttons(inline_keyboard, page, action, *ids):
+    """⬅️ / ➡️ row of a cache.Page, nothing when it is the only page."""
+    buttons = []
+    if page.prev_after is not None:
+        buttons.append(types.InlineKeyboardButton(
+            text="⬅️", callback_data=callbacks.encode(action, *ids, page.prev_after)))
+    if page.next_after is not None:
+        buttons.append(types.InlineKeyboardButton(
+            text="➡️", callback_data=callbacks.encode(action, *ids, page.next_after)))
+    if buttons:
+        inline_keyboard.row(*buttons)
+
+
+# kind -> (callback action of a day's button, button label) of the day lists
+DAY_LISTS = {
+    "select": ("select_day", "{}"),
+    "delete": ("delete_day", "❌ {}"),
+    "stats": ("stats_day", "📈 {}"),
+    "records": ("records_day", "🏆 {}"),
+}
+# the kind goes into days_page callbacks by index: append only
+DAY_LIST_KINDS = ("select", "delete", "stats", "records")
+
+
+def _build_days(page, kind):
+    action, label = DAY_LISTS[kind]
+    inline_keyboard = types.InlineKeyboardMarkup()
+    for day_id, day_name in page:
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text=label.format(day_name),
+            callback_data=callbacks.encode(action, day_id)
+        ))
+    _add_page_buttons(inline_keyboard, page, "days_page", DAY_LIST_KINDS.index(kind))
+    return inline_keyboard.to_json()
+
+
+def day_list_keyboard(kind, page):
+    """One page of the user's days (a cache.Page), buttons of DAY_LISTS[kind]."""
+    return page.markup(kind, lambda rows: _build_days(rows, kind))
+
+
+def days_keyboard(page):
+    """show_my_days: one button per day."""
+    return day_list_keyboard("select", page)
+
+
+def delete_days_keyboard(page):
+    """handle_delete_day: same list, ❌ buttons."""
+    return day_list_keyboard("delete", page)
+
+
+def exercises_keyboard(day_id, page):
+    """show_day_exercises: one button per exercise (a cache.Page) + 'add exercise'."""
+    def build(rows):
+        inline_keyboard = types.InlineKeyboardMarkup()
+        for ex_id, ex_name in rows:
+            inline_keyboard.add(types.InlineKeyboardButton(
+                text=ex_name,
+                callback_data=callbacks.encode("log_ex", ex_id)
+            ))
+        _add_page_buttons(inline_keyboard, page, "exercises_page", day_id)
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="➕ Добавить упражнение",
+            callback_data=callbacks.encode("add_ex", day_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="📈 Статистика дня",
+            callback_data=callbacks.encode("stats_day", day_id)
+        ))
+        return inline_keyboard.to_json()
+
+    return page.markup("select", build)
+
+
+def stats_days_keyboard(page):
+    """/stats: one button per day."""
+    return day_list_keyboard("stats", page)
+
+
+def day_stats_keyboard(day_id, page):
+    """show_day_stats: stats of each exercise on the page (a cache.Page) + back to the day."""
+    def build(rows):
+        inline_keyboard = types.InlineKeyboardMarkup()
+        for ex_id, ex_name in rows:
+            inline_keyboard.add(types.InlineKeyboardButton(
+                text=f"📈 {ex_name}",
+                callback_data=callbacks.encode("stats_ex", ex_id)
+            ))
+        _add_page_buttons(inline_keyboard, page, "stats_day_page", day_id)
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="🏆 Рекорды дня",
+            callback_data=callbacks.encode("records_day", day_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="⬅️ Назад к упражнениям",
+            callback_data=callbacks.encode("select_day", day_id)
+        ))
+        return inline_keyboard.to_json()
+
+    return page.markup("stats", build)
+
+
+# exercise_id -> markup; only depends on ids that never change
+_summary_keyboards = LRUCache(10000)
+
+
+def summary_keyboard(exercise_id, day_id):
+    """show_exercise_summary: 'log new' + 'back to exercises'."""
+    def build(_):
+        inline_keyboard = types.InlineKeyboardMarkup()
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="🏋️‍♂️ Записать новую тренировку",
+            callback_data=callbacks.encode("log_new", exercise_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="📈 Статистика",
+            callback_data=callbacks.encode("stats_ex", exercise_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="⬅️ Назад к упражнениям",
+            callback_data=callbacks.encode("select_day", day_id)
+        ))
+        return inline_keyboard.to_json()
+
+    return _summary_keyboards.get_or_load((exercise_id, day_id), build)
+
+
+_exercise_stats_keyboards = LRUCache(10000)
+
+
+def exercise_stats_keyboard(exercise_id, day_id):
+    """show_exercise_stats: back to the summary / the day's stats."""
+    def build(_):
+        inline_keyboard = types.InlineKeyboardMarkup()
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="⬅️ Назад к упражнению",
+            callback_data=callbacks.encode("log_ex", exercise_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="📈 Статистика дня",
+            callback_data=callbacks.encode("stats_day", day_id)
+        ))
+        return inline_keyboard.to_json()
+
+    return _exercise_stats_keyboards.get_or_load((exercise_id, day_id), build)
+
+
+def records_days_keyboard(page):
+    """/records: one button per day."""
+    return day_list_keyboard("records", page)
+
+
+_day_records_keyboards = LRUCache(10000)
+
+
+def day_records_keyboard(day_id):
+    """show_day_records: back to the day."""
+    def build(_):
+        inline_keyboard = types.InlineKeyboardMarkup()
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="📈 Статистика дня",
+            callback_data=callbacks.encode("stats_day", day_id)
+        ))
+        inline_keyboard.add(types.InlineKeyboardButton(
+            text="⬅️ Назад к упражнениям",
+            callback_data=callbacks.encode("select_day", day_id)
+        ))
+        return inline_keyboard.to_json()
+
+    return _day_records_keyboards.get_or_load(day_id, build)
+
+
+def stats():
+    return {"summary": _summary_keyboards.stats(),
+            "exercise_stats": _exercise_stats_keyboards.stats(),
+            "day_records": _day_records_keyboards.stats()}
@@ -0,0 +1,235 @@
+"""
+Writes to Logs and the derived tables that have to stay in step with it.
+
+Every save is one row in Sessions (exercise + started_at, unix seconds)
+and its sets are Logs rows pointing at it, so "last session" or "sessions
+in a date range" are range scans of idx_sessions_exercise_time.
+ExerciseSummary keeps the last two sessions of every exercise so that
+show_exercise_summary is a single-row read however long the history is.
+PersonalRecords (records.py) is updated in the same transaction.
+"""
+import time
+from datetime import datetime
+
+import records
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def format_date(timestamp, fmt=DATE_FORMAT):
+    """unix seconds -> server local time text, the way dates are shown/exported"""
+    return datetime.fromtimestamp(timestamp).strftime(fmt)
+
+
+def parse_date(text):
+    """DATE_FORMAT text (server local time) -> unix seconds"""
+    return int(datetime.strptime(text, DATE_FORMAT).timestamp())
+
+
+def format_weight(weight):
+    return str(int(weight) if weight.is_integer() else weight)
+
+
+def format_weights(sets):
+    """
+    Weights of a session for the summary, shown after the first set's reps.
+    A set with other reps than the one before it is written as `2x90`, so
+    `reps weights` reads back the same through parser.py.
+    """
+    tokens = []
+    reps = sets[0][0]
+    for set_reps, weight in sets:
+        if set_reps == reps:
+            tokens.append(format_weight(weight))
+        else:
+            tokens.append(f"{set_reps}x{format_weight(weight)}")
+            reps = set_reps
+    return " ".join(tokens)
+
+
+def record_sets(conn, exercise_id, sets, started_at=None):
+    """
+    Insert one session of (reps, weight) sets and update the summary and
+    the personal records. Runs inside the caller's transaction, the caller
+    commits. Returns the records the session beat (see records.update).
+    """
+    if started_at is None:
+        started_at = int(time.time())
+
+    session_id = conn.execute(
+        "INSERT INTO Sessions (exercise_id, started_at) VALUES (?, ?)",
+        (exercise_id, started_at)
+    ).lastrowid
+    # executemany - inserts all reps with one quick query
+    conn.executemany(
+        "INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)",
+        [(session_id, reps, weight) for reps, weight in sets]
+    )
+    update_summary(conn, exercise_id, started_at, sets)
+    return records.update(conn, exercise_id, started_at, sets)
+
+
+def add_exercise(conn, day_id, exercise_name, sets):
+    """Create an exercise together with its first session. Returns the new id."""
+    cursor = conn.execute(
+        "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+        (day_id, exercise_name)
+    )
+    record_sets(conn, cursor.lastrowid, sets)
+    return cursor.lastrowid
+
+
+def record_workout(conn, day_id, exercise_id, entries):
+    """
+    Save a parsed multi-line message (parser.parse) in one transaction, all
+    sessions with the same started_at. An entry named after an exercise of
+    the day is logged to it, an unknown name creates the exercise, name None
+    goes to `exercise_id`. `day_id` may be None when `exercise_id` is given.
+    Returns (day_id, [(exercise_id, name, created, sets, beaten records)]).
+    """
+    # the day may have been deleted since the user was asked for the sets
+    if day_id is None:
+        row = conn.execute(
+            "SELECT e.day_id FROM Exercises e "
+            "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+            "WHERE e.exercise_id = ?", (exercise_id,)).fetchone()
+        if row is None:
+            raise LookupError(f"exercise {exercise_id} not found")
+        day_id = row[0]
+    elif not conn.execute("SELECT 1 FROM TrainingDays WHERE day_id = ? AND deleted_at IS NULL",
+                          (day_id,)).fetchone():
+        raise LookupError(f"day {day_id} not found")
+
+    names = {}
+    by_name = {}
+    for ex_id, name in conn.execute(
+            "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ?", (day_id,)):
+        names[ex_id] = name
+        by_name.setdefault(name.casefold(), ex_id)
+
+    # resolve names first: a named line and an unnamed one can be the same exercise
+    workout = {}
+    for name, sets in entries:
+        created = False
+        if name is None:
+            ex_id = exercise_id
+        else:
+            ex_id = by_name.get(name.casefold())
+            if ex_id is None:
+                ex_id = conn.execute(
+                    "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                    (day_id, name)
+                ).lastrowid
+                names[ex_id] = name
+                by_name[name.casefold()] = ex_id
+                created = True
+        if ex_id in workout:
+            workout[ex_id][2].extend(sets)
+        else:
+            workout[ex_id] = (names.get(ex_id, ""), created, list(sets))
+
+    started_at = int(time.time())
+    saved = []
+    for ex_id, (name, created, sets) in workout.items():
+        beaten = record_sets(conn, ex_id, sets, started_at)
+        saved.append((ex_id, name, created, sets, beaten))
+    return day_id, saved
+
+
+def sessions(conn, exercise_id, since=None, until=None, limit=-1, newest_first=False):
+    """
+    [(session_id, started_at)] of an exercise with since <= started_at < until
+    (either end open when None), oldest first unless `newest_first`.
+    """
+    order = "DESC" if newest_first else "ASC"
+    return conn.execute(
+        "SELECT session_id, started_at FROM Sessions "
+        "WHERE exercise_id = ? AND started_at >= ? AND started_at < ? "
+        f"ORDER BY started_at {order}, session_id {order} LIMIT ?",
+        (exercise_id, -2 ** 63 if since is None else since,
+         2 ** 63 - 1 if until is None else until, limit)
+    ).fetchall()
+
+
+def session_sets(conn, session_id):
+    """[(reps, weight)] of one session in the order they were logged."""
+    return conn.execute(
+        "SELECT reps, weight FROM Logs WHERE session_id = ? ORDER BY log_id",
+        (session_id,)
+    ).fetchall()
+
+
+def update_summary(conn, exercise_id, started_at, sets):
+    row = conn.execute(
+        "SELECT last_at FROM ExerciseSummary WHERE exercise_id = ?",
+        (exercise_id,)
+    ).fetchone()
+
+    weights = format_weights(sets)
+    if row is None:
+        conn.execute(
+            "INSERT INTO ExerciseSummary (exercise_id, last_at, last_reps, last_weights) "
+            "VALUES (?, ?, ?, ?)",
+            (exercise_id, started_at, sets[0][0], weights)
+        )
+    elif row[0] <= started_at:
+        conn.execute(
+            "UPDATE ExerciseSummary SET "
+            "prev_at = last_at, prev_reps = last_reps, prev_weights = last_weights, "
+            "last_at = ?, last_reps = ?, last_weights = ? "
+            "WHERE exercise_id = ?",
+            (started_at, sets[0][0], weights, exercise_id)
+        )
+    else:
+        # back-dated write (imports), the order has to come from Sessions
+        rebuild_summary(conn, exercise_id)
+
+
+def has_sessions(conn):
+    """False while migrations 5-7 run on an old db (before Sessions exists)"""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Sessions'"
+    ).fetchone() is not None
+
+
+def rebuild_summary(conn, exercise_id):
+    """Recompute one exercise's summary row from its last two sessions."""
+    if not has_sessions(conn):
+        # migration 5 on a db that still has dated Logs, migration 9 fills it
+        return
+    last_two = sessions(conn, exercise_id, limit=2, newest_first=True)
+    if not last_two:
+        conn.execute("DELETE FROM ExerciseSummary WHERE exercise_id = ?", (exercise_id,))
+        return
+
+    values = []
+    for session_id, started_at in last_two:
+        sets = session_sets(conn, session_id)
+        values += [started_at, sets[0][0], format_weights(sets)]
+    values += [None] * (6 - len(values))
+
+    conn.execute(
+        "INSERT OR REPLACE INTO ExerciseSummary "
+        "(exercise_id, last_at, last_reps, last_weights, prev_at, prev_reps, prev_weights) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (exercise_id, *values)
+    )
+
+
+def rebuild_summaries(conn, batch_size=500):
+    """Backfill ExerciseSummary for every exercise, committing per batch."""
+    done = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            "SELECT exercise_id FROM Exercises WHERE exercise_id > ? "
+            "ORDER BY exercise_id LIMIT ?",
+            (last_id, batch_size)
+        )]
+        if not ids:
+            return done
+        for exercise_id in ids:
+            rebuild_summary(conn, exercise_id)
+        conn.commit()
+        done += len(ids)
+        last_id = ids[-1]
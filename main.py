@@ -1,9 +1,31 @@
 import telebot
-from telebot import types
 import sqlite3
 import os
-from dotenv import load_dotenv
+import argparse
+import tempfile
+from concurrent.futures import Future
 from datetime import datetime
+import aio
+import backup
+import cache
+import callbacks
+import compaction
+import fakeapi
+import keyboards
+import webhook
+import db
+import migrations
+import outbound
+import logbook
+import parser
+import metrics
+import records
+import stats
+import transfer
+import writer
+from state import State, make_store
+from telebot.apihelper import ApiException
+from dotenv import load_dotenv
 
 load_dotenv()
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
@@ -13,81 +35,90 @@ if TELEGRAM_TOKEN is None:
     print("Ошибка: Не удалось загрузить TELEGRAM_TOKEN.")
     exit() 
 
+# point the bot at another Bot API server, e.g. fakeapi.py for offline runs
+if os.getenv("GYMBRO_API_URL"):
+    fakeapi.use(os.getenv("GYMBRO_API_URL"))
+
 def init_db():
-    """Initialization + db create."""
+    """Initialization + db create (runs pending migrations)."""
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        
-        # day tren table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS TrainingDays (
-            day_id INTEGER PRIMARY KEY AUTOINCREMENT, 
-            user_id INTEGER NOT NULL,
-            day_name TEXT NOT NULL
-        )
-        ''')
-        
-        # day ex table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Exercises (
-            exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            day_id INTEGER NOT NULL,
-            exercise_name TEXT NOT NULL,
-            FOREIGN KEY (day_id) REFERENCES TrainingDays (day_id)
-        )
-        ''')
-
-        # logs table
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS Logs (
-            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            exercise_id INTEGER NOT NULL,
-            date TEXT NOT NULL,
-            weight REAL NOT NULL,
-            reps INTEGER NOT NULL,
-            FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
-        )
-        ''')
-        
-        conn.commit()
-        print("'workouts.db' successfully initialized.")
+        with db.connection() as conn:
+            migrations.migrate(conn)
+            # every hot query must hit its index
+            for problem in migrations.check_query_plans(conn):
+                print(f"Query plan warning: {problem}")
+        states.purge_expired()
+        print(f"'{db.DB_PATH}' successfully initialized.")
     
     except sqlite3.Error as e:
         print(f"SQLite error: {e}")
-    
-    finally:
-        if conn:
-            conn.close()
 
-bot = telebot.TeleBot(TELEGRAM_TOKEN)
+# handler threads; raise it when write-behind is on so saves can group-commit
+bot = telebot.TeleBot(TELEGRAM_TOKEN, num_threads=int(os.getenv("GYMBRO_THREADS", "2")))
+
+# replies go through the rate-limited outbound queue (see outbound.py)
+outbox = outbound.make_outbox(bot)
+
+# what each chat is expected to answer next (see state.py)
+states = make_store()
+
+# stats exported on /metrics (see metrics.py)
+metrics.register("db_pool", db.pool.stats)
+metrics.register("outbox", outbox.stats)
+metrics.register("cache", cache.stats)
+metrics.register("keyboards", keyboards.stats)
+metrics.register("stats_cache", stats.cache_stats)
+metrics.register("callbacks", callbacks.router.stats)
+if writer.writer is not None:
+    metrics.register("writer", writer.writer.stats)
+if compaction.compactor is not None:
+    metrics.register("compaction", compaction.compactor.stats)
+if backup.backups is not None:
+    metrics.register("backup", backup.backups.stats)
 
 def get_main_keyboard():
-    keyboard = types.ReplyKeyboardMarkup(row_width=2, resize_keyboard=True)
-    
-    # button create
-    btn_add_day = types.KeyboardButton("➕ Добавить день")
-    btn_my_days = types.KeyboardButton("📅 Мои дни")
-    btn_delete_day = types.KeyboardButton("🗑️ Удалить день") 
-    
-    # keyboard create
-    keyboard.add(btn_add_day, btn_my_days)
-    keyboard.add(btn_delete_day) 
-    return keyboard
+    # serialized once at startup (keyboards.py)
+    return keyboards.MAIN_KEYBOARD
+
+# message above each paginated day list (keyboards.DAY_LISTS)
+DAY_LIST_TEXTS = {
+    "select": "Выбери день для просмотра или логгирования:",
+    "delete": "Какой день ты хочешь удалить?",
+    "stats": "Статистика какого дня?",
+    "records": "Рекорды какого дня?",
+}
+
+# pending answers go first, like next-step handlers used to
+@bot.message_handler(func=lambda message: states.get(message.chat.id) is not None,
+                     content_types=['text'])
+def handle_pending_step(message):
+    step = states.pop(message.chat.id)
+    if step is None: # expired in the meantime
+        return
+    state, ref_id = step
+    if state == State.AWAIT_DAY_NAME:
+        save_day(message)
+    elif state == State.AWAIT_NEW_EXERCISE:
+        parse_new_exercise_and_logs(message, ref_id)
+    elif state == State.AWAIT_LOGS:
+        parse_logs_for_existing_exercise(message, ref_id)
+    elif state == State.AWAIT_IMPORT:
+        outbox.send_message(message.chat.id, "Импорт отменён.",
+                         reply_markup=get_main_keyboard())
 
 @bot.message_handler(commands=['start'])
 def send_welcome(message):
-    bot.send_message(message.chat.id, 
+    outbox.send_message(message.chat.id, 
                      "Это твой GymBro. let's get it started!", 
                      reply_markup=get_main_keyboard())
     
 @bot.message_handler(func=lambda message: message.text == "➕ Добавить день")
 def handle_add_day(message):
-    msg = bot.send_message(message.chat.id, 
-                           "Введи названия нового дня тренировок;")
+    outbox.send_message(message.chat.id, 
+                     "Введи названия нового дня тренировок;")
     
 # pass to the save_day function(IMPORTANT)
-    bot.register_next_step_handler(msg, save_day)
+    states.set(message.chat.id, State.AWAIT_DAY_NAME)
 
 def save_day(message):
     """Save log names in workouts.db."""
@@ -95,404 +126,274 @@ def save_day(message):
     day_name = message.text
     
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        # specify user_id to find which user it is.
-        cursor.execute(
-            "INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)", 
-            (user_id, day_name)
-        )
-        conn.commit()
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            # specify user_id to find which user it is.
+            cursor.execute(
+                "INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)", 
+                (user_id, day_name)
+            )
+            conn.commit()
+        cache.invalidate_days(user_id)
         
-        bot.send_message(message.chat.id, 
+        outbox.send_message(message.chat.id, 
                          f"👍 День '{day_name}' успешно добавлен!", 
                          reply_markup=get_main_keyboard())
     
     except sqlite3.Error as e:
         print(f"Ошибка при добавлении дня в БД: {e}")
-        bot.send_message(message.chat.id, 
+        outbox.send_message(message.chat.id, 
                          "Произошла ошибка при сохранении. Попробуй еще раз.", 
                          reply_markup=get_main_keyboard())
-    finally:
-        if conn:
-            conn.close()
 
 @bot.message_handler(func=lambda message: message.text == "📅 Мои дни")
 def show_my_days(message):
     user_id = message.from_user.id
     
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        
-        # get id and name of day from db
-        cursor.execute(
-            "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ?", 
-            (user_id,)
-        )
-        days = cursor.fetchall()
+        # first page of days (from cache or db)
+        days = cache.get_day_page(user_id)
         
         if not days:
-            bot.send_message(message.chat.id, 
+            outbox.send_message(message.chat.id, 
                              "У тебя пока нет тренировочного дня. \nНажми '➕ Добавить день', чтобы создать первый.", 
                              reply_markup=get_main_keyboard())
             return
 
-        # creating an inline keyboard
-        inline_keyboard = types.InlineKeyboardMarkup()
-        
-        for day_id, day_name in days:
-            button = types.InlineKeyboardButton(
-                text=day_name, 
-                callback_data=f"select_day_{day_id}" 
-            )
-            inline_keyboard.add(button)
-            
-        bot.send_message(message.chat.id, 
-                         "Выбери день для просмотра или логгирования:", 
-                         reply_markup=inline_keyboard)
+        # inline keyboard, cached together with the page
+        outbox.send_message(message.chat.id, 
+                         DAY_LIST_TEXTS["select"], 
+                         reply_markup=keyboards.days_keyboard(days))
 
     except sqlite3.Error as e:
         print(f"Ошибка при чтении дней из БД: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при получении дней.")
-    finally:
-        if conn:
-            conn.close()
+        outbox.send_message(message.chat.id, "Произошла ошибка при получении дней.")
+
+# every inline button goes through the router: a dict lookup by action code
+@bot.callback_query_handler(func=lambda call: True)
+def handle_callback(call):
+    route = callbacks.decode(call.data)
+    if route is None:
+        # old-style, foreign or tampered button, the db is never touched
+        outbox.answer_callback_query(call.id, text="Кнопка устарела, открой меню заново.")
+        return
+    action, ids = route
+    action.handler(call, *ids)
+
+@callbacks.route("days_page")
+def show_days_page(call, kind_index, after):
+    # ⬅️/➡️ of a day list: same message, another page
+    if kind_index >= len(keyboards.DAY_LIST_KINDS):
+        outbox.answer_callback_query(call.id, text="Ошибка!")
+        return
+    kind = keyboards.DAY_LIST_KINDS[kind_index]
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('select_day_'))
-def show_day_exercises(call):
-    day_id = int(call.data.split('_')[-1])
-    
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ?", 
-            (day_id,)
-        )
-        exercises = cursor.fetchall()
-        
-        inline_keyboard = types.InlineKeyboardMarkup()
-        
-        # create buttons for each ex
-        if exercises:
-            for ex_id, ex_name in exercises:
-                button = types.InlineKeyboardButton(
-                    text=ex_name,
-                    callback_data=f"log_ex_{ex_id}" # some necessary logs
-                )
-                inline_keyboard.add(button)
+        days = cache.get_day_page(call.from_user.id, after)
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
+                              message_id=call.message.message_id,
+                              text=DAY_LIST_TEXTS[kind],
+                              reply_markup=keyboards.day_list_keyboard(kind, days))
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении дней: {e}")
+        outbox.answer_callback_query(call.id, text="Ошибка!")
+
+@callbacks.route("select_day")
+def show_day_exercises(call, day_id):
+    show_exercises_page(call, day_id)
+
+# ⬅️/➡️ of a day's exercises
+@callbacks.route("exercises_page")
+def show_exercises_page(call, day_id, after=0):
+    try:
+        if cache.day_name(call.from_user.id, day_id) is None:
+            outbox.answer_callback_query(call.id, text="Этот день удален.")
+            return
+        exercises = cache.get_exercise_page(day_id, after)
         
-        # new button
-        add_button = types.InlineKeyboardButton(
-            text="➕ Добавить упражнение",
-            callback_data=f"add_ex_{day_id}" 
-        )
-        inline_keyboard.add(add_button)
-        bot.answer_callback_query(call.id)
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        # buttons for each ex + "add" button
+        inline_keyboard = keyboards.exercises_keyboard(day_id, exercises)
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text="Выбери упражнение для логгирования или добавь новое:",
                               reply_markup=inline_keyboard)
 
     except sqlite3.Error as e:
         print(f"Ошибка при получении упражнений: {e}")
-        bot.answer_callback_query(call.id, text="Ошибка!")
-    finally:
-        if conn:
-            conn.close()
+        outbox.answer_callback_query(call.id, text="Ошибка!")
 
 @bot.message_handler(func=lambda message: message.text == "🗑️ Удалить день")
 def handle_delete_day(message):
     user_id = message.from_user.id
     
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        
-        # Take the ID and name of the day from ‘workout.bd’.
-        cursor.execute(
-            "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ?", 
-            (user_id,)
-        )
-        days = cursor.fetchall()
+        # Take the ID and name of the day from ‘workout.bd’ (or the cache).
+        days = cache.get_day_page(user_id)
         
         if not days:
-            bot.send_message(message.chat.id, 
+            outbox.send_message(message.chat.id, 
                              "Нечего удалять.", 
                              reply_markup=get_main_keyboard())
             return
-        inline_keyboard = types.InlineKeyboardMarkup()
-        
-        for day_id, day_name in days:
-            # text - what the user sees.
-            # callback_data - what bot will receive. 
-            # “hide” the ID of the day in callback_data
-            button = types.InlineKeyboardButton(
-                text=f"❌ {day_name}", 
-                callback_data=f"delete_day_{day_id}"
-            )
-            inline_keyboard.add(button)
-            
-        bot.send_message(message.chat.id, 
-                         "Какой день ты хочешь удалить?", 
-                         reply_markup=inline_keyboard)
+        # “hide” the ID of the day in callback_data (keyboards.py)
+        outbox.send_message(message.chat.id, 
+                         DAY_LIST_TEXTS["delete"], 
+                         reply_markup=keyboards.delete_days_keyboard(days))
 
     except sqlite3.Error as e:
         print(f"Ошибка при получении дней для удаления: {e}")
-    finally:
-        if conn:
-            conn.close()
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('delete_day_'))
-def process_day_deletion(call):
+@callbacks.route("delete_day")
+def process_day_deletion(call, day_id_to_delete):
     try:
-        day_id_to_delete = int(call.data.split('_')[-1])
-    except (ValueError, IndexError):
-        bot.answer_callback_query(call.id, text="Ошибка! Неверный ID дня.")
-        return
-
-    try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-
-        # --- Deletion logs + ex(3 steps) ---
-        cursor.execute("SELECT exercise_id FROM Exercises WHERE day_id = ?", (day_id_to_delete,))
-        exercise_ids_to_delete = [row[0] for row in cursor.fetchall()]
-
-        if exercise_ids_to_delete:
-            placeholders = ','.join('?' * len(exercise_ids_to_delete))
-            cursor.execute(f"DELETE FROM Logs WHERE exercise_id IN ({placeholders})", 
-                           exercise_ids_to_delete)
-        cursor.execute("DELETE FROM Exercises WHERE day_id = ?", (day_id_to_delete,))
-        cursor.execute("DELETE FROM TrainingDays WHERE day_id = ?", (day_id_to_delete,))
-        
-        conn.commit()
-
-        bot.answer_callback_query(call.id, text="День удален!")
+        # only marks the day: its history is purged in the background (compaction.py)
+        deleted = writer.write(compaction.soft_delete_day, call.from_user.id, day_id_to_delete)
+        cache.invalidate_days(call.from_user.id)
+        cache.invalidate_exercises(day_id_to_delete)
+        compaction.wake()
+
+        if not deleted:
+            outbox.answer_callback_query(call.id, text="Этот день уже удален.")
+            return
+        outbox.answer_callback_query(call.id, text="День удален!")
         
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text="✅ День был успешно удален.")
         
-        bot.send_message(call.message.chat.id, 
+        outbox.send_message(call.message.chat.id, 
                          "Выбери следующее действие:", 
                          reply_markup=get_main_keyboard())
 
     except sqlite3.Error as e:
         print(f"Ошибка при удалении дня: {e}")
-        bot.answer_callback_query(call.id, text="Ошибка при удалении.")
-    finally:
-        if conn:
-            conn.close()
-def save_logs_to_db(message, exercise_id, sets_to_log, existing_conn=None):
+        outbox.answer_callback_query(call.id, text="Ошибка при удалении.")
+
+def save_workout(message, day_id, exercise_id, entries):
     """
-    Secondary function: saves the list of sets (reps, weight) 
-    to the Logs table.
+    Secondary function: saves every exercise of a parsed message (parser.py)
+    in one transaction and answers with one confirmation.
     """
-    conn = None
     try:
-        if existing_conn:
-            conn = existing_conn
-        else:
-            conn = sqlite3.connect('workouts.db')
-        
-        cursor = conn.cursor()
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        logs_data = []
-        for reps, weight in sets_to_log:
-            logs_data.append((exercise_id, current_date, weight, reps))
-        
-        # executemany - inserts all reps with one quick query
-        cursor.executemany(
-            "INSERT INTO Logs (exercise_id, date, weight, reps) VALUES (?, ?, ?, ?)",
-            logs_data
-        )
-        if not existing_conn:
-            conn.commit()
-        if not existing_conn:
-             bot.send_message(message.chat.id, 
-                              f"🎉 {len(sets_to_log)} подходов записано.", 
-                              reply_markup=get_main_keyboard())
-
+        # returns only once everything is committed, with the records beaten
+        day_id, saved = writer.write(logbook.record_workout, day_id, exercise_id, entries,
+                                     rows=sum(len(sets) + 2 for _, sets in entries))
+    except LookupError:
+        # the day (or the exercise's day) was deleted meanwhile
+        outbox.send_message(message.chat.id, "Ошибка: день или упражнение уже удалены.",
+                         reply_markup=get_main_keyboard())
+        return
     except sqlite3.Error as e:
         print(f"Ошибка сохранения лога: {e}")
-        bot.send_message(message.chat.id, "Ошибка сохранения в БД!")
-    finally:
-        if conn and not existing_conn:
-            conn.close()
+        outbox.send_message(message.chat.id, "Ошибка сохранения в БД!")
+        return
+
+    if any(created for _, _, created, _, _ in saved):
+        cache.invalidate_exercises(day_id)
+    for saved_id, *_ in saved:
+        stats.invalidate(saved_id)
+    outbox.send_message(message.chat.id, 
+                     workout_text(saved), 
+                     reply_markup=get_main_keyboard())
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('add_ex_'))
-def handle_add_new_exercise(call):
+def workout_text(saved):
+    if len(saved) == 1:
+        _, name, created, sets, beaten = saved[0]
+        if created:
+            text = f"👍 Упражнение '{name}' добавлено и {len(sets)} подходов записано!"
+        else:
+            text = f"🎉 {len(sets)} подходов записано."
+        congratulation = records.congratulation(beaten)
+        if congratulation:
+            text += "\n\n" + congratulation
+        return text
+
+    text = f"🎉 Тренировка записана, {sum(len(sets) for *_, sets, _ in saved)} подходов:\n"
+    congratulations = []
+    for _, name, created, sets, beaten in saved:
+        text += f"\n• {name}{' (новое)' if created else ''}: {len(sets)}"
+        congratulation = records.congratulation(beaten)
+        if congratulation:
+            congratulations.append(f"{name}:\n{congratulation}")
+    if congratulations:
+        text += "\n\n" + "\n\n".join(congratulations)
+    return text
+
+@callbacks.route("add_ex")
+def handle_add_new_exercise(call, day_id):
     """
     Start logging NEW exercise.
     Asks the user for the full line.
     """
-    day_id = int(call.data.split('_')[-1])
-    
-    bot.answer_callback_query(call.id)
-    msg = bot.edit_message_text(chat_id=call.message.chat.id,
-                                message_id=call.message.message_id,
-                                text="Введи |название|, |подходы| и |веса| в одну строку:\n"
-                                     "Пример: `Жим 2 20 15`\n")
+    if cache.day_name(call.from_user.id, day_id) is None:
+        outbox.answer_callback_query(call.id, text="Этот день удален.")
+        return
+    outbox.answer_callback_query(call.id)
+    outbox.edit_message_text(chat_id=call.message.chat.id,
+                          message_id=call.message.message_id,
+                          text="Введи |название|, |подходы| и |веса|, по строке на упражнение:\n"
+                               "Пример: `Жим 2 20 15`\n"
+                               "или `Жим 3x80 3x85 2x90`\n"
+                               "`Присед 5x100 5x110`\n")
     
-    bot.register_next_step_handler(msg, parse_new_exercise_and_logs, day_id)
+    states.set(call.message.chat.id, State.AWAIT_NEW_EXERCISE, day_id)
 
 
 def parse_new_exercise_and_logs(message, day_id):
-    parts = message.text.strip().split()
-    
-    # check if right format
-    if not parts or len(parts) < 3:
-        msg = bot.reply_to(message, "🚫 Ошибка формата Bro. \n")                              
-        bot.register_next_step_handler(msg, parse_new_exercise_and_logs, day_id)
-        return
-
-    exercise_name = parts[0]
-    sets_to_log = []
-
-# validation
     try:
-        common_reps = int(parts[1])
-        if common_reps <= 0:
-            raise ValueError("Подходы должны быть > 0")
-
-        weights_list_str = parts[2:]
-        if not weights_list_str:
-            raise ValueError("Нужно указать хотя бы один вес")
-
-        for w_str in weights_list_str:
-            weight = float(w_str.replace(',', '.'))
-            if weight < 0:
-                raise ValueError("Вес не может быть отрицательным ಠ_ಠ")
-            
-            sets_to_log.append((common_reps, weight))
-
-    except ValueError as e:
-        print(f"Ошибка валидации: {e}")
-        msg = bot.reply_to(message, "🚫 Ошибка формата Bro. \n")
-        bot.register_next_step_handler(msg, parse_new_exercise_and_logs, day_id)
+        # every line needs its exercise name
+        entries = parser.parse(message.text, default_name=False)
+    except parser.ParseError as e:
+        print(f"Ошибка валидации: {e.reason}")
+        outbox.reply_to(message, f"🚫 Ошибка формата Bro.\n{e}\n\nПопробуй еще раз:")
+        states.set(message.chat.id, State.AWAIT_NEW_EXERCISE, day_id)
         return
-    conn = None
-    try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)", 
-            (day_id, exercise_name)
-        )
-        new_exercise_id = cursor.lastrowid
-        # IMPORTANT: commit immediately after creating the ex
-        conn.commit() 
-        save_logs_to_db(message, new_exercise_id, sets_to_log, existing_conn=conn)
-        conn.commit() # logs commit
-        
-        bot.send_message(message.chat.id, 
-                         f"👍 Упражнение '{exercise_name}' добавлено и {len(sets_to_log)} подходов записано!",
-                         reply_markup=get_main_keyboard())
 
-    except sqlite3.Error as e:
-        print(f"Ошибка при создании упражнения/сохранении логов: {e}")
-        bot.send_message(message.chat.id, "Произошла ошибка при сохранении.")
-    finally:
-        if conn:
-            conn.close()
+    save_workout(message, day_id, None, entries)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('log_ex_'))
-def show_exercise_summary(call):
-    exercise_id = int(call.data.split('_')[-1])
-    
+@callbacks.route("log_ex")
+def show_exercise_summary(call, exercise_id):
     conn = None
     try:
-        conn = sqlite3.connect('workouts.db')
+        conn = db.pool.acquire()
         cursor = conn.cursor()
         
+        # one row: the exercise + its last two sessions (see logbook.py)
         cursor.execute(
-            "SELECT exercise_name, day_id FROM Exercises WHERE exercise_id = ?", 
+            "SELECT e.exercise_name, e.day_id, s.last_at, s.last_reps, s.last_weights, "
+            "s.prev_at, s.prev_reps, s.prev_weights FROM Exercises e "
+            "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+            "LEFT JOIN ExerciseSummary s ON s.exercise_id = e.exercise_id "
+            "WHERE e.exercise_id = ?", 
             (exercise_id,)
         )
         result = cursor.fetchone()
         if not result:
-            bot.answer_callback_query(call.id, text="Ошибка: Упражнение не найдено.")
+            outbox.answer_callback_query(call.id, text="Ошибка: Упражнение не найдено.")
             return
             
-        ex_name, day_id = result
-    
-        cursor.execute(
-            "SELECT date, reps, weight FROM Logs WHERE exercise_id = ? ORDER BY date DESC",
-            (exercise_id,)
-        )
-        logs = cursor.fetchall()
+        ex_name, day_id, last_at, last_reps, last_weights, prev_at, prev_reps, prev_weights = result
         
         response_text = f"**Упражнение: {ex_name}**\n\n"
-        if not logs:
+        if last_at is None:
             response_text += "Записей пока нет."
-            last_date_str = None
         else:
-            last_date_str = logs[0][0] 
-            last_date_obj = datetime.strptime(last_date_str, "%Y-%m-%d %H:%M:%S")
-            
-            session_logs = [log for log in logs if log[0] == last_date_str]
-            
-            common_reps = session_logs[0][1] 
-            
-            weights_list = []
-            for _, _, weight in session_logs:
-                weight_str = int(weight) if weight.is_integer() else weight
-                weights_list.append(str(weight_str))
-            
-            weights_str_formatted = " ".join(weights_list)
-            
-            response_text += f"**Последняя запись ({last_date_obj.strftime('%Y-%m-%d')}):**\n"
-            response_text += f"  `{common_reps} {weights_str_formatted}`\n"
+            response_text += f"**Последняя запись ({logbook.format_date(last_at, '%Y-%m-%d')}):**\n"
+            response_text += f"  `{last_reps} {last_weights}`\n"
         
-        if last_date_str:
-            previous_date_str = None
-            previous_session_logs = []
-            
-            # find the first date that is NOT equal to the last date
-            for log_date_str, reps, weight in logs:
-                if log_date_str != last_date_str:
-                    if previous_date_str is None:
-                        previous_date_str = log_date_str # e.g., '2025-11-02 14:00:00'
-                    
-                    if log_date_str == previous_date_str:
-                        previous_session_logs.append((reps, weight))
-                    else:
-                        break
-            
-            if previous_session_logs:
-                previous_date_obj = datetime.strptime(previous_date_str, "%Y-%m-%d %H:%M:%S")
-                
-                common_reps = previous_session_logs[0][0] # (reps)
-                weights_list = []
-                for reps_val, weight_val in previous_session_logs:
-                    weight_str = int(weight_val) if weight_val.is_integer() else weight_val
-                    weights_list.append(str(weight_str))
-                
-                weights_str_formatted = " ".join(weights_list)
-                
-                response_text += f"\n**Прошлая запись ({previous_date_obj.strftime('%Y-%m-%d')}):**\n"
-                response_text += f"  `{common_reps} {weights_str_formatted}`\n"
+        if prev_at is not None:
+            response_text += f"\n**Прошлая запись ({logbook.format_date(prev_at, '%Y-%m-%d')}):**\n"
+            response_text += f"  `{prev_reps} {prev_weights}`\n"
 
         response_text += "\nЧто делаем?"
 
-        inline_keyboard = types.InlineKeyboardMarkup()
-        
-        inline_keyboard.add(types.InlineKeyboardButton(
-            text="🏋️‍♂️ Записать новую тренировку",
-            callback_data=f"log_new_{exercise_id}"
-        ))
-        
-        inline_keyboard.add(types.InlineKeyboardButton(
-            text="⬅️ Назад к упражнениям",
-            callback_data=f"select_day_{day_id}"
-        ))
+        inline_keyboard = keyboards.summary_keyboard(exercise_id, day_id)
 
-        bot.answer_callback_query(call.id)
-        bot.edit_message_text(chat_id=call.message.chat.id,
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
                               message_id=call.message.message_id,
                               text=response_text,
                               reply_markup=inline_keyboard,
@@ -500,83 +401,295 @@ def show_exercise_summary(call):
 
     except sqlite3.Error as e:
         print(f"Ошибка при получении сводки: {e}")
-        bot.answer_callback_query(call.id, text="Ошибка БД.")
+        outbox.answer_callback_query(call.id, text="Ошибка БД.")
     finally:
         if conn:
-            conn.close()
+            db.pool.release(conn)
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('log_new_'))
-def handle_log_existing_exercise_new(call):
-    exercise_id = int(call.data.split('_')[-1])
-    
+@callbacks.route("log_new")
+def handle_log_existing_exercise_new(call, exercise_id):
     try:
-        conn = sqlite3.connect('workouts.db')
-        cursor = conn.cursor()
-        cursor.execute("SELECT exercise_name FROM Exercises WHERE exercise_id = ?", (exercise_id,))
-        ex_name = cursor.fetchone()[0]
+        with db.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT e.exercise_name FROM Exercises e "
+                           "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+                           "WHERE e.exercise_id = ?", (exercise_id,))
+            found = cursor.fetchone()
     except Exception:
-        ex_name = "выбранное упражнение"
-    finally:
-        if conn:
-            conn.close()
-
-    bot.answer_callback_query(call.id)
-    msg = bot.edit_message_text(chat_id=call.message.chat.id,
-                                message_id=call.message.message_id,
-                                text=f"Запись для: **{ex_name}**.\n\n"
-                                     f"Введи |подходы| и |веса| в одну строку:\n"
-                                     "**Пример: `3 80 85 90`\n",
-                                parse_mode="Markdown")
+        found = ("выбранное упражнение",)
+    if found is None:
+        outbox.answer_callback_query(call.id, text="Ошибка: Упражнение не найдено.")
+        return
+    ex_name = found[0]
+
+    outbox.answer_callback_query(call.id)
+    outbox.edit_message_text(chat_id=call.message.chat.id,
+                          message_id=call.message.message_id,
+                          text=f"Запись для: **{ex_name}**.\n\n"
+                               f"Введи |подходы| и |веса| в одну строку:\n"
+                               "**Пример: `3 80 85 90` или `3x80 3x85 2x90`\n"
+                               "Другие упражнения дня можно дописать строками ниже, с названием.\n",
+                          parse_mode="Markdown")
     
-    # previous parser
-    bot.register_next_step_handler(msg, parse_logs_for_existing_exercise, exercise_id)
+    # parse_logs_for_existing_exercise
+    states.set(call.message.chat.id, State.AWAIT_LOGS, exercise_id)
+
+@bot.message_handler(commands=['stats'])
+@bot.message_handler(func=lambda message: message.text == "📈 Статистика")
+def handle_stats(message):
+    try:
+        days = cache.get_day_page(message.from_user.id)
+
+        if not days:
+            outbox.send_message(message.chat.id, 
+                             "Статистики пока нет: сначала добавь день и запиши подходы.", 
+                             reply_markup=get_main_keyboard())
+            return
+        outbox.send_message(message.chat.id, 
+                         DAY_LIST_TEXTS["stats"], 
+                         reply_markup=keyboards.stats_days_keyboard(days))
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении дней для статистики: {e}")
+        outbox.send_message(message.chat.id, "Произошла ошибка при получении дней.")
+
+@callbacks.route("stats_day")
+def show_day_stats(call, day_id):
+    show_day_stats_page(call, day_id)
+
+# ⬅️/➡️ of a day's stats
+@callbacks.route("stats_day_page")
+def show_day_stats_page(call, day_id, after=0):
+    try:
+        # None for a deleted day (an old keyboard)
+        day_name = cache.day_name(call.from_user.id, day_id)
+        if day_name is None:
+            outbox.answer_callback_query(call.id, text="Этот день удален.")
+            return
+        exercises = cache.get_exercises(day_id)
+        # all the day's exercises in one query (or from the stats cache),
+        # the day totals need them; lines and buttons are one page
+        stats_by_id = stats.get_many([ex_id for ex_id, _ in exercises])
+        page = cache.get_exercise_page(day_id, after)
+
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
+                              message_id=call.message.message_id,
+                              text=stats.day_text(day_name, exercises, stats_by_id, shown=page),
+                              reply_markup=keyboards.day_stats_keyboard(day_id, page),
+                              parse_mode="Markdown")
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении статистики дня: {e}")
+        outbox.answer_callback_query(call.id, text="Ошибка БД.")
+
+@callbacks.route("stats_ex")
+def show_exercise_stats(call, exercise_id):
+    try:
+        with db.connection() as conn:
+            result = conn.execute(
+                "SELECT e.exercise_name, e.day_id FROM Exercises e "
+                "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+                "WHERE e.exercise_id = ?", (exercise_id,)
+            ).fetchone()
+        if not result:
+            outbox.answer_callback_query(call.id, text="Ошибка: Упражнение не найдено.")
+            return
+        ex_name, day_id = result
+
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
+                              message_id=call.message.message_id,
+                              text=stats.exercise_text(ex_name, stats.get(exercise_id)),
+                              reply_markup=keyboards.exercise_stats_keyboard(exercise_id, day_id),
+                              parse_mode="Markdown")
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении статистики: {e}")
+        outbox.answer_callback_query(call.id, text="Ошибка БД.")
+
+@bot.message_handler(commands=['records'])
+def handle_records(message):
+    try:
+        days = cache.get_day_page(message.from_user.id)
+
+        if not days:
+            outbox.send_message(message.chat.id, 
+                             "Рекордов пока нет: сначала добавь день и запиши подходы.", 
+                             reply_markup=get_main_keyboard())
+            return
+        outbox.send_message(message.chat.id, 
+                         DAY_LIST_TEXTS["records"], 
+                         reply_markup=keyboards.records_days_keyboard(days))
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении дней для рекордов: {e}")
+        outbox.send_message(message.chat.id, "Произошла ошибка при получении дней.")
+
+@callbacks.route("records_day")
+def show_day_records(call, day_id):
+    try:
+        day_name = cache.day_name(call.from_user.id, day_id)
+        if day_name is None:
+            outbox.answer_callback_query(call.id, text="Этот день удален.")
+            return
+        exercises = cache.get_exercises(day_id)
+        # PersonalRecords rows only, however long the history is
+        with db.connection() as conn:
+            records_by_id = records.for_exercises(conn, [ex_id for ex_id, _ in exercises])
+
+        outbox.answer_callback_query(call.id)
+        outbox.edit_message_text(chat_id=call.message.chat.id,
+                              message_id=call.message.message_id,
+                              text=records.day_text(day_name, exercises, records_by_id),
+                              reply_markup=keyboards.day_records_keyboard(day_id),
+                              parse_mode="Markdown")
+
+    except sqlite3.Error as e:
+        print(f"Ошибка при получении рекордов: {e}")
+        outbox.answer_callback_query(call.id, text="Ошибка БД.")
 
 def parse_logs_for_existing_exercise(message, exercise_id):
-    parts = message.text.strip().split()
-    
-    # first check
-    if not parts or len(parts) < 2:
-        msg = bot.reply_to(message, "🚫 Ошибка формата. \n"
-                                    "Нужен минимум: `подходы Вес`\n"
-                                    "Попробуй еще раз:")
-        bot.register_next_step_handler(msg, parse_logs_for_existing_exercise, exercise_id)
+    try:
+        # lines without a name are the picked exercise
+        entries = parser.parse(message.text, default_name=True)
+    except parser.ParseError as e:
+        print(f"Ошибка валидации: {e.reason}")
+        outbox.reply_to(message, f"🚫 Ошибка формата Bro.\n{e}\n\n"
+                              "Пример: `3x80 3x85 2x90` или `3 80 85 90`\n"
+                              "It's not that difficult. Try again:")
+        states.set(message.chat.id, State.AWAIT_LOGS, exercise_id)
+        return
+
+    # If everything complete, save the logs.
+    save_workout(message, None, exercise_id, entries)
+
+@bot.message_handler(commands=['export'])
+def handle_export(message):
+    """/export [csv|jsonl] - all days, exercises and sets as a file."""
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "csv"
+    if fmt not in transfer.FORMATS:
+        outbox.reply_to(message, "Формат: `/export csv` или `/export jsonl`", parse_mode="Markdown")
         return
 
-    sets_to_log = []
+    # streamed to disk, not into memory (transfer.py)
+    out = tempfile.NamedTemporaryFile("w", suffix=f".{fmt}", encoding="utf-8",
+                                      newline="", delete=False)
     try:
-        # second check
-        common_reps = int(parts[0])
-        if common_reps <= 0:
-            raise ValueError("подходы должны быть > 0")
-
-        # third check
-        weights_list_str = parts[1:]
-        if not weights_list_str:
-            raise ValueError("Нужно указать хотя бы один вес")
-
-        for w_str in weights_list_str:
-            weight = float(w_str.replace(',', '.'))
-            if weight < 0:
-                raise ValueError("Вес не может быть отрицательным ಠ_ಠ")
-            
-            sets_to_log.append((common_reps, weight))
-
-    except ValueError as e:
-        print(f"Ошибка валидации: {e}")
-        msg = bot.reply_to(message, "🚫 Ошибка формата Bro. \n"
-                                    "Пример: `3 80 85 90`\n"
-                                    "It's not that difficult. Try again:")
-        bot.register_next_step_handler(msg, parse_logs_for_existing_exercise, exercise_id)
+        with out, db.connection() as conn:
+            count = transfer.export_user(conn, message.from_user.id, out, fmt)
+    except sqlite3.Error as e:
+        print(f"Ошибка экспорта: {e}")
+        os.remove(out.name)
+        outbox.send_message(message.chat.id, "Ошибка при экспорте.")
         return
 
-    # If everything complete, save the logs.
-    save_logs_to_db(message, exercise_id, sets_to_log)
+    if not count:
+        os.remove(out.name)
+        outbox.send_message(message.chat.id, "Нечего экспортировать.",
+                         reply_markup=get_main_keyboard())
+        return
+    send_file(message.chat.id, out.name, f"gymbro-{datetime.now():%Y-%m-%d}.{fmt}",
+              f"📦 {count} строк")
+
+def send_file(chat_id, path, name, caption):
+    """Send a temp file as a document and delete it once it's sent."""
+    def cleanup(_=None):
+        os.remove(path)
+
+    # the outbox opens the file for every attempt (a 429 is retried)
+    result = outbox.send_document_file(chat_id, path, visible_file_name=name, caption=caption)
+    if isinstance(result, Future): # queued in the outbox
+        result.add_done_callback(cleanup)
+    else:
+        cleanup()
+
+@bot.message_handler(commands=['import'])
+def handle_import(message):
+    outbox.send_message(message.chat.id,
+                     "Пришли файл CSV или JSONL с колонками:\n"
+                     "`day, exercise, date, reps, weight`\n"
+                     "(такой же, как из /export). Любой текст - отмена.",
+                     parse_mode="Markdown")
+    states.set(message.chat.id, State.AWAIT_IMPORT)
+
+@bot.message_handler(content_types=['document'],
+                     func=lambda message: (states.get(message.chat.id) or (None,))[0] == State.AWAIT_IMPORT)
+def handle_import_file(message):
+    states.discard(message.chat.id)
+    user_id = message.from_user.id
+    fmt = transfer.guess_format(message.document.file_name)
+    outbox.send_message(message.chat.id, "⏳ Импортирую...")
+
+    try:
+        file_info = bot.get_file(message.document.file_id)
+        # rows are read straight off the download, chunk by chunk
+        with transfer.open_telegram_file(TELEGRAM_TOKEN, file_info.file_path) as stream, \
+                db.connection() as conn:
+            report = transfer.import_user(conn, user_id, stream, fmt)
+    except (ValueError, OSError, ApiException, sqlite3.Error) as e:
+        print(f"Ошибка импорта: {e}")
+        outbox.send_message(message.chat.id, f"🚫 Импорт не удался: {e}",
+                         reply_markup=get_main_keyboard())
+        return
+    finally:
+        # earlier chunks are committed even if a later one failed
+        cache.invalidate_days(user_id)
+        for day_id, _ in cache.get_days(user_id):
+            cache.invalidate_exercises(day_id)
+            for exercise_id, _ in cache.get_exercises(day_id):
+                stats.invalidate(exercise_id)
+
+    text = (f"✅ Импорт завершён.\n"
+            f"Подходов добавлено: {report['inserted']}\n"
+            f"Уже были: {report['skipped_existing']}\n"
+            f"Новых дней: {report['days_created']}, упражнений: {report['exercises_created']}")
+    if report["errors"]:
+        text += f"\nСтрок с ошибками: {report['errors']}\n" + "\n".join(report["error_lines"])
+    outbox.send_message(message.chat.id, text, reply_markup=get_main_keyboard())
+
+# time every handler above + every Bot API call
+metrics.instrument_bot(bot, callbacks.router)
+metrics.instrument_api()
+
+def shutdown():
+    # flush queued sets before the pool goes away; purge batches go through the writer
+    backup.stop()
+    compaction.stop()
+    writer.stop()
+    outbox.close()
+    print(f"Outbox stats: {outbox.stats()}")
+    print(f"DB pool stats: {db.pool.stats()}")
+    print(f"Cache stats: {cache.stats()}")
+    db.pool.close()
 
 # --- main part(starttttt) ---
 if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="GymBro bot")
+    arg_parser.add_argument("--mode", choices=["sync", "async", "webhook"],
+                            default=os.getenv("GYMBRO_MODE", "sync"),
+                            help="sync: TeleBot polling, async: AsyncTeleBot + per-user executor, "
+                                 "webhook: local HTTP server + worker pool")
+    arg_parser.add_argument("--webhook-url", default=os.getenv("GYMBRO_WEBHOOK_URL"),
+                            help="public URL to register with setWebhook")
+    args = arg_parser.parse_args()
+
     # init db ¯\(°_o)/¯
     init_db()
+    writer.start()
+    compaction.start()
+    backup.start()
+    metrics.serve()
     
     # bot start(hell yeahhhh)
-    print("Бот успешно запущен...")
-    bot.polling(none_stop=True)
\ No newline at end of file
+    print(f"Бот успешно запущен ({args.mode})...")
+    try:
+        if args.mode == "async":
+            aio.run(bot, TELEGRAM_TOKEN)
+        elif args.mode == "webhook":
+            webhook.run(bot, public_url=args.webhook_url)
+        else:
+            bot.polling(none_stop=True)
+    finally:
+        shutdown()
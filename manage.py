@@ -0,0 +1,251 @@
+"""
+Maintenance commands for workouts.db.
+
+    python manage.py migrate
+    python manage.py check-plans
+    python manage.py rebuild-summaries
+    python manage.py rebuild-records
+    python manage.py export --user 123 --output history.csv
+    python manage.py import --user 123 --input history.jsonl
+    python manage.py reshard --from 1 --to 4
+    python manage.py compact
+    python manage.py vacuum
+    python manage.py archive --days 180
+    python manage.py backup
+    python manage.py backups
+    python manage.py restore --latest
+"""
+import argparse
+import os
+import sys
+
+import archive
+import backup
+import compaction
+import db
+import logbook
+import migrations
+import records
+import shards
+import transfer
+import writer
+
+
+def cmd_migrate(args):
+    with db.connection() as conn:
+        before = migrations.get_version(conn)
+        migrations.migrate(conn, target=args.target)
+        print(f"Schema version: {before} -> {migrations.get_version(conn)}")
+
+
+def cmd_check_plans(args):
+    with db.connection() as conn:
+        problems = migrations.check_query_plans(conn)
+    for problem in problems:
+        print(problem)
+    if problems:
+        return 1
+    print(f"All {len(migrations.HOT_QUERIES)} hot queries use their indexes.")
+    return 0
+
+
+def cmd_rebuild_summaries(args):
+    with db.connection() as conn:
+        done = logbook.rebuild_summaries(conn, batch_size=args.batch_size)
+    print(f"Rebuilt summaries for {done} exercises.")
+
+
+def cmd_rebuild_records(args):
+    with db.connection() as conn:
+        done = records.rebuild_all(conn, batch_size=args.batch_size)
+    print(f"Rebuilt personal records for {done} exercises.")
+
+
+def cmd_export(args):
+    fmt = args.format or transfer.guess_format(args.output)
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8",
+                                                      newline="")
+    try:
+        with db.connection() as conn:
+            count = transfer.export_user(conn, args.user, out, fmt)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f"Exported {count} rows for user {args.user}.", file=sys.stderr)
+
+
+def cmd_import(args):
+    fmt = args.format or transfer.guess_format(args.input)
+    stream = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8-sig",
+                                                       newline="")
+    try:
+        with db.connection() as conn:
+            report = transfer.import_user(conn, args.user, stream, fmt,
+                                          chunk_size=args.chunk_size, chunk_ms=args.chunk_ms)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    print(f"Imported {report['inserted']} sets for user {args.user} "
+          f"({report['rows']} rows, {report['skipped_existing']} already there, "
+          f"{report['days_created']} new days, {report['exercises_created']} new exercises).")
+    if report["errors"]:
+        print(f"{report['errors']} bad rows:")
+        for line in report["error_lines"]:
+            print(f"  {line}")
+    # the running bot caches day/exercise lists, restart it to see new ones
+    return 1 if report["errors"] else 0
+
+
+def cmd_reshard(args):
+    result = shards.reshard(args.old, args.new)
+    print(f"Moved {result['users']} users ({result['sets']} sets) "
+          f"from {args.old} to {args.new} shards.")
+    if args.new < args.old:
+        print("Now empty, can be deleted: " +
+              ", ".join(shards.shard_path(i) for i in range(args.new, args.old)))
+
+
+def cmd_compact(args):
+    compactor = compaction.Compactor(batch_size=args.batch_size)
+    sessions, days = compactor.purge_all()
+    freed = compactor.vacuum()
+    print(f"Purged {days} deleted days ({sessions} sessions), "
+          f"{freed} free pages returned to the file.")
+
+
+def cmd_vacuum(args):
+    # VACUUM rewrites the whole file, auto_vacuum only changes with it
+    with db.connection() as conn:
+        before = conn.execute("PRAGMA page_count").fetchone()[0]
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        after = conn.execute("PRAGMA page_count").fetchone()[0]
+    print(f"Vacuumed: {before} -> {after} pages, auto_vacuum=incremental.")
+
+
+def cmd_archive(args):
+    before = archive.cutoff(args.days)
+    with db.connection() as conn:
+        sessions, sets = archive.archive_all(conn, writer.write, before, args.batch_size)
+        freed = compaction.vacuum(conn, 0)
+        cold = archive.totals(conn)
+    print(f"Archived {sessions} sessions ({sets} sets), {freed} free pages returned "
+          f"to the file. Cold tier: {cold['sessions']} sessions in {cold['chunks']} "
+          f"months, {cold['bytes']} bytes.")
+
+
+def cmd_backup(args):
+    result = backup.take(db.DB_PATH, args.dir, pages=args.pages)
+    removed = backup.prune(db.DB_PATH, args.dir)
+    print(f"Backup {result['path']}: {result['size']} bytes in {result['seconds']:.2f}s "
+          f"({result['steps']} steps), {len(removed)} old snapshots removed.")
+
+
+def cmd_backups(args):
+    found = backup.snapshots(db.DB_PATH, args.dir)
+    for path, taken in found:
+        print(f"{taken:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path):>12}  {path}")
+    if not found:
+        print(f"No snapshots in {backup.backup_dir(db.DB_PATH, args.dir)}.")
+
+
+def cmd_restore(args):
+    if args.latest:
+        found = backup.snapshots(db.DB_PATH, args.dir)
+        if not found:
+            print(f"No snapshots in {backup.backup_dir(db.DB_PATH, args.dir)}.")
+            return 1
+        path = found[0][0]
+    else:
+        path = args.snapshot
+    db.pool.close()
+    try:
+        saved = backup.restore(path, db.DB_PATH, args.dir)
+    except ValueError as e:
+        print(e)
+        return 1
+    print(f"Restored {db.DB_PATH} from {path}." +
+          (f" The db before the restore is in {saved}." if saved else ""))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="GymBro db maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("migrate", help="apply pending schema migrations")
+    p.add_argument("--target", type=int, default=migrations.LATEST_VERSION)
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("check-plans", help="EXPLAIN QUERY PLAN for hot handler queries")
+    p.set_defaults(func=cmd_check_plans)
+
+    p = sub.add_parser("rebuild-summaries", help="backfill ExerciseSummary from Sessions")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.set_defaults(func=cmd_rebuild_summaries)
+
+    p = sub.add_parser("rebuild-records", help="backfill PersonalRecords from Sessions")
+    p.add_argument("--batch-size", type=int, default=500)
+    p.set_defaults(func=cmd_rebuild_records)
+
+    p = sub.add_parser("export", help="stream a user's days, exercises and sets to CSV/JSONL")
+    p.add_argument("--user", type=int, required=True)
+    p.add_argument("--output", default="-", help="file, '-' for stdout")
+    p.add_argument("--format", choices=transfer.FORMATS, help="default: from the file name, csv")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("import", help="load a user's history from CSV/JSONL")
+    p.add_argument("--user", type=int, required=True)
+    p.add_argument("--input", default="-", help="file, '-' for stdin")
+    p.add_argument("--format", choices=transfer.FORMATS, help="default: from the file name, csv")
+    p.add_argument("--chunk-size", type=int, default=transfer.CHUNK_SIZE,
+                   help="most rows per transaction")
+    p.add_argument("--chunk-ms", type=float, default=transfer.CHUNK_MS,
+                   help="about how long a transaction holds the write lock")
+    p.set_defaults(func=cmd_import)
+
+    p = sub.add_parser("reshard", help="move users between shard files (bot stopped)")
+    p.add_argument("--from", dest="old", type=int, required=True, help="current shard count")
+    p.add_argument("--to", dest="new", type=int, required=True, help="new shard count")
+    p.set_defaults(func=cmd_reshard)
+
+    p = sub.add_parser("compact", help="purge soft-deleted days now + incremental vacuum")
+    p.add_argument("--batch-size", type=int, default=compaction.BATCH_SESSIONS,
+                   help="sessions per transaction")
+    p.set_defaults(func=cmd_compact)
+
+    p = sub.add_parser("vacuum", help="rewrite the db with auto_vacuum=incremental (bot stopped)")
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser("archive", help="move sessions older than --days to the cold tier now")
+    p.add_argument("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS)
+    p.add_argument("--batch-size", type=int, default=archive.ARCHIVE_BATCH,
+                   help="exercises per read")
+    p.set_defaults(func=cmd_archive)
+
+    p = sub.add_parser("backup", help="online snapshot of the db now (the bot may run)")
+    p.add_argument("--dir", help="default: GYMBRO_BACKUP_DIR or backups/ next to the db")
+    p.add_argument("--pages", type=int, default=backup.PAGES, help="pages per backup step")
+    p.set_defaults(func=cmd_backup)
+
+    p = sub.add_parser("backups", help="list snapshots, newest first")
+    p.add_argument("--dir")
+    p.set_defaults(func=cmd_backups)
+
+    p = sub.add_parser("restore", help="check a snapshot and copy it over the db (bot stopped)")
+    p.add_argument("--dir")
+    which = p.add_mutually_exclusive_group(required=True)
+    which.add_argument("--snapshot", help="snapshot file")
+    which.add_argument("--latest", action="store_true", help="the newest snapshot")
+    p.set_defaults(func=cmd_restore)
+
+    args = parser.parse_args(argv)
+    try:
+        return args.func(args) or 0
+    finally:
+        writer.stop()
+        db.pool.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""
+Hot-path instrumentation.
+
+- every message/callback handler is timed (instrument_bot)
+- every SQL statement run through a pooled connection is timed
+  (TimedConnection, used by db.ConnectionPool)
+- every Telegram Bot API request is timed on its own (instrument_api)
+- pool/outbox/cache/writer stats are exported as gauges (register)
+
+serve() exposes all of it in Prometheus text format on /metrics.
+With GYMBRO_SLOW_MS set, a handler that takes longer is written to
+GYMBRO_SLOW_LOG as one JSON line with every query (expanded by sqlite's
+trace callback, with its time) and API call it made. Replies queued in
+the Outbox are sent from its threads after the handler returns: they are
+tracked by their future and the line is written once the last is sent.
+
+GYMBRO_METRICS=0 turns the timing off entirely.
+"""
+import bisect
+import contextlib
+import functools
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.getenv("GYMBRO_METRICS", "1") == "1"
+METRICS_HOST = os.getenv("GYMBRO_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("GYMBRO_METRICS_PORT", "0"))  # 0 = no endpoint
+SLOW_MS = float(os.getenv("GYMBRO_SLOW_MS", "0"))            # 0 = no slow log
+SLOW_LOG = os.getenv("GYMBRO_SLOW_LOG", "slow_requests.log")
+
+# seconds
+HANDLER_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SQL_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1)
+
+# a slow request keeps at most this many statements
+MAX_LOGGED_QUERIES = 200
+
+
+class Histogram:
+    """Cumulative-bucket histogram, one series per label value tuple."""
+
+    def __init__(self, name, help, labels, buckets=HANDLER_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[i] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for label_values, counts in sorted(series.items()):
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for le, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{le}"}} {cumulative}')
+            cumulative += counts[-2]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {counts[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{{{_labels(self.labels, label_values)}}} {value}")
+        return lines
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+handler_seconds = Histogram("gymbro_handler_seconds", "Time spent in bot handlers.",
+                            ("handler",))
+handler_errors = Counter("gymbro_handler_errors_total", "Exceptions raised by bot handlers.",
+                         ("handler",))
+sql_seconds = Histogram("gymbro_sql_seconds", "Time to execute a SQL statement (first row).",
+                        ("statement",), SQL_BUCKETS)
+sql_errors = Counter("gymbro_sql_errors_total", "SQL statements that raised.", ("statement",))
+api_seconds = Histogram("gymbro_telegram_api_seconds", "Telegram Bot API request time.",
+                        ("method",))
+api_errors = Counter("gymbro_telegram_api_errors_total", "Failed Telegram Bot API requests.",
+                     ("method", "code"))
+
+_collectors = {}
+_local = threading.local()
+
+
+def register(name, stats):
+    """Export the numbers of `stats()` (a dict, may be nested) as gymbro_<name>_* gauges."""
+    _collectors[name] = stats
+
+
+# --- per-request context (slow log) ---
+
+def _request():
+    return getattr(_local, "request", None)
+
+
+def track(future):
+    """
+    A reply of the current request went to another thread: its API time
+    counts and the slow log waits for `future`. Returns the request to
+    run the call under (attributed()), None outside a traced handler.
+    """
+    request = _request()
+    if request is not None:
+        request["futures"].append(future)
+    return request
+
+
+@contextlib.contextmanager
+def attributed(request):
+    """Count what runs inside toward `request` (from track()), on any thread."""
+    previous = _request()
+    _local.request = request
+    try:
+        yield
+    finally:
+        _local.request = previous
+
+
+def _log_when_sent(handler, elapsed, update, request):
+    futures = request["futures"]
+    if not futures:
+        _log_slow(handler, elapsed, update, request)
+        return
+    lock = threading.Lock()
+    left = [len(futures)]
+
+    def sent(_):
+        with lock:
+            left[0] -= 1
+            last = not left[0]
+        if last:
+            _log_slow(handler, elapsed, update, request)
+
+    for future in futures:
+        future.add_done_callback(sent)
+
+
+def _log_slow(handler, elapsed, update, request):
+    chat = getattr(update, "chat", None) or getattr(getattr(update, "message", None), "chat", None)
+    entry = {
+        "time": datetime.now().isoformat(timespec="milliseconds"),
+        "handler": handler,
+        "ms": round(elapsed * 1000, 3),
+        "chat_id": getattr(chat, "id", None),
+        "queries": request["queries"],
+        "dropped_queries": request["dropped"],
+        "api_ms": round(sum(call["ms"] for call in request["api"]), 3),
+        "api": request["api"],
+    }
+    try:
+        with open(SLOW_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Не удалось записать slow log: {e}")
+
+
+# --- handlers ---
+
+def timed_handler(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(update, *args, **kwargs):
+        request = None
+        if SLOW_MS and _request() is None:
+            request = _local.request = {"queries": [], "dropped": 0, "api": [], "traced": [],
+                                        "futures": []}
+        started = time.perf_counter()
+        try:
+            return func(update, *args, **kwargs)
+        except Exception:
+            handler_errors.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            handler_seconds.observe(elapsed, name)
+            if request is not None:
+                _local.request = None
+                if elapsed * 1000 >= SLOW_MS:
+                    _log_when_sent(name, elapsed, update, request)
+
+    return wrapper
+
+
+def instrument_bot(bot, router=None):
+    """
+    Wrap every registered message and callback handler, and the actions
+    of a callbacks.Router. Call after registering them.
+    """
+    if not ENABLED:
+        return
+    for handler in bot.message_handlers + bot.callback_query_handlers:
+        handler["function"] = timed_handler(handler["function"])
+    if router is not None:
+        router.wrap(timed_handler)
+
+
+# --- SQL ---
+
+_IN_LIST = re.compile(r"\?(\s*,\s*\?)+")
+_SPACES = re.compile(r"\s+")
+_statement_names = {}
+
+
+def statement_label(sql):
+    """Statement text as a label: whitespace collapsed, IN (?,?,?) lists folded."""
+    label = _statement_names.get(sql)
+    if label is None:
+        label = _IN_LIST.sub("?, ...", _SPACES.sub(" ", sql).strip())
+        if len(_statement_names) < 10000:
+            _statement_names[sql] = label
+    return label
+
+
+def _timed_sql(func, sql, args, many=False):
+    request = _request()
+    traced = len(request["traced"]) if request is not None else 0
+    started = time.perf_counter()
+    try:
+        return func(sql, *args)
+    except sqlite3.Error:
+        sql_errors.inc(statement_label(sql))
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        sql_seconds.observe(elapsed, statement_label(sql))
+        if request is not None:
+            queries = request["queries"]
+            if len(queries) >= MAX_LOGGED_QUERIES:
+                request["dropped"] += 1
+            else:
+                statements = request["traced"][traced:]
+                # sqlite3 opens transactions itself, right before the first write
+                for statement in statements:
+                    if statement.rstrip() == "BEGIN":
+                        queries.append({"sql": "BEGIN (implicit)"})
+                statements = [s for s in statements if s.rstrip() != "BEGIN"]
+                entry = {"ms": round(elapsed * 1000, 3),
+                         "sql": statements[0] if statements else statement_label(sql)}
+                if many:
+                    entry["rows"] = len(statements)
+                queries.append(entry)
+            del request["traced"][traced:]
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, *args):
+        return _timed_sql(super().execute, sql, args)
+
+    def executemany(self, sql, *args):
+        return _timed_sql(super().executemany, sql, args, many=True)
+
+
+class TimedConnection(sqlite3.Connection):
+    """sqlite3 connection factory that times every statement (see db.ConnectionPool)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if SLOW_MS:
+            # expanded SQL (with values) for the slow log
+            self.set_trace_callback(_trace)
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    # Connection.execute would skip TimedCursor.execute, go through cursor()
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        _timed_sql(lambda _: super(TimedConnection, self).commit(), "COMMIT", ())
+
+
+def _trace(statement):
+    request = _request()
+    if request is not None:
+        request["traced"].append(statement)
+
+
+def connection_factory():
+    return TimedConnection if ENABLED else sqlite3.Connection
+
+
+# --- Telegram API ---
+
+def instrument_api():
+    """Time every request telebot makes (apihelper._make_request)."""
+    from telebot import apihelper
+
+    if not ENABLED or getattr(apihelper._make_request, "timed", False):
+        return
+    make_request = apihelper._make_request
+
+    @functools.wraps(make_request)
+    def timed_request(token, method_name, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return make_request(token, method_name, *args, **kwargs)
+        except Exception as e:
+            api_errors.inc(method_name, getattr(e, "error_code", type(e).__name__))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            api_seconds.observe(elapsed, method_name)
+            request = _request()
+            if request is not None:
+                request["api"].append({"method": method_name, "ms": round(elapsed * 1000, 3)})
+
+    timed_request.timed = True
+    apihelper._make_request = timed_request
+
+
+# --- export ---
+
+def _gauges(prefix, stats, lines):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            _gauges(name, value, lines)
+        elif isinstance(value, (int, float)):
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {float(value)}")
+
+
+def render():
+    lines = []
+    for metric in (handler_seconds, handler_errors, sql_seconds, sql_errors,
+                   api_seconds, api_errors):
+        lines.extend(metric.render())
+    for name, stats in list(_collectors.items()):
+        try:
+            _gauges(f"gymbro_{name}", stats(), lines)
+        except Exception as e:
+            print(f"Ошибка метрик ({name}): {e}")
+    return "\n".join(lines) + "\n"
+
+
+def serve(port=METRICS_PORT, host=METRICS_HOST):
+    """Start the /metrics endpoint in a daemon thread. Returns the server (None if port is 0)."""
+    if not port:
+        return None
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
@@ -0,0 +1,614 @@
+"""
+Versioned schema migrations for workouts.db.
+
+The schema version lives in `PRAGMA user_version`. Every migration runs
+in its own transaction together with the version bump, so a crash
+leaves the db at the last fully applied version. A migration that is a
+generator (big backfills) is committed at every `yield` as well and has
+to pick up where it left off when it runs again after a crash.
+"""
+import inspect
+import os
+import sqlite3
+
+import logbook
+import records
+
+
+def _m001_base_tables(conn):
+    # same tables init_db used to create, old dbs already have them
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS TrainingDays (
+        day_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        day_name TEXT NOT NULL
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Exercises (
+        exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day_id INTEGER NOT NULL,
+        exercise_name TEXT NOT NULL,
+        FOREIGN KEY (day_id) REFERENCES TrainingDays (day_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Logs (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exercise_id INTEGER NOT NULL,
+        date TEXT NOT NULL,
+        weight REAL NOT NULL,
+        reps INTEGER NOT NULL,
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+    )
+    ''')
+
+
+def _m002_days_by_user(conn):
+    # covers show_my_days / handle_delete_day without touching the table
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_days_user "
+        "ON TrainingDays (user_id, day_id, day_name)"
+    )
+
+
+def _m003_exercises_by_day(conn):
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_exercises_day "
+        "ON Exercises (day_id, exercise_id, exercise_name)"
+    )
+
+
+def _m004_logs_by_exercise_date(conn):
+    # exercise history comes straight out of the index, already sorted
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_logs_exercise_date "
+        "ON Logs (exercise_id, date, reps, weight)"
+    )
+
+
+def _m005_exercise_summary(conn):
+    # last two sessions per exercise, kept up to date by logbook.record_sets
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ExerciseSummary (
+        exercise_id INTEGER PRIMARY KEY,
+        last_date TEXT NOT NULL,
+        last_reps INTEGER NOT NULL,
+        last_weights TEXT NOT NULL,
+        prev_date TEXT,
+        prev_reps INTEGER,
+        prev_weights TEXT,
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+    )
+    ''')
+    # existing history gets summarised right away
+    for (exercise_id,) in conn.execute("SELECT exercise_id FROM Exercises").fetchall():
+        logbook.rebuild_summary(conn, exercise_id)
+
+
+def _m006_conversation_state(conn):
+    # pending next steps (state.SqliteStateStore), survive restarts
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS ConversationState (
+        chat_id INTEGER PRIMARY KEY,
+        state INTEGER NOT NULL,
+        ref_id INTEGER,
+        expires_at REAL NOT NULL
+    )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_state_expires ON ConversationState (expires_at)"
+    )
+
+
+def _m007_personal_records(conn):
+    # best weight per rep count / e1RM / session volume, kept up to date
+    # by logbook.record_sets; WITHOUT ROWID so an exercise's rows sit together
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS PersonalRecords (
+        exercise_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        reps INTEGER NOT NULL,
+        value REAL NOT NULL,
+        date TEXT NOT NULL,
+        PRIMARY KEY (exercise_id, kind, reps),
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+    ) WITHOUT ROWID
+    ''')
+    # existing history gets its records right away
+    for (exercise_id,) in conn.execute("SELECT exercise_id FROM Exercises").fetchall():
+        records.rebuild(conn, exercise_id)
+
+
+# 'YYYY-MM-DD HH:MM:SS' (server local time, as the bot used to write it) -> unix seconds
+_EPOCH_SQL = "CAST(strftime('%s', {}, 'utc') AS INTEGER)"
+MIGRATION_BATCH = int(os.getenv("GYMBRO_MIGRATION_BATCH", "50000"))
+
+
+def _m008_sessions(conn):
+    # one row per logging action, Logs rows point at it instead of
+    # carrying a date string each
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS Sessions (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exercise_id INTEGER NOT NULL,
+        started_at INTEGER NOT NULL,
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+    )
+    ''')
+    # last / previous session and date ranges are range scans of this
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_exercise_time "
+        "ON Sessions (exercise_id, started_at)"
+    )
+
+
+def _m009_logs_to_sessions(conn, batch_size=None):
+    """
+    Move Logs over to Sessions a few exercises at a time (about
+    `batch_size` sets per commit, an exercise is never split) and rebuild
+    their summaries and records from the new tables. The old rows wait in
+    LogsOld until the end, so a rerun resumes after the last exercise that
+    already has sessions.
+    """
+    batch_size = batch_size or MIGRATION_BATCH
+    if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'LogsOld'").fetchone():
+        conn.execute("ALTER TABLE Logs RENAME TO LogsOld")
+        conn.execute('''
+        CREATE TABLE Logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            session_id INTEGER NOT NULL,
+            reps INTEGER NOT NULL,
+            weight REAL NOT NULL,
+            FOREIGN KEY (session_id) REFERENCES Sessions (session_id)
+        )
+        ''')
+        # a session's sets in insert order, covering (log_id spelled out so
+        # ORDER BY log_id comes from the index)
+        conn.execute(
+            "CREATE INDEX idx_logs_session ON Logs (session_id, log_id, reps, weight)")
+        # derived tables, refilled batch by batch below (the backfills of
+        # migrations 5 and 7 ran before Sessions existed and left them empty)
+        conn.execute("DROP TABLE ExerciseSummary")
+        conn.execute('''
+        CREATE TABLE ExerciseSummary (
+            exercise_id INTEGER PRIMARY KEY,
+            last_at INTEGER NOT NULL,
+            last_reps INTEGER NOT NULL,
+            last_weights TEXT NOT NULL,
+            prev_at INTEGER,
+            prev_reps INTEGER,
+            prev_weights TEXT,
+            FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+        )
+        ''')
+        conn.execute("DROP TABLE PersonalRecords")
+        conn.execute('''
+        CREATE TABLE PersonalRecords (
+            exercise_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            reps INTEGER NOT NULL,
+            value REAL NOT NULL,
+            achieved_at INTEGER NOT NULL,
+            PRIMARY KEY (exercise_id, kind, reps),
+            FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id)
+        ) WITHOUT ROWID
+        ''')
+
+    last_id = conn.execute("SELECT max(exercise_id) FROM Sessions").fetchone()[0] or 0
+    while True:
+        counts = conn.execute(
+            "SELECT exercise_id, count(*) FROM LogsOld WHERE exercise_id > ? "
+            "GROUP BY exercise_id ORDER BY exercise_id LIMIT ?",
+            (last_id, batch_size)
+        ).fetchall()
+        if not counts:
+            break
+        rows = 0
+        for exercise_id, count in counts:
+            upto = exercise_id
+            rows += count
+            if rows >= batch_size:
+                break
+        # equal date strings (one save) become one session; grouping by the
+        # epoch also merges the rare strings that land on the same second
+        conn.execute(
+            f"INSERT INTO Sessions (exercise_id, started_at) "
+            f"SELECT exercise_id, {_EPOCH_SQL.format('date')} AS started_at FROM LogsOld "
+            f"WHERE exercise_id > ? AND exercise_id <= ? "
+            f"GROUP BY exercise_id, started_at ORDER BY exercise_id, started_at",
+            (last_id, upto)
+        )
+        conn.execute(
+            f"INSERT INTO Logs (log_id, session_id, reps, weight) "
+            f"SELECT l.log_id, s.session_id, l.reps, l.weight FROM LogsOld l "
+            f"JOIN Sessions s ON s.exercise_id = l.exercise_id "
+            f"AND s.started_at = {_EPOCH_SQL.format('l.date')} "
+            f"WHERE l.exercise_id > ? AND l.exercise_id <= ? ORDER BY l.log_id",
+            (last_id, upto)
+        )
+        for exercise_id, _ in counts:
+            if exercise_id > upto:
+                break
+            logbook.rebuild_summary(conn, exercise_id)
+            # no SessionArchive before migration 11
+            records.rebuild(conn, exercise_id, archived=False)
+        last_id = upto
+        yield
+
+    conn.execute("DROP TABLE LogsOld")
+
+
+# tables rebuilt by migration 10, parents first:
+# (table, batch key or None for one go, parent check, create, indexes)
+_CASCADE_TABLES = [
+    ("Exercises", None,
+     "EXISTS (SELECT 1 FROM TrainingDays p WHERE p.day_id = t.day_id)",
+     """CREATE TABLE {} (
+        exercise_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        day_id INTEGER NOT NULL,
+        exercise_name TEXT NOT NULL,
+        FOREIGN KEY (day_id) REFERENCES TrainingDays (day_id) ON DELETE CASCADE
+    )""",
+     ["CREATE INDEX idx_exercises_day ON Exercises (day_id, exercise_id, exercise_name)"]),
+    ("Sessions", "session_id",
+     "EXISTS (SELECT 1 FROM Exercises p WHERE p.exercise_id = t.exercise_id)",
+     """CREATE TABLE {} (
+        session_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        exercise_id INTEGER NOT NULL,
+        started_at INTEGER NOT NULL,
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id) ON DELETE CASCADE
+    )""",
+     ["CREATE INDEX idx_sessions_exercise_time ON Sessions (exercise_id, started_at)"]),
+    ("Logs", "log_id",
+     "EXISTS (SELECT 1 FROM Sessions p WHERE p.session_id = t.session_id)",
+     """CREATE TABLE {} (
+        log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        session_id INTEGER NOT NULL,
+        reps INTEGER NOT NULL,
+        weight REAL NOT NULL,
+        FOREIGN KEY (session_id) REFERENCES Sessions (session_id) ON DELETE CASCADE
+    )""",
+     ["CREATE INDEX idx_logs_session ON Logs (session_id, log_id, reps, weight)"]),
+    ("ExerciseSummary", None,
+     "EXISTS (SELECT 1 FROM Exercises p WHERE p.exercise_id = t.exercise_id)",
+     """CREATE TABLE {} (
+        exercise_id INTEGER PRIMARY KEY,
+        last_at INTEGER NOT NULL,
+        last_reps INTEGER NOT NULL,
+        last_weights TEXT NOT NULL,
+        prev_at INTEGER,
+        prev_reps INTEGER,
+        prev_weights TEXT,
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id) ON DELETE CASCADE
+    )""",
+     []),
+    ("PersonalRecords", None,
+     "EXISTS (SELECT 1 FROM Exercises p WHERE p.exercise_id = t.exercise_id)",
+     """CREATE TABLE {} (
+        exercise_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        reps INTEGER NOT NULL,
+        value REAL NOT NULL,
+        achieved_at INTEGER NOT NULL,
+        PRIMARY KEY (exercise_id, kind, reps),
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id) ON DELETE CASCADE
+    ) WITHOUT ROWID""",
+     []),
+]
+
+
+def _m010_cascade_deletes(conn, batch_size=None):
+    """
+    Soft-deleted days (TrainingDays.deleted_at, purged later by
+    compaction.py) and ON DELETE CASCADE all the way down to Logs.
+    SQLite can't add the cascade to a table, so each child table is copied
+    into {table}_new (Sessions/Logs `batch_size` rows per commit) and
+    swapped in; rows whose parent is already gone are left behind. A rerun
+    carries on with the table that has a _new copy or no cascade yet.
+    migrate() runs this with foreign_keys off, nothing may cascade here.
+    """
+    batch_size = batch_size or MIGRATION_BATCH
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(TrainingDays)")]
+    if "deleted_at" not in columns:
+        conn.execute("ALTER TABLE TrainingDays ADD COLUMN deleted_at INTEGER")
+    # the lists only ever read live days; the compactor finds the others
+    conn.execute("DROP INDEX IF EXISTS idx_days_user")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_days_live "
+        "ON TrainingDays (user_id, day_id, day_name) WHERE deleted_at IS NULL"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_days_deleted "
+        "ON TrainingDays (deleted_at) WHERE deleted_at IS NOT NULL"
+    )
+    yield
+
+    for table, key, parent_exists, create, indexes in _CASCADE_TABLES:
+        new = f"{table}_new"
+        found = dict(conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type = 'table' AND name IN (?, ?)",
+            (table, new)))
+        if new not in found:
+            if "ON DELETE CASCADE" in found[table]:
+                continue
+            conn.execute(create.format(new))
+        names = ", ".join(row[1] for row in conn.execute(f"PRAGMA table_info({new})"))
+
+        if key is None:
+            conn.execute(f"DELETE FROM {new}")
+            conn.execute(f"INSERT INTO {new} ({names}) SELECT {names} FROM {table} t "
+                         f"WHERE {parent_exists}")
+        else:
+            last = conn.execute(f"SELECT max({key}) FROM {new}").fetchone()[0] or 0
+            while True:
+                upto = conn.execute(
+                    f"SELECT {key} FROM {table} WHERE {key} > ? ORDER BY {key} "
+                    f"LIMIT 1 OFFSET ?", (last, batch_size - 1)).fetchone()
+                conn.execute(
+                    f"INSERT INTO {new} ({names}) SELECT {names} FROM {table} t "
+                    f"WHERE {key} > ? AND {key} <= ? AND {parent_exists} ORDER BY {key}",
+                    (last, upto[0] if upto else 2 ** 63 - 1))
+                if upto is None:
+                    break
+                last = upto[0]
+                yield
+
+        # the old sequence may be past the copied ids (deleted rows), keep it
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?",
+                           (table,)).fetchone()
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {new} RENAME TO {table}")
+        if seq:
+            conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+                         (seq[0], table))
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+                         "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+                         (table, seq[0], table))
+        for sql in indexes:
+            conn.execute(sql)
+        yield
+
+    problems = conn.execute("PRAGMA foreign_key_check").fetchall()
+    if problems:
+        raise sqlite3.IntegrityError(f"foreign key violations after the rebuild: {problems[:10]}")
+
+
+def _m011_session_archive(conn):
+    # cold tier (archive.py): a month of one exercise's old sessions per
+    # row, packed and compressed; small rows, so WITHOUT ROWID keeps an
+    # exercise's months together
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS SessionArchive (
+        exercise_id INTEGER NOT NULL,
+        month INTEGER NOT NULL,
+        first_at INTEGER NOT NULL,
+        last_at INTEGER NOT NULL,
+        sessions INTEGER NOT NULL,
+        sets INTEGER NOT NULL,
+        data BLOB NOT NULL,
+        PRIMARY KEY (exercise_id, month),
+        FOREIGN KEY (exercise_id) REFERENCES Exercises (exercise_id) ON DELETE CASCADE
+    ) WITHOUT ROWID
+    ''')
+
+
+# (version, name, function) - append only, never reorder or edit
+MIGRATIONS = [
+    (1, "base tables", _m001_base_tables),
+    (2, "index TrainingDays by user", _m002_days_by_user),
+    (3, "index Exercises by day", _m003_exercises_by_day),
+    (4, "index Logs by exercise and date", _m004_logs_by_exercise_date),
+    (5, "ExerciseSummary table", _m005_exercise_summary),
+    (6, "ConversationState table", _m006_conversation_state),
+    (7, "PersonalRecords table", _m007_personal_records),
+    (8, "Sessions table", _m008_sessions),
+    (9, "Logs dates to Sessions", _m009_logs_to_sessions),
+    (10, "soft-deleted days, cascading deletes", _m010_cascade_deletes),
+    (11, "SessionArchive table", _m011_session_archive),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target=LATEST_VERSION):
+    """Apply every pending migration up to `target`. Returns applied versions."""
+    applied = []
+    current = get_version(conn)
+    if current > LATEST_VERSION:
+        raise RuntimeError(
+            f"db schema version {current} is newer than this code ({LATEST_VERSION})"
+        )
+
+    if current == 0 and not conn.execute("SELECT 1 FROM sqlite_master").fetchone():
+        # a new db: free pages go back to the file with PRAGMA
+        # incremental_vacuum (compaction.py). Only an empty db can switch
+        # without a long VACUUM (manage.py vacuum for old ones).
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    # rebuilding a parent table must not cascade into its children; the
+    # pragma is a no-op inside a transaction, so it's switched out here
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        for version, name, func in MIGRATIONS:
+            if version <= current or version > target:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                steps = func(conn)
+                if inspect.isgenerator(steps):
+                    for _ in steps:
+                        conn.commit()
+                        conn.execute("BEGIN IMMEDIATE")
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            print(f"Migration {version} applied: {name}")
+            applied.append(version)
+    finally:
+        conn.execute(f"PRAGMA foreign_keys = {foreign_keys}")
+    return applied
+
+
+# Every query a handler runs on the hot path, with the index it must use.
+# (handler, sql, params, expected index)
+HOT_QUERIES = [
+    ("show_my_days",
+     "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ? AND deleted_at IS NULL",
+     (0,), "idx_days_live"),
+    ("show_my_days",
+     "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ? AND day_id > ? "
+     "AND deleted_at IS NULL ORDER BY day_id LIMIT ?",
+     (0, 0, 11), "idx_days_live"),
+    ("show_my_days",
+     "SELECT day_id FROM TrainingDays WHERE user_id = ? AND day_id <= ? "
+     "AND deleted_at IS NULL ORDER BY day_id DESC LIMIT ?",
+     (0, 0, 11), "idx_days_live"),
+    ("show_day_exercises",
+     "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ?",
+     (0,), "idx_exercises_day"),
+    ("show_day_exercises",
+     "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ? AND exercise_id > ? "
+     "ORDER BY exercise_id LIMIT ?",
+     (0, 0, 11), "idx_exercises_day"),
+    ("show_day_exercises",
+     "SELECT exercise_id FROM Exercises WHERE day_id = ? AND exercise_id <= ? "
+     "ORDER BY exercise_id DESC LIMIT ?",
+     (0, 0, 11), "idx_exercises_day"),
+    ("process_day_deletion",
+     "UPDATE TrainingDays SET deleted_at = ? "
+     "WHERE day_id = ? AND user_id = ? AND deleted_at IS NULL",
+     (0, 0, 0), "INTEGER PRIMARY KEY"),
+    # compaction.purge_step, in the background (the cascades use idx_logs_session,
+    # idx_exercises_day and the summary/records primary keys)
+    ("compaction",
+     "SELECT day_id FROM TrainingDays WHERE deleted_at IS NOT NULL "
+     "ORDER BY deleted_at LIMIT 1",
+     (), "idx_days_deleted"),
+    ("compaction",
+     "DELETE FROM Sessions WHERE session_id IN ("
+     "SELECT s.session_id FROM Exercises e "
+     "JOIN Sessions s ON s.exercise_id = e.exercise_id "
+     "WHERE e.day_id = ? LIMIT ?)",
+     (0, 200), "idx_sessions_exercise_time"),
+    ("compaction",
+     "DELETE FROM Logs WHERE session_id = ?",
+     (0,), "idx_logs_session"),
+    ("compaction",
+     "DELETE FROM Exercises WHERE day_id = ?",
+     (0,), "idx_exercises_day"),
+    ("show_exercise_summary",
+     "SELECT e.exercise_name, e.day_id, s.last_at, s.last_reps, s.last_weights, "
+     "s.prev_at, s.prev_reps, s.prev_weights FROM Exercises e "
+     "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+     "LEFT JOIN ExerciseSummary s ON s.exercise_id = e.exercise_id "
+     "WHERE e.exercise_id = ?",
+     (0,), "INTEGER PRIMARY KEY"),
+    ("handle_pending_step",
+     "SELECT state, ref_id, expires_at FROM ConversationState "
+     "WHERE chat_id = ? AND expires_at > ?",
+     (0, 0), "INTEGER PRIMARY KEY"),
+    ("save_logs_to_db",
+     "SELECT last_at FROM ExerciseSummary WHERE exercise_id = ?",
+     (0,), "INTEGER PRIMARY KEY"),
+    ("save_logs_to_db",
+     "SELECT session_id, started_at FROM Sessions "
+     "WHERE exercise_id = ? AND started_at >= ? AND started_at < ? "
+     "ORDER BY started_at DESC, session_id DESC LIMIT ?",
+     (0, 0, 0, 2), "idx_sessions_exercise_time"),
+    ("save_logs_to_db",
+     "SELECT reps, weight FROM Logs WHERE session_id = ? ORDER BY log_id",
+     (0,), "idx_logs_session"),
+    ("save_logs_to_db",
+     "SELECT kind, reps, value FROM PersonalRecords WHERE exercise_id = ?",
+     (0,), "PRIMARY KEY"),
+    ("show_day_records",
+     "SELECT exercise_id, kind, reps, value, achieved_at FROM PersonalRecords "
+     "WHERE exercise_id IN (?, ?)",
+     (0, 0), "PRIMARY KEY"),
+    ("show_exercise_stats",
+     "SELECT e.exercise_name, e.day_id FROM Exercises e "
+     "JOIN TrainingDays d ON d.day_id = e.day_id AND d.deleted_at IS NULL "
+     "WHERE e.exercise_id = ?",
+     (0,), "INTEGER PRIMARY KEY"),
+    ("show_day_stats",
+     "SELECT s.exercise_id, s.session_id, s.started_at, l.reps, l.weight "
+     "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+     "WHERE s.exercise_id IN (?, ?) ORDER BY s.exercise_id, s.started_at, s.session_id",
+     (0, 0), "idx_sessions_exercise_time"),
+    ("show_day_stats",
+     "SELECT s.exercise_id, s.session_id, s.started_at, l.reps, l.weight "
+     "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+     "WHERE s.exercise_id IN (?, ?) ORDER BY s.exercise_id, s.started_at, s.session_id",
+     (0, 0), "idx_logs_session"),
+    ("show_day_stats",
+     "SELECT exercise_id, data FROM SessionArchive "
+     "WHERE exercise_id IN (?, ?) ORDER BY exercise_id, month",
+     (0, 0), "PRIMARY KEY"),
+    # transfer._import_chunk, per chunk of an import
+    ("handle_import_file",
+     "WITH wanted (exercise_id, started_at) AS (VALUES (?, ?), (?, ?)) "
+     "SELECT s.exercise_id, s.started_at, s.session_id FROM wanted w "
+     "JOIN Sessions s ON s.exercise_id = w.exercise_id AND s.started_at = w.started_at",
+     (0, 0, 0, 0), "idx_sessions_exercise_time"),
+    ("handle_import_file",
+     "WITH wanted (exercise_id, month) AS (VALUES (?, ?), (?, ?)) "
+     "SELECT a.exercise_id, a.month, a.data FROM wanted w "
+     "JOIN SessionArchive a ON a.exercise_id = w.exercise_id AND a.month = w.month",
+     (0, 0, 0, 0), "PRIMARY KEY"),
+    ("handle_import_file",
+     "SELECT session_id, sum(reps * weight) FROM Logs "
+     "WHERE session_id IN (?, ?) GROUP BY session_id",
+     (0, 0), "idx_logs_session"),
+    ("handle_import_file",
+     "SELECT exercise_id, prev_at FROM ExerciseSummary WHERE exercise_id IN (?, ?)",
+     (0, 0), "INTEGER PRIMARY KEY"),
+    # archive.py, in the background
+    ("archive",
+     "SELECT 1 FROM Sessions WHERE exercise_id = ? AND started_at < ? AND EXISTS ("
+     "SELECT 1 FROM Sessions WHERE exercise_id = ? ORDER BY started_at DESC "
+     "LIMIT 1 OFFSET ?) LIMIT 1",
+     (0, 0, 0, 2), "idx_sessions_exercise_time"),
+    ("archive",
+     "SELECT started_at, session_id FROM Sessions WHERE exercise_id = ? "
+     "ORDER BY started_at DESC, session_id DESC LIMIT 1 OFFSET ?",
+     (0, 1), "idx_sessions_exercise_time"),
+    ("archive",
+     "SELECT s.session_id, s.started_at, l.reps, l.weight "
+     "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+     "WHERE s.exercise_id = ? AND (s.started_at < ? OR s.started_at = ? AND s.session_id < ?) "
+     "ORDER BY s.started_at, s.session_id, l.log_id",
+     (0, 0, 0, 0), "idx_sessions_exercise_time"),
+    ("archive",
+     "SELECT data FROM SessionArchive WHERE exercise_id = ? AND month = ?",
+     (0, 0), "PRIMARY KEY"),
+]
+
+
+def check_query_plans(conn):
+    """
+    Run EXPLAIN QUERY PLAN over HOT_QUERIES.
+    Returns a list of problems, empty when every query uses its index.
+    """
+    problems = []
+    for handler, sql, params, index in HOT_QUERIES:
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error as e:
+            problems.append(f"{handler}: {e} ({sql})")
+            continue
+        details = [row[-1] for row in rows]
+        if not any(index in d for d in details):
+            problems.append(f"{handler}: expected {index}, got {details} ({sql})")
+        elif any("TEMP B-TREE" in d for d in details):
+            problems.append(f"{handler}: sorts in a temp b-tree {details} ({sql})")
+    return problems
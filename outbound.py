@@ -0,0 +1,379 @@
+"""
+Outbound scheduler for Telegram API calls.
+
+Handlers queue replies through an Outbox instead of calling the bot
+directly. The scheduler thread hands them to a few sender threads while
+keeping to Telegram's limits:
+
+- one global token bucket (~30 msg/s) and one per chat (~1 msg/s, small burst)
+- callback answers jump the queue: the user's spinner is waiting on them
+- a 429 pauses that chat (or the callback lane) for `retry_after` and the
+  call is retried, instead of every thread hammering the API again
+- repeated edit_message_text calls on the same message that have not been
+  sent yet collapse into the newest one
+
+Messages to one chat are sent one at a time, in the order they were queued.
+Set GYMBRO_OUTBOX=0 to call the bot directly (no queue).
+"""
+import collections
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+
+ENABLED = os.getenv("GYMBRO_OUTBOX", "1") == "1"
+GLOBAL_RATE = float(os.getenv("GYMBRO_OUTBOX_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("GYMBRO_OUTBOX_CHAT_RATE", "1"))
+CHAT_BURST = float(os.getenv("GYMBRO_OUTBOX_CHAT_BURST", "3"))
+SENDERS = int(os.getenv("GYMBRO_OUTBOX_SENDERS", "8"))
+MAX_RETRIES = 5
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """0 if a token is available now, else seconds until there is one."""
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboxClosed(Exception):
+    """The outbox was closed before the call could be sent."""
+
+
+class _Call:
+    __slots__ = ("func", "args", "kwargs", "lane", "edit_key", "queued_at", "retries", "future",
+                 "request")
+
+    def __init__(self, func, args, kwargs, lane, edit_key=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.lane = lane
+        self.edit_key = edit_key
+        self.queued_at = time.monotonic()
+        self.retries = 0
+        self.future = Future()
+        # the handler's slow-log context, its API time is counted there
+        self.request = metrics.track(self.future)
+
+
+def _send_document(bot):
+    def send_document(chat_id, document, **kwargs):
+        # a 429 retry must not send what's left of an already read file
+        if hasattr(document, "seek"):
+            document.seek(0)
+        return bot.send_document(chat_id, document, **kwargs)
+    return send_document
+
+
+def _send_document_file(bot):
+    def send_document_file(chat_id, path, **kwargs):
+        with open(path, "rb") as document:
+            return bot.send_document(chat_id, document, **kwargs)
+    return send_document_file
+
+
+class _Lane:
+    """Pending calls of one chat (or of the callback-answer lane)."""
+    __slots__ = ("key", "calls", "bucket", "busy", "paused_until")
+
+    def __init__(self, key, bucket):
+        self.key = key
+        self.calls = collections.deque()
+        self.bucket = bucket
+        self.busy = False
+        self.paused_until = 0.0
+
+
+class Outbox:
+    """Rate-limited, prioritised queue in front of a TeleBot."""
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE,
+                 chat_burst=CHAT_BURST, senders=SENDERS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        # no burst here: a full bucket plus its refill would let ~2x the
+        # rate through in the first second
+        self._global = TokenBucket(global_rate, 1)
+        # callback answers: own lane, only the global bucket applies
+        self._urgent = _Lane("callbacks", None)
+        self._lanes = {}
+        self._ready = collections.deque()
+        self._edits = {}
+        self._cond = threading.Condition()
+        self._senders = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="outbox")
+        self._thread = None
+        self._running = False
+        self._queued = 0
+        self._in_flight = 0
+        self._last_sweep = time.monotonic()
+
+        # stats
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.coalesced = 0
+        self._delays = collections.deque(maxlen=1000)
+
+    # --- the bot methods handlers use ---
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._enqueue(self.bot.send_message, (chat_id, text), kwargs, chat_id)
+
+    def reply_to(self, message, text, **kwargs):
+        return self._enqueue(self.bot.reply_to, (message, text), kwargs, message.chat.id)
+
+    def send_document(self, chat_id, document, **kwargs):
+        return self._enqueue(_send_document(self.bot), (chat_id, document), kwargs, chat_id)
+
+    def send_document_file(self, chat_id, path, **kwargs):
+        """A file on disk as a document, opened again for every attempt."""
+        return self._enqueue(_send_document_file(self.bot), (chat_id, path), kwargs, chat_id)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        return self._enqueue(self.bot.edit_message_text, (text,), kwargs, chat_id,
+                             edit_key=(chat_id, message_id))
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        return self._enqueue(self.bot.answer_callback_query, (callback_query_id, text), kwargs,
+                             None)
+
+    # --- scheduling ---
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._running = True
+                self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+                self._thread.start()
+        return self
+
+    def _enqueue(self, func, args, kwargs, chat_id, edit_key=None):
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            if edit_key is not None:
+                pending = self._edits.get(edit_key)
+                if pending is not None:
+                    # not sent yet: just send the newest text instead
+                    pending.args = args
+                    pending.kwargs = kwargs
+                    self.coalesced += 1
+                    metrics.track(pending.future)
+                    return pending.future
+
+            lane = self._urgent if chat_id is None else self._lane(chat_id)
+            call = _Call(func, args, kwargs, lane, edit_key)
+            if edit_key is not None:
+                self._edits[edit_key] = call
+            lane.calls.append(call)
+            self._queued += 1
+            if lane is not self._urgent and not lane.busy and len(lane.calls) == 1:
+                self._ready.append(lane)
+            self._cond.notify()
+            return call.future
+
+    def _lane(self, chat_id):
+        lane = self._lanes.get(chat_id)
+        if lane is None:
+            lane = self._lanes[chat_id] = _Lane(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        return lane
+
+    def _next_call(self, now):
+        """Pick the next call to send. Returns (call, 0) or (None, seconds to wait)."""
+        wait = self._global.wait_time(now)
+        if wait:
+            return None, wait
+
+        urgent = self._urgent
+        if urgent.calls and not urgent.busy and urgent.paused_until <= now:
+            return self._take(urgent), 0.0
+
+        wait = 1.0
+        if urgent.calls and urgent.paused_until > now:
+            wait = urgent.paused_until - now
+        for _ in range(len(self._ready)):
+            lane = self._ready.popleft()
+            lane_wait = max(lane.paused_until - now, lane.bucket.wait_time(now))
+            if lane_wait <= 0:
+                lane.bucket.take()
+                return self._take(lane), 0.0
+            self._ready.append(lane)
+            wait = min(wait, lane_wait)
+        return None, wait
+
+    def _take(self, lane):
+        self._global.take()
+        call = lane.calls.popleft()
+        if call.edit_key is not None:
+            self._edits.pop(call.edit_key, None)
+        lane.busy = lane is not self._urgent
+        self._queued -= 1
+        self._in_flight += 1
+        self._delays.append(time.monotonic() - call.queued_at)
+        return call
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                now = time.monotonic()
+                self._sweep(now)
+                call, wait = self._next_call(now)
+                if call is None:
+                    self._cond.wait(wait)
+                    continue
+            self._senders.submit(self._send, call)
+
+    def _sweep(self, now):
+        # forget idle chats whose bucket is full again
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for chat_id, lane in list(self._lanes.items()):
+            if not lane.calls and not lane.busy and lane.bucket.is_full(now):
+                del self._lanes[chat_id]
+
+    def _send(self, call):
+        lane = call.lane
+        retry_after = None
+        try:
+            with metrics.attributed(call.request):
+                result = call.func(*call.args, **call.kwargs)
+        except ApiTelegramException as e:
+            if e.error_code == 429 and call.retries < MAX_RETRIES:
+                retry_after = (e.result_json.get("parameters") or {}).get("retry_after", 1)
+            else:
+                print(f"Ошибка Telegram API ({call.func.__name__}): {e}")
+                call.future.set_exception(e)
+        except Exception as e:
+            print(f"Ошибка отправки ({call.func.__name__}): {e}")
+            call.future.set_exception(e)
+        else:
+            call.future.set_result(result)
+
+        with self._cond:
+            self._in_flight -= 1
+            if retry_after is not None:
+                call.retries += 1
+                self.retried += 1
+                # back to the head of its lane, the lane sleeps it off
+                lane.calls.appendleft(call)
+                lane.paused_until = time.monotonic() + retry_after
+                self._queued += 1
+            elif call.future.exception() is None:
+                self.sent += 1
+            else:
+                self.failed += 1
+            if lane is not self._urgent:
+                lane.busy = False
+                if lane.calls:
+                    self._ready.append(lane)
+            self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until everything queued so far has been sent (or failed)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._queued or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else 0.1)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        Send what is queued (up to `timeout` seconds), then stop. Calls
+        still queued after that fail with OutboxClosed, so their futures'
+        callbacks (temp file cleanup...) still run.
+        """
+        if self._thread is None:
+            return
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join()
+        self._thread = None
+        self._senders.shutdown(wait=True)
+
+        with self._cond:
+            left = [call for lane in (self._urgent, *self._lanes.values()) for call in lane.calls]
+            for lane in (self._urgent, *self._lanes.values()):
+                lane.calls.clear()
+            self._ready.clear()
+            self._edits.clear()
+            self._queued = 0
+            self.failed += len(left)
+        for call in left:
+            call.future.set_exception(OutboxClosed(f"{call.func.__name__} not sent"))
+
+    def stats(self):
+        with self._cond:
+            delays = sorted(self._delays)
+            return {
+                "queued": self._queued,
+                "queued_callbacks": len(self._urgent.calls),
+                "in_flight": self._in_flight,
+                "chats": len(self._lanes),
+                "sent": self.sent,
+                "failed": self.failed,
+                "retried_429": self.retried,
+                "coalesced_edits": self.coalesced,
+                "delay_p50": delays[len(delays) // 2] if delays else 0.0,
+                "delay_p99": delays[int(len(delays) * 0.99)] if delays else 0.0,
+                "delay_max": delays[-1] if delays else 0.0,
+            }
+
+
+class DirectOutbox:
+    """Same interface, no queue: every call goes straight to the bot."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
+
+    def send_document_file(self, chat_id, path, **kwargs):
+        return _send_document_file(self.bot)(chat_id, path, **kwargs)
+
+    def flush(self, timeout=None):
+        return True
+
+    def close(self, timeout=None):
+        pass
+
+    def stats(self):
+        return {}
+
+
+def make_outbox(bot):
+    return Outbox(bot) if ENABLED else DirectOutbox(bot)
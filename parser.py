@@ -0,0 +1,143 @@
+"""
+Parses a logging message: one line per exercise, any number of lines.
+
+    Жим лёжа 3x80 3x85 2x90
+    Присед 5 100 110 120
+    Тяга 5x140 150
+
+A line is an optional exercise name (the words before the first number)
+followed by sets. `3x80` is one set of 3 reps with 80 kg (x, х, × or *);
+a bare number is a weight done with the reps of the set before it, and
+the very first bare number of a line is the reps themselves, so the old
+one-line format `Жим 3 80 85 90` still means 3x80 3x85 3x90.
+
+The whole message is checked in one pass before anything is written; a
+mistake raises ParseError pointing at the line and the token, nothing of
+the message is saved.
+"""
+import math
+import re
+
+MAX_LINES = 30
+MAX_SETS = 50     # per exercise
+MAX_REPS = 1000
+MAX_WEIGHT = 10000
+
+_TOKEN = re.compile(r"\S+")
+_NUMBER = re.compile(r"-?\d+(?:[.,]\d+)?")
+_SET = re.compile(r"(-?\d+(?:[.,]\d+)?)[xх×*](-?\d+(?:[.,]\d+)?)", re.IGNORECASE)
+
+
+class ParseError(ValueError):
+    """A bad token: line is 1-based, column the token's 0-based offset in it."""
+
+    def __init__(self, reason, line_no, line, column, token):
+        super().__init__(reason)
+        self.reason = reason
+        self.line_no = line_no
+        self.line = line
+        self.column = column
+        self.token = token
+
+    def __str__(self):
+        marked = f"{self.line[:self.column]}[{self.token}]{self.line[self.column + len(self.token):]}"
+        return f"Строка {self.line_no}, «{self.token}»: {self.reason}\n{marked}"
+
+
+def parse_reps(text):
+    """'5' -> 5; ValueError with a message for the user (imports use it too)."""
+    if not text.isdigit():
+        raise ValueError("подходы должны быть целым числом > 0")
+    reps = int(text)
+    if not 0 < reps <= MAX_REPS:
+        raise ValueError(f"подходы должны быть от 1 до {MAX_REPS}")
+    return reps
+
+
+def parse_weight(text):
+    """'82,5' -> 82.5; rejects negative, nan/inf and over MAX_WEIGHT."""
+    try:
+        weight = float(text.replace(",", "."))
+    except ValueError:
+        weight = math.nan
+    if not math.isfinite(weight):
+        raise ValueError("вес должен быть числом")
+    if weight < 0:
+        raise ValueError("Вес не может быть отрицательным ಠ_ಠ")
+    if weight > MAX_WEIGHT:
+        raise ValueError(f"вес больше {MAX_WEIGHT} кг, опечатка?")
+    return weight
+
+
+def parse_line(line, line_no=1):
+    """-> (name or None, [(reps, weight)]); raises ParseError."""
+    name_words = []
+    sets = []
+    reps = None
+    token = None
+    for match in _TOKEN.finditer(line):
+        token = match.group()
+        try:
+            found = _SET.fullmatch(token)
+            if found:
+                reps = parse_reps(found.group(1))
+                sets.append((reps, parse_weight(found.group(2))))
+            elif _NUMBER.fullmatch(token):
+                if reps is None:
+                    reps = parse_reps(token)
+                else:
+                    sets.append((reps, parse_weight(token)))
+            elif reps is None:
+                name_words.append(token)
+                continue
+            else:
+                raise ValueError("ожидал вес или подход вида 3x80")
+        except ValueError as e:
+            raise ParseError(str(e), line_no, line, match.start(), token) from None
+        if len(sets) > MAX_SETS:
+            raise ParseError(f"больше {MAX_SETS} подходов в одной строке", line_no, line,
+                             match.start(), token)
+
+    if not sets:
+        if reps is None:
+            reason = "нет ни одного подхода, пример: `Жим 3x80 3x85`"
+        else:
+            reason = "после подходов нужен хотя бы один вес"
+        # point at the last thing on the line
+        raise ParseError(reason, line_no, line, line.rfind(token), token)
+    return " ".join(name_words) or None, sets
+
+
+def parse(text, default_name=False):
+    """
+    Message -> [(name, [(reps, weight)])] in the order of the message, lines
+    of the same exercise (names compared case-insensitively) merged.
+    With `default_name` a line may leave the name out (name None: the
+    exercise the user picked), otherwise every line needs one.
+    Blank lines are skipped. Raises ParseError.
+    """
+    entries = {}
+    lines = [(line_no, line) for line_no, line in enumerate(text.splitlines(), 1)
+             if line.strip()]
+    if not lines:
+        raise ParseError("пустое сообщение", 1, "", 0, "")
+    if len(lines) > MAX_LINES:
+        line_no, line = lines[MAX_LINES]
+        raise ParseError(f"больше {MAX_LINES} строк в одном сообщении", line_no, line,
+                         len(line) - len(line.lstrip()), line.strip())
+
+    for line_no, line in lines:
+        name, sets = parse_line(line, line_no)
+        if name is None and not default_name:
+            token = _TOKEN.search(line)
+            raise ParseError("сначала название упражнения", line_no, line,
+                             token.start(), token.group())
+        key = name.casefold() if name else None
+        if key in entries:
+            entries[key][1].extend(sets)
+            if len(entries[key][1]) > MAX_SETS:
+                raise ParseError(f"больше {MAX_SETS} подходов одного упражнения", line_no, line,
+                                 len(line) - len(line.lstrip()), line.strip())
+        else:
+            entries[key] = (name, sets)
+    return list(entries.values())
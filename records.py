@@ -0,0 +1,226 @@
+"""
+Personal records per exercise, kept in PersonalRecords.
+
+kinds:
+- weight: heaviest weight lifted for `reps` reps (one row per rep count)
+- e1rm: best estimated 1RM of a set (Epley), reps = 0
+- volume: best session tonnage (sum of reps * weight), reps = 0
+
+update() runs inside logbook.record_sets, in the transaction that
+inserts the sets, and only looks at the new sets + the exercise's
+current records (a handful of rows), never at the history. Records are
+maxima, so the order sets arrive in (imports, back-dated writes)
+doesn't matter. rebuild() recomputes an exercise from Sessions/Logs
+(migration and `manage.py rebuild-records`), plus its archived sessions
+(archive.py) when it has any.
+"""
+from datetime import datetime
+
+import archive
+from stats import escape_markdown
+
+# float noise between the SQL and the Python e1RM formulas is not a record
+EPSILON = 1e-6
+
+KIND_WEIGHT = "weight"
+KIND_E1RM = "e1rm"
+KIND_VOLUME = "volume"
+KINDS = (KIND_WEIGHT, KIND_E1RM, KIND_VOLUME)
+
+
+def epley(weight, reps):
+    return weight if reps == 1 else weight * (1 + reps / 30)
+
+
+def _best(sets, volume=None):
+    """{(kind, reps): value} of one session's sets."""
+    best = {}
+    for reps, weight in sets:
+        if weight > best.get((KIND_WEIGHT, reps), -1):
+            best[(KIND_WEIGHT, reps)] = weight
+        e1rm = epley(weight, reps)
+        if e1rm > best.get((KIND_E1RM, 0), -1):
+            best[(KIND_E1RM, 0)] = e1rm
+    if volume is None:
+        volume = sum(reps * weight for reps, weight in sets)
+    best[(KIND_VOLUME, 0)] = volume
+    return best
+
+
+def update(conn, exercise_id, started_at, sets, volume=None):
+    """
+    Merge one session's (reps, weight) sets into the exercise's records.
+    `volume` is the session's tonnage when `sets` is only part of it
+    (imports that add to a session). Returns the records that were beaten,
+    [(kind, reps, value, previous value)], previous is None for a first one.
+    """
+    current = {(kind, reps): value for kind, reps, value in conn.execute(
+        "SELECT kind, reps, value FROM PersonalRecords WHERE exercise_id = ?",
+        (exercise_id,)
+    )}
+    beaten = []
+    for (kind, reps), value in _best(sets, volume).items():
+        previous = current.get((kind, reps))
+        if previous is None or value > previous + EPSILON:
+            beaten.append((kind, reps, value, previous))
+    conn.executemany(
+        "INSERT OR REPLACE INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(exercise_id, kind, reps, value, started_at) for kind, reps, value, _ in beaten]
+    )
+    return beaten
+
+
+def update_many(conn, sessions):
+    """
+    update() for many sessions [(exercise_id, started_at, sets, volume)]
+    in that order (imports): one read of their exercises' records, one write.
+    """
+    current = {exercise_id: {key: value for key, (value, _) in found.items()}
+               for exercise_id, found in for_exercises(
+                   conn, list({session[0] for session in sessions})).items()}
+    changed = {}
+    for exercise_id, started_at, sets, volume in sessions:
+        records = current[exercise_id]
+        for (kind, reps), value in _best(sets, volume).items():
+            previous = records.get((kind, reps))
+            if previous is None or value > previous + EPSILON:
+                records[(kind, reps)] = value
+                changed[(exercise_id, kind, reps)] = (value, started_at)
+    conn.executemany(
+        "INSERT OR REPLACE INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(*key, value, started_at) for key, (value, started_at) in changed.items()]
+    )
+
+
+def rebuild(conn, exercise_id, archived=True):
+    """Recompute one exercise's records from its sessions (`archived` ones too)."""
+    if not conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Sessions'").fetchone():
+        # migration 7 on a db that still has dated Logs, migration 9 fills it
+        return
+    conn.execute("DELETE FROM PersonalRecords WHERE exercise_id = ?", (exercise_id,))
+    cold = archived and archive.sessions(conn, [exercise_id]).get(exercise_id)
+    if cold:
+        _rebuild_with_archive(conn, exercise_id, cold)
+        return
+    # sqlite fills the bare `started_at` column from the row that has the max()
+    conn.execute(
+        "INSERT INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+        "SELECT s.exercise_id, ?, l.reps, max(l.weight), s.started_at "
+        "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+        "WHERE s.exercise_id = ? GROUP BY l.reps",
+        (KIND_WEIGHT, exercise_id)
+    )
+    conn.execute(
+        "INSERT INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+        "SELECT s.exercise_id, ?, 0, "
+        "max(CASE WHEN l.reps = 1 THEN l.weight ELSE l.weight * (1 + l.reps / 30.0) END), "
+        "s.started_at FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+        "WHERE s.exercise_id = ? GROUP BY s.exercise_id",
+        (KIND_E1RM, exercise_id)
+    )
+    conn.execute(
+        "INSERT INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+        "SELECT s.exercise_id, ?, 0, sum(l.reps * l.weight) AS volume, s.started_at "
+        "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+        "WHERE s.exercise_id = ? GROUP BY s.session_id "
+        "ORDER BY volume DESC, s.started_at LIMIT 1",
+        (KIND_VOLUME, exercise_id)
+    )
+
+
+def _rebuild_with_archive(conn, exercise_id, cold):
+    # archived + hot sessions replayed through update() oldest first
+    hot = {}
+    for session_id, started_at, reps, weight in conn.execute(
+            "SELECT s.session_id, s.started_at, l.reps, l.weight "
+            "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+            "WHERE s.exercise_id = ? ORDER BY s.started_at, s.session_id, l.log_id",
+            (exercise_id,)):
+        hot.setdefault(session_id, (started_at, []))[1].append((reps, weight))
+    for started_at, sets in sorted(cold + list(hot.values()), key=lambda session: session[0]):
+        update(conn, exercise_id, started_at, sets)
+
+
+def rebuild_all(conn, batch_size=500):
+    """Backfill PersonalRecords for every exercise, committing per batch."""
+    done = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in conn.execute(
+            "SELECT exercise_id FROM Exercises WHERE exercise_id > ? "
+            "ORDER BY exercise_id LIMIT ?",
+            (last_id, batch_size)
+        )]
+        if not ids:
+            return done
+        for exercise_id in ids:
+            rebuild(conn, exercise_id)
+        conn.commit()
+        done += len(ids)
+        last_id = ids[-1]
+
+
+def for_exercises(conn, exercise_ids):
+    """{exercise_id: {(kind, reps): (value, achieved_at)}} with one primary-key query."""
+    result = {exercise_id: {} for exercise_id in exercise_ids}
+    if not exercise_ids:
+        return result
+    placeholders = ",".join("?" * len(exercise_ids))
+    for exercise_id, kind, reps, value, achieved_at in conn.execute(
+            "SELECT exercise_id, kind, reps, value, achieved_at FROM PersonalRecords "
+            f"WHERE exercise_id IN ({placeholders})",
+            list(exercise_ids)):
+        result[exercise_id][(kind, reps)] = (value, achieved_at)
+    return result
+
+
+# --- texts ---
+
+def _kg(value):
+    value = round(float(value), 1)
+    return f"{value:,.0f}".replace(",", " ") if value.is_integer() else f"{value:.1f}"
+
+
+def _day(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d")
+
+
+def describe(kind, reps, value):
+    if kind == KIND_WEIGHT:
+        return f"вес на {reps} повт.: {_kg(value)} кг"
+    if kind == KIND_E1RM:
+        return f"расчётный 1ПМ: {_kg(value)} кг"
+    return f"тоннаж за тренировку: {_kg(value)} кг"
+
+
+def congratulation(beaten):
+    """Lines for the records of update() that beat an earlier one ('' if none)."""
+    lines = [f"🏆 Новый рекорд, {describe(kind, reps, value)} (был {_kg(previous)})"
+             for kind, reps, value, previous in sorted(
+                 beaten, key=lambda record: (KINDS.index(record[0]), record[1]))
+             if previous is not None and value > 0]
+    return "\n".join(lines)
+
+
+def day_text(day_name, exercises, records_by_id):
+    """exercises: [(exercise_id, name)], records_by_id: see for_exercises."""
+    text = f"🏆 *{escape_markdown(day_name or 'День')}* — рекорды\n"
+    if not exercises:
+        return text + "\nВ этом дне пока нет упражнений."
+    for exercise_id, name in exercises:
+        found = records_by_id[exercise_id]
+        text += f"\n*{escape_markdown(name)}*\n"
+        if not found:
+            text += "записей нет\n"
+            continue
+        e1rm, e1rm_at = found[(KIND_E1RM, 0)]
+        volume, volume_at = found[(KIND_VOLUME, 0)]
+        weights = sorted((reps, value) for (kind, reps), (value, _) in found.items()
+                         if kind == KIND_WEIGHT)
+        text += (f"1ПМ ≈ {_kg(e1rm)} кг ({_day(e1rm_at)}), "
+                 f"тоннаж {_kg(volume)} кг ({_day(volume_at)})\n"
+                 f"{' · '.join(f'{reps}×{_kg(value)}' for reps, value in weights)}\n")
+    return text
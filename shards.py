@@ -0,0 +1,432 @@
+"""
+Sharded multi-process mode.
+
+One dispatcher process takes the updates (long polling or webhook) and
+routes each one by a hash of its user id to one of N worker processes.
+Every worker imports main.py with GYMBRO_DB pointing at its own shard
+file, so it has its own pool, caches, writer and outbox, and its own
+SQLite write lock. All of a user's updates go to one worker over one
+FIFO queue and, inside it, to one handler thread, so they stay in order.
+Every worker's outbox gets 1/N of the global send rate
+(GYMBRO_OUTBOX_GLOBAL_RATE), so together they keep to Telegram's limit.
+
+    python shards.py --shards 4                 # long polling
+    python shards.py --shards 4 --source webhook --webhook-url https://...
+
+Shard 0 is GYMBRO_DB itself (workouts.db), shard i is workouts-i.db, so
+a single-process db is shard 0 of any layout. Each shard hands out
+day/exercise/log ids from its own range (i << ID_BITS), ids stay unique
+across shards.
+
+Changing the number of shards moves the users whose shard changes
+(`python manage.py reshard --from 1 --to 4`, with the bot stopped).
+Doubling N splits every shard in two and leaves the other half of its
+users where they are. A moved user gets new ids in the target shard,
+inline keyboards sent before the move stop pointing at anything.
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+
+import db
+import metrics
+import migrations
+import webhook
+
+SHARDS = int(os.getenv("GYMBRO_SHARDS", "4"))
+SHARD_THREADS = int(os.getenv("GYMBRO_SHARD_THREADS", "2"))
+SHARD_QUEUE = int(os.getenv("GYMBRO_SHARD_QUEUE", "10000"))
+
+ID_BITS = 40  # ~10^12 ids per shard
+ID_TABLES = ("TrainingDays", "Exercises", "Sessions", "Logs")
+
+
+def shard_for(user_id, shards):
+    # crc32, not hash(): the same user must land on the same shard in every process
+    return zlib.crc32(int(user_id).to_bytes(8, "little", signed=True)) % shards
+
+
+def shard_path(index, base=None):
+    base = base or db.DB_PATH
+    if index == 0:
+        return base
+    root, ext = os.path.splitext(base)
+    return f"{root}-{index}{ext}"
+
+
+def reserve_ids(conn, index):
+    """Make AUTOINCREMENT ids of this shard start at its range."""
+    start = index << ID_BITS
+    for table in ID_TABLES:
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = ? AND seq < ?",
+                     (start, table, start))
+        conn.execute(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT ?, ? "
+            "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = ?)",
+            (table, start, table))
+    conn.commit()
+
+
+def open_shard(index, base=None):
+    """Pool for one shard file, migrated and with its id range reserved."""
+    pool = db.ConnectionPool(shard_path(index, base), max_size=1)
+    with pool.connection() as conn:
+        migrations.migrate(conn)
+        reserve_ids(conn, index)
+    return pool
+
+
+# --- worker process ---
+
+def _worker(index, path, updates, processed, ready, threads, global_rate):
+    # db (and metrics) came in with this module, before main.py
+    os.environ["GYMBRO_DB"] = path
+    # read by outbound.py when main.py imports it
+    os.environ["GYMBRO_OUTBOX_GLOBAL_RATE"] = str(global_rate)
+    db.use(path)
+
+    import main
+    from telebot import types
+
+    main.init_db()
+    with db.connection() as conn:
+        reserve_ids(conn, index)
+    main.writer.start()
+    main.compaction.start()
+    main.backup.start()
+    # the dispatcher's port + 1 + shard
+    if main.metrics.METRICS_PORT:
+        main.metrics.serve(main.metrics.METRICS_PORT + 1 + index)
+    # handlers run inline on our lanes, not in telebot's own pool
+    main.bot.threaded = False
+
+    def lane(lane_updates):
+        while True:
+            update = lane_updates.get()
+            if update is None:
+                return
+            try:
+                main.bot.process_new_updates([types.Update.de_json(update)])
+            except Exception as e:
+                print(f"Шард {index}: ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                with processed.get_lock():
+                    processed.value += 1
+
+    # same partitioning as webhook.py: one user always on the same lane
+    lanes = [queue.SimpleQueue() for _ in range(threads)]
+    workers = [threading.Thread(target=lane, args=(q,), name=f"shard{index}-{i}")
+               for i, q in enumerate(lanes)]
+    for t in workers:
+        t.start()
+    ready.set()
+
+    try:
+        while True:
+            update = updates.get()
+            if update is None:
+                break
+            lanes[hash(webhook.update_user_id(update)) % threads].put(update)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for q in lanes:
+            q.put(None)
+        for t in workers:
+            t.join()
+        main.shutdown()
+
+
+# --- dispatcher ---
+
+class ShardDispatcher:
+    """
+    Routes raw update dicts to `shards` worker processes by user id.
+
+    A worker that died is started again on its queue, the updates still
+    queued for it are not lost. Each queue holds at most `max_queue`
+    updates, dispatch() blocks when the worker falls that far behind.
+    """
+
+    def __init__(self, shards=SHARDS, base_path=None, threads=SHARD_THREADS,
+                 max_queue=SHARD_QUEUE, global_rate=None):
+        # not at the top: the workers import this module and must read the
+        # rate from the environment we give them
+        import outbound
+
+        self.shards = shards
+        self.base_path = base_path or db.DB_PATH
+        self.threads = threads
+        # the Bot API limit is per bot, the workers share it
+        self.global_rate = (global_rate or outbound.GLOBAL_RATE) / shards
+        # spawn: workers import main.py fresh, with their own GYMBRO_DB
+        self._context = multiprocessing.get_context("spawn")
+        self._queues = [self._context.Queue(max_queue) for _ in range(shards)]
+        self._processed = [self._context.Value("q", 0) for _ in range(shards)]
+        self._dispatched = [0] * shards
+        self._processes = [None] * shards
+        self._lock = threading.Lock()  # webhook threads dispatch concurrently
+        self.restarts = 0
+
+    def _spawn(self, index):
+        ready = self._context.Event()
+        process = self._context.Process(
+            target=_worker, name=f"shard-{index}",
+            args=(index, shard_path(index, self.base_path), self._queues[index],
+                  self._processed[index], ready, self.threads, self.global_rate))
+        process.start()
+        self._processes[index] = process
+        return ready
+
+    def start(self, timeout=60):
+        for ready in [self._spawn(i) for i in range(self.shards)]:
+            if not ready.wait(timeout):
+                raise RuntimeError("shard worker did not start")
+        return self
+
+    def dispatch(self, update):
+        index = shard_for(webhook.update_user_id(update), self.shards)
+        with self._lock:
+            if not self._processes[index].is_alive():
+                # what it had taken off the queue but not finished is lost
+                queued = self._queues[index].qsize()
+                lost = self._dispatched[index] - self._processed[index].value - queued
+                print(f"Шард {index} упал (код {self._processes[index].exitcode}), "
+                      f"потеряно апдейтов: {lost}, перезапускаю")
+                self._dispatched[index] -= lost
+                self.restarts += 1
+                self._spawn(index)
+            self._dispatched[index] += 1
+        self._queues[index].put(update)
+
+    def pending(self):
+        return sum(d - p.value for d, p in zip(self._dispatched, self._processed))
+
+    def join(self, timeout=None):
+        """Wait until every dispatched update has been handled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.pending():
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.005)
+        return True
+
+    def stop(self):
+        for updates in self._queues:
+            updates.put(None)
+        for process in self._processes:
+            if process is not None:
+                process.join()
+
+    def stats(self):
+        return {
+            "restarts": self.restarts,
+            "pending": self.pending(),
+            "shards": {str(i): {"dispatched": self._dispatched[i],
+                                "processed": self._processed[i].value,
+                                "alive": int(bool(self._processes[i] and
+                                                  self._processes[i].is_alive()))}
+                       for i in range(self.shards)},
+        }
+
+
+def poll(dispatcher, token, timeout=20):
+    """Long-poll Telegram and dispatch the raw updates."""
+    from telebot import apihelper
+
+    offset = None
+    while True:
+        try:
+            updates = apihelper.get_updates(token, offset=offset, timeout=timeout)
+        except Exception as e:
+            print(f"Ошибка getUpdates: {e}")
+            time.sleep(1)
+            continue
+        for update in updates:
+            offset = update["update_id"] + 1
+            dispatcher.dispatch(update)
+
+
+# --- moving users between shards ---
+
+def shard_users(conn):
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT user_id FROM TrainingDays ORDER BY user_id")]
+
+
+def _delete_user(conn, user_id):
+    # exercises, sessions, sets, summaries and records go with the days (ON DELETE CASCADE)
+    conn.execute("DELETE FROM TrainingDays WHERE user_id = ?", (user_id,))
+    # private chats: chat_id == user_id
+    conn.execute("DELETE FROM ConversationState WHERE chat_id = ?", (user_id,))
+
+
+def move_user(src, dst, user_id):
+    """
+    Copy a user's days/exercises/sessions/sets/archived months/summaries/
+    records/pending step from `src` to `dst` with new ids, then delete them from `src`.
+    Safe to run again after a crash: a leftover partial copy in `dst` is
+    dropped first.
+    Returns the number of sets moved.
+    """
+    from state import State
+
+    day_map = {}
+    exercise_map = {}
+    moved = 0
+    _delete_user(dst, user_id)
+    for day_id, day_name in src.execute(
+            "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ? AND deleted_at IS NULL "
+            "ORDER BY day_id", (user_id,)).fetchall():
+        day_map[day_id] = dst.execute(
+            "INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)", (user_id, day_name)
+        ).lastrowid
+        for exercise_id, name in src.execute(
+                "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ? "
+                "ORDER BY exercise_id", (day_id,)).fetchall():
+            new_id = exercise_map[exercise_id] = dst.execute(
+                "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)",
+                (day_map[day_id], name)
+            ).lastrowid
+            for session_id, started_at in src.execute(
+                    "SELECT session_id, started_at FROM Sessions WHERE exercise_id = ? "
+                    "ORDER BY session_id", (exercise_id,)).fetchall():
+                new_session = dst.execute(
+                    "INSERT INTO Sessions (exercise_id, started_at) VALUES (?, ?)",
+                    (new_id, started_at)
+                ).lastrowid
+                logs = src.execute(
+                    "SELECT reps, weight FROM Logs WHERE session_id = ? ORDER BY log_id",
+                    (session_id,)).fetchall()
+                dst.executemany(
+                    "INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)",
+                    [(new_session, *row) for row in logs])
+                moved += len(logs)
+            # archived months move as they are, blobs don't hold ids
+            for row in src.execute(
+                    "SELECT month, first_at, last_at, sessions, sets, data FROM SessionArchive "
+                    "WHERE exercise_id = ?", (exercise_id,)).fetchall():
+                dst.execute(
+                    "INSERT INTO SessionArchive (exercise_id, month, first_at, last_at, "
+                    "sessions, sets, data) VALUES (?, ?, ?, ?, ?, ?, ?)", (new_id, *row))
+                moved += row[4]
+            summary = src.execute(
+                "SELECT last_at, last_reps, last_weights, prev_at, prev_reps, prev_weights "
+                "FROM ExerciseSummary WHERE exercise_id = ?", (exercise_id,)).fetchone()
+            if summary:
+                dst.execute(
+                    "INSERT INTO ExerciseSummary (exercise_id, last_at, last_reps, "
+                    "last_weights, prev_at, prev_reps, prev_weights) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", (new_id, *summary))
+            dst.executemany(
+                "INSERT INTO PersonalRecords (exercise_id, kind, reps, value, achieved_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(new_id, *row) for row in src.execute(
+                    "SELECT kind, reps, value, achieved_at FROM PersonalRecords "
+                    "WHERE exercise_id = ?", (exercise_id,))])
+
+    step = src.execute("SELECT state, ref_id, expires_at FROM ConversationState "
+                       "WHERE chat_id = ?", (user_id,)).fetchone()
+    if step:
+        state, ref_id, expires_at = step
+        if state == State.AWAIT_NEW_EXERCISE:
+            ref_id = day_map.get(ref_id)
+        elif state == State.AWAIT_LOGS:
+            ref_id = exercise_map.get(ref_id)
+        dst.execute("INSERT INTO ConversationState (chat_id, state, ref_id, expires_at) "
+                    "VALUES (?, ?, ?, ?)", (user_id, state, ref_id, expires_at))
+    dst.commit()
+
+    _delete_user(src, user_id)
+    src.commit()
+    return moved
+
+
+def reshard(old_shards, new_shards, base=None, log=print):
+    """
+    Move every user to shard_for(user, new_shards). Run with the bot
+    stopped. Shards >= new_shards are left empty (delete the files after).
+    Returns {"users": moved users, "sets": moved sets}.
+    """
+    pools = {}
+
+    def pool(index):
+        if index not in pools:
+            pools[index] = open_shard(index, base)
+        return pools[index]
+
+    users = sets = 0
+    try:
+        for source in range(old_shards):
+            with pool(source).connection() as src:
+                for user_id in shard_users(src):
+                    target = shard_for(user_id, new_shards)
+                    if target == source:
+                        continue
+                    with pool(target).connection() as dst:
+                        sets += move_user(src, dst, user_id)
+                    users += 1
+            log(f"shard {source}: done, {users} users / {sets} sets moved so far")
+    finally:
+        for p in pools.values():
+            p.close()
+    return {"users": users, "sets": sets}
+
+
+def run(shards=SHARDS, source="polling", public_url=None):
+    from dotenv import load_dotenv
+
+    import fakeapi
+
+    load_dotenv()
+    token = os.getenv("TELEGRAM_TOKEN")
+    if token is None:
+        print("Ошибка: Не удалось загрузить TELEGRAM_TOKEN.")
+        return
+    if os.getenv("GYMBRO_API_URL"):
+        fakeapi.use(os.getenv("GYMBRO_API_URL"))
+
+    dispatcher = ShardDispatcher(shards).start()
+    # workers serve their own /metrics on the next ports
+    metrics.register("shards", dispatcher.stats)
+    metrics.serve()
+    server = None
+    print(f"Бот успешно запущен ({shards} шардов, {source})...")
+    try:
+        if source == "webhook":
+            from telebot import apihelper
+
+            if not public_url and not webhook.SECRET:
+                print("Ошибка: без --webhook-url нужен GYMBRO_WEBHOOK_SECRET "
+                      "(тот же, что передан в setWebhook).")
+                return
+            # the server's threads are partitioned by user too, order is kept
+            server = webhook.WebhookServer(dispatcher.dispatch)
+            if public_url:
+                apihelper.set_webhook(token, url=public_url, secret_token=server.secret)
+            server.start()
+            print(f"Webhook слушает {server.url}")
+            threading.Event().wait()
+        else:
+            poll(dispatcher, token)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if server is not None:
+            server.stop()
+        dispatcher.stop()
+        print(f"Shard stats: {dispatcher.stats()}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="GymBro bot, one process per shard")
+    parser.add_argument("--shards", type=int, default=SHARDS)
+    parser.add_argument("--source", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--webhook-url", default=os.getenv("GYMBRO_WEBHOOK_URL"),
+                        help="public URL to register with setWebhook")
+    args = parser.parse_args()
+    run(args.shards, args.source, args.webhook_url)
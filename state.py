@@ -0,0 +1,152 @@
+"""
+Conversation state: which answer the bot is waiting for from each chat.
+
+Replaces bot.register_next_step_handler, which kept a closure per pending
+user in memory forever. A pending step is just (State, ref_id, expires_at)
+where ref_id is the day_id / exercise_id the answer belongs to.
+
+MemoryStateStore is an LRU with a TTL. SqliteStateStore keeps the same
+LRU as a cache in front of the ConversationState table, so pending flows
+survive a restart and evicted entries are not lost. It caches "nothing
+pending" too, so most messages (no step waiting) don't hit the table.
+"""
+import enum
+import math
+import os
+import threading
+import time
+
+import db
+
+STATE_TTL = int(os.getenv("GYMBRO_STATE_TTL", str(24 * 3600)))
+STATE_CACHE_SIZE = int(os.getenv("GYMBRO_STATE_CACHE_SIZE", "100000"))
+STATE_STORE = os.getenv("GYMBRO_STATE_STORE", "sqlite")
+
+# cached miss of SqliteStateStore, replaced by set(), never expires by itself
+_NOTHING = (None, None, math.inf)
+
+
+class State(enum.IntEnum):
+    AWAIT_DAY_NAME = 1          # save_day
+    AWAIT_NEW_EXERCISE = 2      # parse_new_exercise_and_logs, ref = day_id
+    AWAIT_LOGS = 3              # parse_logs_for_existing_exercise, ref = exercise_id
+    AWAIT_IMPORT = 4            # handle_import_file (a document, not text)
+
+
+class MemoryStateStore:
+    """chat_id -> (state, ref_id, expires_at), LRU-bounded, entries expire after `ttl`."""
+
+    def __init__(self, ttl=STATE_TTL, max_size=STATE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # plain dicts keep insertion order and are much smaller than
+        # OrderedDict; re-inserting a key moves it to the end
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set(self, chat_id, state, ref_id=None):
+        self._remember(chat_id, (int(state), ref_id, time.time() + self.ttl))
+
+    def get(self, chat_id):
+        """Returns (State, ref_id) or None."""
+        entry = self._lookup(chat_id)
+        if entry is None:
+            return None
+        return State(entry[0]), entry[1]
+
+    def pop(self, chat_id):
+        """Like get(), but the step is consumed."""
+        step = self.get(chat_id)
+        if step is not None:
+            self.discard(chat_id)
+        return step
+
+    def discard(self, chat_id):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [k for k, entry in self._entries.items() if entry[2] <= now]
+            for chat_id in expired:
+                del self._entries[chat_id]
+        return len(expired)
+
+    def _remember(self, chat_id, entry):
+        with self._lock:
+            self._entries.pop(chat_id, None)
+            self._entries[chat_id] = entry
+            while len(self._entries) > self.max_size:
+                del self._entries[next(iter(self._entries))]
+                self.evictions += 1
+
+    def _lookup(self, chat_id):
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is None:
+                return None
+            del self._entries[chat_id]
+            if entry[2] <= time.time():
+                return None
+            self._entries[chat_id] = entry
+            return entry
+
+
+class SqliteStateStore(MemoryStateStore):
+    """Write-through to ConversationState; the in-memory LRU is only a cache."""
+
+    def __init__(self, pool=None, ttl=STATE_TTL, max_size=STATE_CACHE_SIZE):
+        super().__init__(ttl=ttl, max_size=max_size)
+        self.pool = pool or db.pool
+
+    def set(self, chat_id, state, ref_id=None):
+        entry = (int(state), ref_id, time.time() + self.ttl)
+        with self.pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ConversationState (chat_id, state, ref_id, expires_at) "
+                "VALUES (?, ?, ?, ?)",
+                (chat_id, *entry)
+            )
+            conn.commit()
+        self._remember(chat_id, entry)
+
+    def discard(self, chat_id):
+        super().discard(chat_id)
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM ConversationState WHERE chat_id = ?", (chat_id,))
+            conn.commit()
+        self._remember(chat_id, _NOTHING)
+
+    def purge_expired(self):
+        super().purge_expired()
+        with self.pool.connection() as conn:
+            cursor = conn.execute("DELETE FROM ConversationState WHERE expires_at <= ?",
+                                  (time.time(),))
+            conn.commit()
+        return cursor.rowcount
+
+    def _lookup(self, chat_id):
+        entry = super()._lookup(chat_id)
+        if entry is not None:
+            return None if entry is _NOTHING else entry
+
+        # not cached: evicted, from before a restart, or simply not pending
+        with self.pool.connection() as conn:
+            entry = conn.execute(
+                "SELECT state, ref_id, expires_at FROM ConversationState "
+                "WHERE chat_id = ? AND expires_at > ?",
+                (chat_id, time.time())
+            ).fetchone()
+        self._remember(chat_id, entry or _NOTHING)
+        return entry
+
+
+def make_store(kind=STATE_STORE):
+    if kind == "memory":
+        return MemoryStateStore()
+    return SqliteStateStore()
@@ -0,0 +1,338 @@
+"""
+Progress analytics: tonnage per session, estimated 1RM, weekly volume
+and trend slopes, per exercise and per training day.
+
+The sets of a batch of exercises come out of idx_sessions_exercise_time
++ idx_logs_session with one query, already sorted by (exercise, time),
+and everything is computed on NumPy arrays: a session is a run of equal
+session_id, so per-session sums/maxima are ufunc.reduceat over the run
+starts. Sessions moved to the cold tier (archive.py) come as arrays too
+(archive.columns), get concatenated and the rows re-sorted, only for
+exercises that have any.
+
+Per-exercise results are cached. Writes to Logs must call invalidate()
+after their commit, like the cache.invalidate_* functions. Anything that
+depends on today's date (last N weeks, recent trend) is worked out when
+the text is rendered, so cached entries don't go stale overnight.
+"""
+import os
+import re
+import time
+from datetime import date, datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+import archive
+import db
+from cache import LRUCache
+
+STATS_CACHE_SIZE = int(os.getenv("GYMBRO_STATS_CACHE_SIZE", "20000"))
+TREND_DAYS = 90          # "recent" trend window
+WEEKS_SHOWN = 8
+SPARK = "▁▂▃▄▅▆▇█"
+
+_EPOCH = np.datetime64("1970-01-01", "D")
+
+
+class ExerciseStats:
+    """Per-session arrays of one exercise (sorted by date)."""
+    __slots__ = ("days", "dates", "tonnage", "epley", "brzycki", "first_week", "weekly")
+
+    def __init__(self, days, dates, tonnage, epley, brzycki):
+        self.days = days          # session day numbers (days since 1970-01-01)
+        self.dates = dates        # session dates as 'YYYY-MM-DD'
+        self.tonnage = tonnage    # sum of reps * weight
+        self.epley = epley        # best Epley e1RM of the session
+        self.brzycki = brzycki    # best Brzycki e1RM (nan past 36 reps)
+        if len(days):
+            # weeks start on Monday; 1970-01-01 was a Thursday
+            weeks = (days + 3) // 7
+            self.first_week = int(weeks[0])
+            self.weekly = np.bincount(weeks - weeks[0], weights=tonnage)
+        else:
+            self.first_week = 0
+            self.weekly = np.zeros(0)
+
+    def __len__(self):
+        return len(self.days)
+
+
+EMPTY = ExerciseStats(np.zeros(0, np.int64), np.zeros(0, "U10"), np.zeros(0), np.zeros(0),
+                      np.zeros(0))
+
+
+def epley(weight, reps):
+    return np.where(reps == 1, weight, weight * (1 + reps / 30))
+
+
+def brzycki(weight, reps):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(reps < 37, weight * 36 / (37 - reps), np.nan)
+
+
+def _local_zone():
+    """the server's zone (TZ or /etc/localtime) as a ZoneInfo, None if it has no tzdata name"""
+    key = os.getenv("TZ", "").lstrip(":")
+    if not key:
+        path = os.path.realpath("/etc/localtime")
+        key = path.split("zoneinfo/", 1)[1] if "zoneinfo/" in path else ""
+    try:
+        return ZoneInfo(key) if key else None
+    except (ValueError, ZoneInfoNotFoundError):
+        return None
+
+
+def _utc_offset(timestamp, zone):
+    if zone is None:
+        return time.localtime(timestamp).tm_gmtoff
+    return int(datetime.fromtimestamp(timestamp, zone).utcoffset().total_seconds())
+
+
+# (first, last, transitions, offsets): utc offsets of the local zone between
+# `first` and `last`, offsets[i] is in effect from transitions[i - 1] on
+_zone_table = None
+
+
+def _transitions(lo, hi):
+    """
+    Transition points of the local zone covering [lo, hi]. The offset is
+    looked up once a day and every change is bisected down to the second,
+    so a 10-year span costs a few thousand lookups, once per process.
+    """
+    global _zone_table
+    table = _zone_table
+    if table is not None and table[0] <= lo and hi <= table[1]:
+        return table[2], table[3]
+    if table is not None:
+        lo, hi = min(lo, table[0]), max(hi, table[1])
+    zone = _local_zone()
+    probes = list(range(lo - lo % 86400, hi + 86400, 86400))
+    offsets = [_utc_offset(t, zone) for t in probes]
+    transitions, values = [], [offsets[0]]
+    for before, after, old, new in zip(probes, probes[1:], offsets, offsets[1:]):
+        if old == new:
+            continue
+        while after - before > 1:
+            middle = (before + after) // 2
+            if _utc_offset(middle, zone) == old:
+                before = middle
+            else:
+                after = middle
+        transitions.append(after)
+        values.append(new)
+    table = (probes[0], probes[-1], np.array(transitions, np.int64), np.array(values, np.int64))
+    _zone_table = table
+    return table[2], table[3]
+
+
+def local_days(timestamps):
+    """unix seconds -> day numbers of the server's local calendar (like the shown dates)"""
+    if not len(timestamps):
+        return timestamps // 86400
+    transitions, offsets = _transitions(int(timestamps.min()), int(timestamps.max()))
+    return (timestamps + offsets[np.searchsorted(transitions, timestamps, side="right")]) // 86400
+
+
+def compute(exercise_ids, session_ids, started_at, reps, weights):
+    """
+    Rows sorted by (exercise_id, started_at, session_id) as arrays ->
+    {exercise_id: ExerciseStats}. `started_at` is unix seconds.
+    """
+    n = len(exercise_ids)
+    if not n:
+        return {}
+    new_session = np.empty(n, dtype=bool)
+    new_session[0] = True
+    np.not_equal(session_ids[1:], session_ids[:-1], out=new_session[1:])
+    starts = np.flatnonzero(new_session)
+
+    tonnage = np.add.reduceat(reps * weights, starts)
+    best_epley = np.maximum.reduceat(epley(weights, reps), starts)
+    best_brzycki = np.fmax.reduceat(brzycki(weights, reps), starts)
+    session_exercise = exercise_ids[starts]
+    # utc offsets come from the zone's transition points, per session
+    session_day = local_days(started_at[starts])
+    session_date = np.datetime_as_string(session_day.astype("datetime64[D]"))
+
+    # split the session arrays per exercise (a loop over exercises, not rows)
+    bounds = np.flatnonzero(np.diff(session_exercise)) + 1
+    result = {}
+    for lo, hi in zip(np.r_[0, bounds], np.r_[bounds, len(starts)]):
+        result[int(session_exercise[lo])] = ExerciseStats(
+            session_day[lo:hi], session_date[lo:hi], tonnage[lo:hi],
+            best_epley[lo:hi], best_brzycki[lo:hi])
+    return result
+
+
+def load(conn, exercise_ids):
+    """
+    One query for all the exercises' hot sets (+ one for their archived
+    months) -> {exercise_id: ExerciseStats}.
+    """
+    placeholders = ",".join("?" * len(exercise_ids))
+    rows = conn.execute(
+        "SELECT s.exercise_id, s.session_id, s.started_at, l.reps, l.weight "
+        "FROM Sessions s JOIN Logs l ON l.session_id = s.session_id "
+        f"WHERE s.exercise_id IN ({placeholders}) "
+        "ORDER BY s.exercise_id, s.started_at, s.session_id",
+        list(exercise_ids)
+    ).fetchall()
+    result = dict.fromkeys(exercise_ids, EMPTY)
+    # old sessions live in the archive, as arrays with negative session ids
+    cold = archive.columns(conn, exercise_ids)
+    if not rows and cold is None:
+        return result
+    if not rows:
+        ex, session_ids, started_at, reps, weights = cold
+    elif cold is None:
+        ex, session_ids, started_at, reps, weights = (np.array(column) for column in zip(*rows))
+    else:
+        ex, session_ids, started_at, reps, weights = (
+            np.concatenate((np.array(hot), archived)) for hot, archived in zip(zip(*rows), cold))
+        order = np.lexsort((session_ids, started_at, ex))
+        ex, session_ids, started_at, reps, weights = (
+            column[order] for column in (ex, session_ids, started_at, reps, weights))
+    result.update(compute(ex.astype(np.int64), session_ids.astype(np.int64),
+                          started_at.astype(np.int64), reps.astype(np.float64),
+                          weights.astype(np.float64)))
+    return result
+
+
+_cache = LRUCache(STATS_CACHE_SIZE)
+
+
+def _load_many(exercise_ids):
+    with db.connection() as conn:
+        return load(conn, exercise_ids)
+
+
+def get(exercise_id):
+    return _cache.get_many_or_load([exercise_id], _load_many)[exercise_id]
+
+
+def get_many(exercise_ids):
+    return _cache.get_many_or_load(exercise_ids, _load_many)
+
+
+def invalidate(exercise_id):
+    _cache.invalidate(exercise_id)
+
+
+def cache_stats():
+    return _cache.stats()
+
+
+# --- derived numbers (cheap, done at render time) ---
+
+def today():
+    return (np.datetime64(date.today(), "D") - _EPOCH).astype(np.int64)
+
+
+def slope_per_week(days, values):
+    """Least-squares slope of values over time, per week. None with < 2 distinct days."""
+    mask = ~np.isnan(values)
+    days, values = days[mask], values[mask]
+    if len(days) < 2 or days[0] == days[-1]:
+        return None
+    x = days - days.mean()
+    return float((x * (values - values.mean())).sum() / (x * x).sum() * 7)
+
+
+def weekly_volume(st, weeks=WEEKS_SHOWN, now=None):
+    """Tonnage of the last `weeks` calendar weeks, oldest first (zeros included)."""
+    current = (int(today() if now is None else now) + 3) // 7
+    out = np.zeros(weeks)
+    if len(st):
+        idx = np.arange(current - weeks + 1, current + 1) - st.first_week
+        ok = (idx >= 0) & (idx < len(st.weekly))
+        out[ok] = st.weekly[idx[ok]]
+    return out
+
+
+def sparkline(values):
+    top = values.max() if len(values) else 0
+    if not top:
+        return SPARK[0] * len(values)
+    return "".join(SPARK[int(v / top * (len(SPARK) - 1))] for v in values)
+
+
+def _kg(value):
+    if np.isnan(value):
+        return "—"
+    if value >= 100:
+        return f"{value:,.0f}".replace(",", " ")
+    return f"{value:.1f}".rstrip("0").rstrip(".")
+
+
+def _trend(value, unit="кг"):
+    if value is None:
+        return "—"
+    return f"{value:+.1f} {unit}/нед"
+
+
+# --- texts (Markdown) ---
+
+def escape_markdown(text):
+    # legacy Markdown (parse_mode="Markdown") only knows these
+    return re.sub(r"([_*`\[])", r"\\\1", text)
+
+
+def exercise_text(name, st, now=None):
+    now = today() if now is None else now
+    text = f"📈 *{escape_markdown(name)}* — статистика\n\n"
+    if not len(st):
+        return text + "Записей пока нет."
+
+    best = int(np.argmax(st.epley))
+    recent = st.days >= now - TREND_DAYS
+    volume = weekly_volume(st, now=now)
+    text += (
+        f"Тренировок: {len(st)} (с {st.dates[0]})\n"
+        f"Последняя ({st.dates[-1]}): тоннаж {_kg(st.tonnage[-1])} кг, "
+        f"1ПМ ≈ {_kg(st.epley[-1])} кг\n"
+        f"Лучший 1ПМ ({st.dates[best]}): Эпли {_kg(st.epley[best])} / "
+        f"Бжицки {_kg(np.fmax.reduce(st.brzycki))} кг\n\n"
+        f"Тоннаж (последние 5): {', '.join(_kg(t) for t in st.tonnage[-5:])}\n"
+        f"Объём по неделям ({WEEKS_SHOWN} нед): `{sparkline(volume)}` "
+        f"{_kg(volume[-1])} кг на этой неделе\n\n"
+        f"Тренд 1ПМ: {_trend(slope_per_week(st.days[recent], st.epley[recent]))} "
+        f"({TREND_DAYS} дн), {_trend(slope_per_week(st.days, st.epley))} (всё время)\n"
+        f"Тренд тоннажа: {_trend(slope_per_week(st.days[recent], st.tonnage[recent]))} "
+        f"({TREND_DAYS} дн)"
+    )
+    return text
+
+
+def day_text(day_name, exercises, stats_by_id, now=None, shown=None):
+    """
+    exercises: [(exercise_id, name)], stats_by_id: {exercise_id: ExerciseStats}.
+    The totals are over all `exercises`, the per-exercise lines only for
+    `shown` (one page of them) when it is given.
+    """
+    now = today() if now is None else now
+    text = f"📈 *{escape_markdown(day_name or 'День')}* — статистика\n\n"
+    if not exercises:
+        return text + "В этом дне пока нет упражнений."
+
+    volume = np.zeros(WEEKS_SHOWN)
+    sessions = 0
+    for exercise_id, _ in exercises:
+        st = stats_by_id[exercise_id]
+        volume += weekly_volume(st, now=now)
+        sessions += len(st)
+    lines = []
+    for exercise_id, name in (exercises if shown is None else shown):
+        st = stats_by_id[exercise_id]
+        if not len(st):
+            lines.append(f"• {escape_markdown(name)}: записей нет")
+            continue
+        recent = st.days >= now - TREND_DAYS
+        lines.append(f"• {escape_markdown(name)}: 1ПМ {_kg(st.epley.max())} кг, "
+                     f"тренд {_trend(slope_per_week(st.days[recent], st.epley[recent]))}")
+    text += (
+        f"Тренировок по упражнениям: {sessions}\n"
+        f"Объём дня по неделям ({WEEKS_SHOWN} нед): `{sparkline(volume)}`\n"
+        f"Эта неделя: {_kg(volume[-1])} кг, прошлая: {_kg(volume[-2])} кг\n\n"
+    )
+    return text + "\n".join(lines)
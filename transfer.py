@@ -0,0 +1,370 @@
+"""
+Streaming import/export of a user's workout history.
+
+One row per logged set: day, exercise, date, reps, weight. Days and
+exercises without sets are exported as rows with empty date/reps/weight
+so an import recreates them too. Two formats:
+
+- csv: header row + one row per set, opens in any spreadsheet
+- jsonl: one {"day": ..., "exercise": ..., ...} object per line
+
+Both directions are streamed: export reads the db with fetchmany (and
+an exercise's archived months, archive.py, one exercise at a time),
+import writes chunks of rows, each chunk one transaction (through
+writer.write, so other users' saves get in between chunks). A chunk is
+sized to hold the write lock for about CHUNK_MS: the size follows how
+long the previous chunks took, up to CHUNK_SIZE rows. What a chunk needs
+to know (existing sessions, archived ones, current records) is read with
+a few set-based queries, not per session.
+Memory stays constant in the number of rows.
+
+Dates are written and read as server local time ('%Y-%m-%d %H:%M:%S').
+Importing the same file twice does not duplicate sessions: a session
+(exercise + time) that already existed before the import is skipped.
+"""
+import csv
+import heapq
+import io
+import itertools
+import json
+import os
+import time
+
+import archive
+import logbook
+import parser
+import records
+import writer
+
+CHUNK_SIZE = int(os.getenv("GYMBRO_IMPORT_CHUNK", "5000"))  # most rows per transaction
+CHUNK_MS = float(os.getenv("GYMBRO_IMPORT_CHUNK_MS", "50"))  # write lock hold per chunk
+FIRST_CHUNK = 200
+MIN_CHUNK = 20
+FORMATS = ("csv", "jsonl")
+FIELDS = ("day", "exercise", "date", "reps", "weight")
+
+# how many bad rows are described in the import report
+MAX_REPORTED_ERRORS = 10
+
+EXPORT_QUERY = (
+    "SELECT e.exercise_id, d.day_name, e.exercise_name, s.started_at, l.reps, l.weight "
+    "FROM TrainingDays d "
+    "LEFT JOIN Exercises e ON e.day_id = d.day_id "
+    "LEFT JOIN Sessions s ON s.exercise_id = e.exercise_id "
+    "LEFT JOIN Logs l ON l.session_id = s.session_id "
+    "WHERE d.user_id = ? AND d.deleted_at IS NULL "
+    # the sort only ever holds one session (see the plan: RIGHT PART OF ORDER BY)
+    "ORDER BY d.day_id, e.exercise_id, s.started_at, s.session_id, l.log_id"
+)
+
+
+def guess_format(name, default="csv"):
+    name = (name or "").lower()
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith(".csv"):
+        return "csv"
+    return default
+
+
+# --- export ---
+
+def _fetched(cursor, fetch_size):
+    while True:
+        rows = cursor.fetchmany(fetch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def export_rows(conn, user_id, fetch_size=1000):
+    """Yield (day, exercise, date, reps, weight) for every set of a user."""
+    cursor = conn.execute(EXPORT_QUERY, (user_id,))
+    rows = _fetched(cursor, fetch_size)
+    for (exercise_id, day, exercise), group in itertools.groupby(rows, key=lambda row: row[:3]):
+        sets = (row[3:] for row in group)
+        cold = exercise_id is not None and archive.exercise_sets(conn, exercise_id)
+        if cold:
+            # archived sets merged in by time; an exercise with nothing hot
+            # left comes with one empty row, dropped here
+            hot = (found for found in sets if found[0] is not None)
+            sets = heapq.merge(cold, hot, key=lambda found: found[0])
+        for started_at, reps, weight in sets:
+            date = None if started_at is None else logbook.format_date(started_at)
+            yield day, exercise, date, reps, weight
+
+
+def write_rows(rows, out, fmt="csv"):
+    """Write rows to a text stream. Returns the number of rows written."""
+    count = 0
+    if fmt == "csv":
+        csv_writer = csv.writer(out)
+        csv_writer.writerow(FIELDS)
+        for day, exercise, date, reps, weight in rows:
+            csv_writer.writerow((day, exercise or "", date or "", "" if reps is None else reps,
+                                 "" if weight is None else logbook.format_weight(weight)))
+            count += 1
+    elif fmt == "jsonl":
+        for row in rows:
+            out.write(json.dumps(dict(zip(FIELDS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+    return count
+
+
+def export_user(conn, user_id, out, fmt="csv"):
+    return write_rows(export_rows(conn, user_id), out, fmt)
+
+
+# --- import ---
+
+def read_rows(stream, fmt="csv"):
+    """Yield (line number, record dict) from a text stream."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        missing = {"day", "exercise"} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"в CSV нет колонок: {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_no, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"unknown format {fmt!r}")
+
+
+def parse_record(record):
+    """
+    record dict -> (day, exercise, started_at, reps, weight), started_at in
+    unix seconds; started_at/reps/weight may be None.
+    """
+    if record is None:
+        raise ValueError("не JSON-объект")
+    day = str(record.get("day") or "").strip()
+    exercise = str(record.get("exercise") or "").strip()
+    if not day:
+        raise ValueError("пустой день")
+
+    date = str(record.get("date") or "").strip()
+    reps = record.get("reps")
+    weight = record.get("weight")
+    if not date and reps in (None, "") and weight in (None, ""):
+        # just the day / exercise
+        return day, exercise or None, None, None, None
+    if not exercise:
+        raise ValueError("пустое упражнение")
+
+    if len(date) == 10:
+        date += " 00:00:00"
+    try:
+        started_at = logbook.parse_date(date)
+    except (ValueError, OverflowError, OSError):
+        raise ValueError(f"дата {date!r} не в формате ГГГГ-ММ-ДД[ ЧЧ:ММ:СС]") from None
+    try:
+        # the same limits as sets typed into the chat (nan, inf, 1e9 kg...)
+        return (day, exercise, started_at, parser.parse_reps(str(reps).strip()),
+                parser.parse_weight(str(weight).strip()))
+    except ValueError as e:
+        raise ValueError(f"подходы/вес {reps!r}, {weight!r}: {e}") from None
+
+
+def _existing_sessions(conn, sessions, batch=400):
+    """{(exercise_id, started_at): first session_id} of those of `sessions` in Sessions."""
+    found = {}
+    for i in range(0, len(sessions), batch):
+        part = sessions[i:i + batch]
+        for ex, started_at, session_id in conn.execute(
+                "WITH wanted (exercise_id, started_at) AS (VALUES "
+                + ",".join(["(?, ?)"] * len(part)) + ") "
+                "SELECT s.exercise_id, s.started_at, s.session_id FROM wanted w "
+                "JOIN Sessions s ON s.exercise_id = w.exercise_id AND s.started_at = w.started_at",
+                [value for key in part for value in key]):
+            key = (ex, started_at)
+            if key not in found or session_id < found[key]:
+                found[key] = session_id
+    return found
+
+
+def _refresh_summaries(conn, new_sessions):
+    """Rebuild the summaries the new sessions change: only newer than the summary's previous one."""
+    newest = {}
+    for ex, started_at, _, _ in new_sessions:
+        newest[ex] = max(started_at, newest.get(ex, started_at))
+    if not newest:
+        return
+    placeholders = ",".join("?" * len(newest))
+    previous = dict(conn.execute(
+        "SELECT exercise_id, prev_at FROM ExerciseSummary "
+        f"WHERE exercise_id IN ({placeholders})",
+        list(newest)))
+    for ex, started_at in newest.items():
+        prev_at = previous.get(ex)
+        # the summary shows the last two sessions, older history doesn't touch it
+        if prev_at is None or started_at >= prev_at:
+            logbook.rebuild_summary(conn, ex)
+
+
+def _import_chunk(conn, user_id, rows, days, exercises, before_session_id):
+    """
+    One transaction: create missing days/exercises, insert the sets of
+    sessions that did not exist before the import, refresh summaries and
+    personal records.
+    Returns (new days, new exercises, inserted sets, skipped sets).
+    """
+    new_days = {}
+    new_exercises = {}
+
+    def day_id(name):
+        found = days.get(name) or new_days.get(name)
+        if found is None:
+            found = new_days[name] = conn.execute(
+                "INSERT INTO TrainingDays (user_id, day_name) VALUES (?, ?)", (user_id, name)
+            ).lastrowid
+        return found
+
+    def exercise_id(day, name):
+        key = (day, name)
+        found = exercises.get(key) or new_exercises.get(key)
+        if found is None:
+            found = new_exercises[key] = conn.execute(
+                "INSERT INTO Exercises (day_id, exercise_name) VALUES (?, ?)", (day, name)
+            ).lastrowid
+        return found
+
+    # the chunk's sets per session, in file order
+    sessions = {}
+    for day, exercise, started_at, reps, weight in rows:
+        d = day_id(day)
+        if exercise is None:
+            continue
+        ex = exercise_id(d, exercise)
+        if started_at is not None:
+            sessions.setdefault((ex, started_at), []).append((reps, weight))
+
+    # what already exists, a few set-based queries for the whole chunk
+    found = _existing_sessions(conn, list(sessions))
+    cold = archive.archived(conn, [key for key in sessions if key not in found])
+
+    inserted = skipped = 0
+    continued = []
+    new_records = []
+    for (ex, started_at), session_sets in sessions.items():
+        session_id = found.get((ex, started_at))
+        if session_id is not None and session_id <= before_session_id or (
+                (ex, started_at) in cold):
+            # already there before this import started (maybe archived)
+            skipped += len(session_sets)
+            continue
+        if session_id is not None:
+            # begun by an earlier chunk of this same import
+            continued.append(session_id)
+        else:
+            session_id = conn.execute(
+                "INSERT INTO Sessions (exercise_id, started_at) VALUES (?, ?)", (ex, started_at)
+            ).lastrowid
+        conn.executemany(
+            "INSERT INTO Logs (session_id, reps, weight) VALUES (?, ?, ?)",
+            [(session_id, reps, weight) for reps, weight in session_sets]
+        )
+        new_records.append((ex, started_at, session_sets, session_id))
+        inserted += len(session_sets)
+
+    volumes = {}
+    if continued:
+        placeholders = ",".join("?" * len(continued))
+        volumes = dict(conn.execute(
+            "SELECT session_id, sum(reps * weight) FROM Logs "
+            f"WHERE session_id IN ({placeholders}) GROUP BY session_id",
+            continued))
+    records.update_many(conn, [(ex, started_at, session_sets, volumes.get(session_id))
+                               for ex, started_at, session_sets, session_id in new_records])
+    _refresh_summaries(conn, new_records)
+    return new_days, new_exercises, inserted, skipped
+
+
+def import_rows(conn, user_id, records, chunk_size=CHUNK_SIZE, write=None, chunk_ms=CHUNK_MS):
+    """
+    Import (line number, record) pairs (see read_rows) for a user.
+    `conn` is only read from; chunks of up to `chunk_size` rows, about
+    `chunk_ms` each, are written with `write` (writer.write by default).
+    Returns a report dict.
+    """
+    write = write or writer.write
+    days = dict((name, day_id) for day_id, name in conn.execute(
+        "SELECT day_id, day_name FROM TrainingDays WHERE user_id = ? AND deleted_at IS NULL",
+        (user_id,)))
+    exercises = {}
+    for day_id in set(days.values()):
+        for ex_id, name in conn.execute(
+                "SELECT exercise_id, exercise_name FROM Exercises WHERE day_id = ?", (day_id,)):
+            exercises[(day_id, name)] = ex_id
+    before_session_id = conn.execute("SELECT max(session_id) FROM Sessions").fetchone()[0] or 0
+    conn.commit()  # don't keep a read snapshot open while the writer works
+
+    report = {"rows": 0, "inserted": 0, "skipped_existing": 0, "errors": 0,
+              "error_lines": [], "days_created": 0, "exercises_created": 0}
+
+    size = min(chunk_size, FIRST_CHUNK)
+
+    def flush(chunk):
+        nonlocal size
+        started = time.perf_counter()
+        new_days, new_exercises, inserted, skipped = write(
+            _import_chunk, user_id, chunk, days, exercises, before_session_id, rows=len(chunk))
+        # rows that fit in chunk_ms at this chunk's pace, at most twice as many as now
+        elapsed = max(time.perf_counter() - started, 0.001)
+        size = max(MIN_CHUNK, min(chunk_size, size * 2,
+                                  int(len(chunk) * chunk_ms / 1000 / elapsed)))
+        days.update(new_days)
+        exercises.update(new_exercises)
+        report["days_created"] += len(new_days)
+        report["exercises_created"] += len(new_exercises)
+        report["inserted"] += inserted
+        report["skipped_existing"] += skipped
+
+    chunk = []
+    for line_no, record in records:
+        report["rows"] += 1
+        try:
+            chunk.append(parse_record(record))
+        except (ValueError, TypeError) as e:
+            report["errors"] += 1
+            if len(report["error_lines"]) < MAX_REPORTED_ERRORS:
+                report["error_lines"].append(f"строка {line_no}: {e}")
+            continue
+        if len(chunk) >= size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return report
+
+
+def import_user(conn, user_id, stream, fmt="csv", chunk_size=CHUNK_SIZE, write=None,
+                chunk_ms=CHUNK_MS):
+    return import_rows(conn, user_id, read_rows(stream, fmt), chunk_size, write, chunk_ms)
+
+
+def open_telegram_file(token, file_path):
+    """Stream a file from the Bot API as text, without loading it all."""
+    from telebot import apihelper
+
+    url = (apihelper.FILE_URL or "https://api.telegram.org/file/bot{0}/{1}").format(
+        token, file_path)
+    response = apihelper._get_req_session().get(
+        url, stream=True, proxies=apihelper.proxy, timeout=apihelper.READ_TIMEOUT)
+    response.raise_for_status()
+    response.raw.decode_content = True
+    # urllib3 closes the stream at the end of the body, TextIOWrapper
+    # would then fail on its last read
+    response.raw.auto_close = False
+    # utf-8-sig: spreadsheets like to start CSVs with a BOM
+    return io.TextIOWrapper(response.raw, encoding="utf-8-sig", newline="")
@@ -0,0 +1,222 @@
+"""
+Webhook ingestion server.
+
+Telegram (or a proxy in front of it) POSTs updates here, either one
+update object or a JSON list of them. The secret token header is checked,
+the updates are queued and the request is answered right away;
+processing happens on a pool of worker threads.
+
+Without GYMBRO_WEBHOOK_SECRET a random secret is made at start and sent
+to setWebhook with the URL, so the header is always checked; a webhook
+registered by hand (no --webhook-url) needs the secret set.
+
+Updates are partitioned across workers by user id, so one user's updates
+are still handled in order. When too many updates are waiting the server
+answers 503 and Telegram redelivers later (backpressure).
+"""
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HOST = os.getenv("GYMBRO_WEBHOOK_HOST", "127.0.0.1")
+PORT = int(os.getenv("GYMBRO_WEBHOOK_PORT", "8443"))
+PATH = os.getenv("GYMBRO_WEBHOOK_PATH", "/webhook")
+SECRET = os.getenv("GYMBRO_WEBHOOK_SECRET")
+WORKERS = int(os.getenv("GYMBRO_WEBHOOK_WORKERS", "8"))
+MAX_PENDING = int(os.getenv("GYMBRO_WEBHOOK_MAX_PENDING", "5000"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_user_id(update):
+    """Same key as aio.update_user_id, but on the raw update dict."""
+    for kind in ("message", "edited_message", "callback_query"):
+        event = update.get(kind)
+        if event and "from" in event:
+            return event["from"]["id"]
+    return update.get("update_id", 0)
+
+
+class WebhookServer:
+    """
+    HTTP server that feeds `handle(update_dict)` from a worker pool.
+
+    `max_pending` caps updates accepted but not yet handled; a batch that
+    does not fit is refused as a whole so nothing is processed twice.
+    """
+
+    def __init__(self, handle, host=HOST, port=PORT, path=PATH, secret=SECRET,
+                 workers=WORKERS, max_pending=MAX_PENDING):
+        self.handle = handle
+        self.path = path
+        # never serve unauthenticated, run() hands a made-up one to setWebhook
+        self.secret = secret or secrets.token_urlsafe(32)
+        self.max_pending = max_pending
+        self._queues = [queue.SimpleQueue() for _ in range(workers)]
+        self._workers = []
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._drained = threading.Condition(self._lock)
+
+        # stats
+        self.accepted = 0
+        self.rejected = 0
+        self.unauthorized = 0
+        self.processed = 0
+        self.failed = 0
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                # headers and body are separate writes, don't let Nagle hold the body
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def do_POST(self):
+                status = server._receive(self)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self._serve_thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}{self.path}"
+
+    def _receive(self, request):
+        if request.path != self.path:
+            return 404
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            with self._lock:
+                self.unauthorized += 1
+            return 403
+
+        try:
+            length = int(request.headers.get("Content-Length") or 0)
+        except ValueError:
+            return 400
+        # read(-1) would wait for the client to close the connection
+        if length < 0:
+            return 400
+        try:
+            payload = json.loads(request.rfile.read(length))
+        except ValueError:
+            return 400
+        updates = payload if isinstance(payload, list) else [payload]
+        try:
+            # before any slot is reserved: a bad item refuses the whole batch
+            queues = [hash(update_user_id(update)) % len(self._queues) for update in updates]
+        except (AttributeError, TypeError, KeyError):
+            return 400
+
+        with self._lock:
+            if self._pending + len(updates) > self.max_pending:
+                self.rejected += len(updates)
+                return 503
+            self._pending += len(updates)
+            self.accepted += len(updates)
+
+        for update, index in zip(updates, queues):
+            self._queues[index].put(update)
+        return 200
+
+    def _work(self, updates):
+        while True:
+            update = updates.get()
+            if update is None:
+                return
+            try:
+                self.handle(update)
+                ok = True
+            except Exception as e:
+                print(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+                ok = False
+            with self._lock:
+                self._pending -= 1
+                if ok:
+                    self.processed += 1
+                else:
+                    self.failed += 1
+                if not self._pending:
+                    self._drained.notify_all()
+
+    def start(self):
+        for i, updates in enumerate(self._queues):
+            t = threading.Thread(target=self._work, args=(updates,), name=f"webhook-{i}", daemon=True)
+            t.start()
+            self._workers.append(t)
+        self._serve_thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._serve_thread.start()
+        return self
+
+    def join(self, timeout=None):
+        """Wait until every accepted update has been handled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._drained.wait(remaining)
+        return True
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for updates in self._queues:
+            updates.put(None)
+        for t in self._workers:
+            t.join()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "unauthorized": self.unauthorized,
+                "processed": self.processed,
+                "failed": self.failed,
+            }
+
+
+def run(bot, public_url=None, **kwargs):
+    """Serve `bot`'s handlers over a webhook until interrupted."""
+    from telebot import types
+
+    # handlers run inline on our workers, not in telebot's own pool
+    bot.threaded = False
+    if not public_url and not SECRET:
+        print("Ошибка: без --webhook-url нужен GYMBRO_WEBHOOK_SECRET "
+              "(тот же, что передан в setWebhook).")
+        return
+    server = WebhookServer(lambda u: bot.process_new_updates([types.Update.de_json(u)]), **kwargs)
+    if public_url:
+        bot.set_webhook(url=public_url, secret_token=server.secret,
+                        max_connections=len(server._queues))
+    server.start()
+    print(f"Webhook слушает {server.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(f"Webhook stats: {server.stats()}")
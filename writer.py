@@ -0,0 +1,242 @@
+"""
+Group-commit write-behind queue.
+
+Handlers submit small write jobs; one writer thread runs many of them
+(from many users) inside a single transaction, so the fsync cost is paid
+once per batch instead of once per message. Each job gets a Future that
+resolves only after its batch is committed.
+
+The queue is off by default, enable it with GYMBRO_WRITE_BEHIND=1.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import db
+
+ENABLED = os.getenv("GYMBRO_WRITE_BEHIND") == "1"
+# 0 = commit as soon as the writer is free with whatever queued up meanwhile
+MAX_DELAY_MS = float(os.getenv("GYMBRO_WRITE_DELAY_MS", "0"))
+MAX_BATCH_ROWS = int(os.getenv("GYMBRO_WRITE_BATCH_ROWS", "500"))
+MAX_QUEUE = int(os.getenv("GYMBRO_WRITE_QUEUE", "10000"))
+
+
+class WriterBusy(sqlite3.OperationalError):
+    """The write queue stayed full for longer than the submit timeout."""
+
+
+class _Job:
+    __slots__ = ("func", "args", "rows", "future")
+
+    def __init__(self, func, args, rows):
+        self.func = func
+        self.args = args
+        self.rows = rows
+        self.future = Future()
+
+
+_STOP = object()
+
+
+class WriteBehindWriter:
+    """
+    Single writer thread fed by a bounded queue.
+
+    A batch is committed when it holds `max_batch_rows` rows, when
+    `max_delay` seconds have passed since its first job arrived, or (with
+    no delay) as soon as the queue runs dry - callers that wait on their
+    futures pile up while the previous batch commits. A job that would
+    take a batch past `max_batch_rows` (an import chunk) starts the next
+    one instead, so small writes queued before it don't wait for it.
+    """
+
+    def __init__(self, pool=None, max_delay=MAX_DELAY_MS / 1000,
+                 max_batch_rows=MAX_BATCH_ROWS, max_queue=MAX_QUEUE):
+        self.pool = pool or db.pool
+        self.max_delay = max_delay
+        self.max_batch_rows = max_batch_rows
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._carry = None  # job held over for the next batch
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # stats
+        self._batches = 0
+        self._jobs = 0
+        self._rows = 0
+        self._failed = 0
+        self._commit_time = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, func, *args, rows=1, timeout=5.0):
+        """
+        Queue `func(conn, *args)` for the next batch. Returns a Future with
+        its return value, resolved after the batch is committed.
+        """
+        if self._thread is None:
+            self.start()
+        job = _Job(func, args, rows)
+        try:
+            self._queue.put(job, timeout=timeout)
+        except queue.Full:
+            raise WriterBusy(f"write queue is full ({self._queue.maxsize} jobs)")
+        return job.future
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far is committed."""
+        self.submit(lambda conn: None, rows=0, timeout=timeout).result(timeout)
+
+    def close(self, timeout=10.0):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _collect(self):
+        """
+        Wait for the first job, then take everything already queued. With
+        max_delay > 0 keep waiting for stragglers until the batch is full or
+        the delay since the first job has passed.
+        """
+        first = self._carry if self._carry is not None else self._queue.get()
+        self._carry = None
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        rows = first.rows
+        deadline = time.monotonic() + self.max_delay
+        while rows < self.max_batch_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    job = self._queue.get(timeout=remaining)
+                else:
+                    job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return batch, True
+            if rows + job.rows > self.max_batch_rows:
+                self._carry = job
+                break
+            batch.append(job)
+            rows += job.rows
+        return batch, False
+
+    def _drain(self):
+        jobs = []
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                return jobs
+            if job is not _STOP:
+                jobs.append(job)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._collect()
+            if stopping:
+                # on shutdown commit whatever is still queued
+                batch += self._drain()
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        results = []
+        try:
+            with self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                for job in batch:
+                    # a failing job must not take the rest of the batch with it
+                    conn.execute("SAVEPOINT job")
+                    try:
+                        results.append((True, job.func(conn, *job.args)))
+                        conn.execute("RELEASE job")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO job")
+                        conn.execute("RELEASE job")
+                        results.append((False, e))
+                conn.commit()
+        except Exception as e:
+            for job in batch:
+                job.future.set_exception(e)
+            with self._lock:
+                self._failed += len(batch)
+            return
+
+        elapsed = time.perf_counter() - started
+        failed = 0
+        for job, (ok, value) in zip(batch, results):
+            if ok:
+                job.future.set_result(value)
+            else:
+                failed += 1
+                job.future.set_exception(value)
+        with self._lock:
+            self._batches += 1
+            self._jobs += len(batch)
+            self._rows += sum(job.rows for job in batch)
+            self._failed += failed
+            self._commit_time += elapsed
+
+    def stats(self):
+        with self._lock:
+            batches = self._batches
+            return {
+                "queued": self._queue.qsize(),
+                "batches": batches,
+                "jobs": self._jobs,
+                "rows": self._rows,
+                "failed": self._failed,
+                "avg_batch_jobs": self._jobs / batches if batches else 0.0,
+                "avg_commit_time": self._commit_time / batches if batches else 0.0,
+            }
+
+
+writer = WriteBehindWriter() if ENABLED else None
+# without the queue: one write at a time from this process, waiters sleep
+# on this lock instead of sqlite's busy handler (which backs off up to 100ms)
+_direct = threading.Lock()
+
+
+def start():
+    if writer is not None:
+        writer.start()
+
+
+def stop():
+    if writer is not None:
+        writer.close()
+
+
+def write(func, *args, rows=1):
+    """
+    Run `func(conn, *args)` durably and return its result.
+    Goes through the group-commit queue when it is enabled.
+    """
+    if writer is not None:
+        return writer.submit(func, *args, rows=rows).result()
+
+    with _direct, db.connection() as conn:
+        try:
+            result = func(conn, *args)
+        except Exception:
+            # all or nothing, like a job in the queue
+            conn.rollback()
+            raise
+        conn.commit()
+        return result